@@ -0,0 +1,90 @@
+"""
+Сравнение способов получения эталонных фонем eSpeak NG для фраз блока аудирования.
+
+Режимы:
+  • subprocess_per_word — как было раньше в analyze_word_errors: отдельный процесс
+    espeak-ng на фразу и по два на каждое слово;
+  • library_per_word — те же вызовы, но через libespeak-ng внутри процесса;
+  • library_batch — одна пакетная фонемизация фразы и всех её слов.
+Кэш транскрипций (bot/phoneme_cache.py) здесь не используется — меряется сама фонемизация.
+
+Запуск:
+    python benchmarks/espeak_phonemizer.py --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DATA_PATH, ESPEAK_VOICE
+from bot.phonemizer import phonemizer, _run_espeak_subprocess
+
+
+def _preprocess(text: str) -> List[str]:
+    from bot.utils import _preprocess_text_for_phoneme_splitting
+    return _preprocess_text_for_phoneme_splitting(text).split()
+
+
+def subprocess_per_word(phrase: str):
+    _run_espeak_subprocess(phrase, ESPEAK_VOICE)
+    for word in _preprocess(phrase):
+        _run_espeak_subprocess(word, ESPEAK_VOICE)
+        _run_espeak_subprocess(word, ESPEAK_VOICE)
+
+
+def library_per_word(phrase: str):
+    phonemizer.phonemize(phrase)
+    for word in _preprocess(phrase):
+        phonemizer.phonemize(word)
+        phonemizer.phonemize(word)
+
+
+def library_batch(phrase: str):
+    phonemizer.phonemize_batch([phrase] + _preprocess(phrase))
+
+
+def _measure(func: Callable[[str], None], phrases: List[str], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        for phrase in phrases:
+            started = time.perf_counter()
+            func(phrase)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк фонемизации eSpeak NG")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(os.path.join(DATA_PATH, "listening_phrases_it.json"), 'r', encoding='utf-8') as f:
+        phrases = [item["phrase"] for item in json.load(f)]
+
+    modes = [("subprocess_per_word", subprocess_per_word)]
+    if phonemizer.backend == "library":
+        modes += [("library_per_word", library_per_word), ("library_batch", library_batch)]
+        # Проверяем, что библиотека даёт те же транскрипции, что и командная строка
+        mismatches = [
+            phrase for phrase in phrases
+            if phonemizer.phonemize(phrase).split() != _run_espeak_subprocess(phrase, ESPEAK_VOICE).split()
+        ]
+        print(f"Совпадение с espeak-ng --ipa: {len(phrases) - len(mismatches)}/{len(phrases)} фраз")
+    else:
+        print("libespeak-ng не найдена — доступен только режим subprocess_per_word")
+
+    print(f"eSpeak NG {phonemizer.version}, фраз: {len(phrases)}, повторов: {args.repeat}\n")
+    print(f"{'режим':>22} | {'среднее, мс':>12} | {'p95, мс':>10}")
+    for name, func in modes:
+        timings = sorted(_measure(func, phrases, args.repeat))
+        p95 = timings[min(len(timings) - 1, int(0.95 * len(timings)))]
+        print(f"{name:>22} | {statistics.mean(timings):>12.2f} | {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Сравнение пословного выравнивания фонем: прежний вариант analyze_word_errors
+(SequenceMatcher по фразе → пропорциональная нарезка по словам → SequenceMatcher по слову)
+против bot/phoneme_alignment.py (одно взвешенное выравнивание Needleman–Wunsch на NumPy).
+
+Эталонные фонемы берутся из фраз блока аудирования (eSpeak NG), «произнесённые» получаются
+из них случайными заменами (чаще на похожие фонемы), пропусками и вставками. Поскольку
+для каждой искажённой фонемы известно, из какого слова она пришла, кроме скорости
+меряется и точность границ слов: доля фонем пользователя, отнесённых к правильному слову.
+
+Запуск:
+    python benchmarks/phoneme_alignment.py
+    python benchmarks/phoneme_alignment.py --join 4 --error-rate 0.2 --repeat 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from difflib import SequenceMatcher
+from typing import List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DATA_PATH
+from bot import phoneme_alignment
+from bot.phoneme_alignment import similar_groups
+
+
+def legacy_word_alignment(words_phonemes: List[str], user_flat: str) -> List[List[int]]:
+    """
+    Ядро прежнего analyze_word_errors: для каждого слова — индексы фонем пользователя,
+    которые ему достались, плюс пословный SequenceMatcher (ради честного сравнения скорости).
+    """
+    orig_flat = "".join(words_phonemes)
+    boundaries = []
+    position = 0
+    for word_ph in words_phonemes:
+        boundaries.append((position, position + len(word_ph)))
+        position += len(word_ph)
+
+    alignment = SequenceMatcher(None, orig_flat, user_flat).get_opcodes()
+    assigned = []
+    for start, end in boundaries:
+        indices = []
+        for tag, i1, i2, j1, j2 in alignment:
+            if i2 <= start:
+                continue
+            if i1 >= end:
+                break
+            clip_start, clip_end = max(i1, start), min(i2, end)
+            if clip_end <= clip_start:
+                continue
+            ratio_in_block = (clip_end - clip_start) / (i2 - i1) if (i2 - i1) > 0 else 0
+            segment = int((j2 - j1) * ratio_in_block)
+            if tag in ('equal', 'replace'):
+                indices.extend(range(j1, j1 + segment))
+            elif tag == 'insert' and start <= i1 < end:
+                indices.extend(range(j1, j2))
+        detected = "".join(user_flat[j] for j in indices)
+        SequenceMatcher(None, orig_flat[start:end], detected).get_opcodes()
+        assigned.append(indices)
+    return assigned
+
+
+def engine_word_alignment(words_phonemes: List[str], user_flat: str) -> List[List[int]]:
+    steps = phoneme_alignment.align("".join(words_phonemes), user_flat)
+    per_word = phoneme_alignment.split_by_words(steps, [len(word_ph) for word_ph in words_phonemes])
+    for word_steps in per_word:
+        phoneme_alignment.runs(word_steps)
+    return [[j for _, _, j in word_steps if j is not None] for word_steps in per_word]
+
+
+def corrupt(words_phonemes: List[str], error_rate: float, rng: random.Random) -> Tuple[str, List[int]]:
+    """Искажает эталон; возвращает строку пользователя и номер слова для каждой её фонемы."""
+    similar = {}
+    for group in similar_groups:
+        for phoneme in group:
+            if len(phoneme) == 1:
+                similar.setdefault(phoneme, []).extend(p for p in group if len(p) == 1 and p != phoneme)
+    alphabet = sorted(set("".join(words_phonemes)))
+
+    user, owners = [], []
+    for word_idx, word_ph in enumerate(words_phonemes):
+        for phoneme in word_ph:
+            roll = rng.random()
+            if roll < error_rate / 3:
+                continue  # пропуск
+            if roll < 2 * error_rate / 3:
+                phoneme = rng.choice(similar.get(phoneme) or alphabet)  # замена
+            user.append(phoneme)
+            owners.append(word_idx)
+            if rng.random() < error_rate / 3:
+                user.append(rng.choice(alphabet))  # вставка
+                owners.append(word_idx)
+    return "".join(user), owners
+
+
+def boundary_accuracy(assigned: List[List[int]], owners: List[int]) -> float:
+    correct = sum(1 for word_idx, indices in enumerate(assigned) for j in indices if owners[j] == word_idx)
+    return correct / len(owners) if owners else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пословного выравнивания фонем")
+    parser.add_argument("--join", type=int, default=3, help="Сколько фраз склеивать в одну длинную")
+    parser.add_argument("--error-rate", type=float, default=0.15, help="Доля искажённых фонем")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from bot.utils import text_to_phonemes_simplified, _preprocess_text_for_phoneme_splitting
+
+    with open(os.path.join(DATA_PATH, "listening_phrases_it.json"), 'r', encoding='utf-8') as f:
+        phrases = [item["phrase"] for item in json.load(f)]
+    texts = [" ".join(phrases[i:i + args.join]) for i in range(0, len(phrases), args.join)]
+    cases = []
+    for text in texts:
+        words = _preprocess_text_for_phoneme_splitting(text).split()
+        cases.append([text_to_phonemes_simplified(word) for word in words])
+
+    rng = random.Random(args.seed)
+    corrupted = [corrupt(words_phonemes, args.error_rate, rng) for words_phonemes in cases]
+    mean_length = statistics.mean(len("".join(words_phonemes)) for words_phonemes in cases)
+    print(f"Фраз: {len(cases)}, средняя длина: {mean_length:.0f} фонем, искажений: {args.error_rate:.0%}\n")
+
+    print(f"{'вариант':>12} | {'среднее, мс':>12} | {'p95, мс':>10} | {'границы слов':>13}")
+    for name, func in (("legacy", legacy_word_alignment), ("engine", engine_word_alignment)):
+        timings, accuracies = [], []
+        for _ in range(args.repeat):
+            for words_phonemes, (user_flat, owners) in zip(cases, corrupted):
+                started = time.perf_counter()
+                assigned = func(words_phonemes, user_flat)
+                timings.append((time.perf_counter() - started) * 1000)
+                accuracies.append(boundary_accuracy(assigned, owners))
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(0.95 * len(timings)))]
+        print(f"{name:>12} | {statistics.mean(timings):>12.3f} | {p95:>10.3f} | {statistics.mean(accuracies):>12.1%}")
+
+
+if __name__ == "__main__":
+    main()
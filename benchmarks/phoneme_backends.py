@@ -0,0 +1,140 @@
+"""
+Сравнение бэкендов инференса модели произношения по скорости, памяти и точности.
+
+Каждый бэкенд (torch, torch_int8, onnx) запускается в отдельном процессе,
+распознаёт все записи из media/audio и сравнивается с эталонным torch (fp32):
+точность — это сходство фонем бэкенда с фонемами fp32-модели на той же записи.
+
+Запуск:
+    python benchmarks/phoneme_backends.py
+    python benchmarks/phoneme_backends.py --backends torch onnx --repeat 3 --output backends.csv
+"""
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import AUDIO_PATH
+from bot.phoneme_backends import AVAILABLE_BACKENDS, BACKEND_TORCH
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _run_backend(backend_name: str, audio_files: List[str], repeat: int, threads: int) -> Dict:
+    """Загружает бэкенд и распознаёт все записи (выполняется в отдельном процессе)."""
+    import torch
+    torch.set_num_threads(threads)
+
+    import bot.utils as utils
+
+    started = time.perf_counter()
+    processor, backend = utils.load_phoneme_model(backend_name)
+    # Подменяем модель в модуле, чтобы распознавание шло через тот же код, что и в боте
+    utils._phoneme_model = (processor, backend)
+    load_seconds = time.perf_counter() - started
+
+    transcriptions = {}
+    latencies = []
+    for audio_path in audio_files:
+        waveform = utils._load_waveform_for_model(audio_path)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            transcriptions[audio_path] = utils.phoneme_inventory.to_string(
+                utils._phoneme_ids_from_waveforms([waveform])[0]
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "backend": backend.name,
+        "load_seconds": load_seconds,
+        # ru_maxrss на Linux в килобайтах
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latencies_ms": latencies,
+        "transcriptions": transcriptions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов распознавания фонем")
+    parser.add_argument("--backends", nargs="+", default=list(AVAILABLE_BACKENDS), choices=AVAILABLE_BACKENDS)
+    parser.add_argument("--audio-dir", default=AUDIO_PATH)
+    parser.add_argument("--repeat", type=int, default=1, help="Сколько раз распознавать каждую запись")
+    parser.add_argument("--threads", type=int, default=1, help="Потоков torch/ONNX Runtime на бэкенд")
+    parser.add_argument("--output", help="CSV-файл для сохранения сводной таблицы")
+    args = parser.parse_args()
+
+    audio_files = sorted(
+        path for pattern in ("*.mp3", "*.wav", "*.ogg")
+        for path in glob.glob(os.path.join(args.audio_dir, pattern))
+    )
+    if not audio_files:
+        print(f"В {args.audio_dir} нет аудиофайлов")
+        return
+
+    backends = list(args.backends)
+    if BACKEND_TORCH not in backends:
+        backends.insert(0, BACKEND_TORCH)  # эталон для оценки точности
+
+    results = {}
+    for backend_name in backends:
+        print(f"⏳ {backend_name}: {len(audio_files)} записей...")
+        # Отдельный процесс на бэкенд, чтобы пиковая память не смешивалась
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results[backend_name] = executor.submit(
+                _run_backend, backend_name, audio_files, args.repeat, args.threads
+            ).result()
+
+    from bot.utils import advanced_phoneme_comparison
+
+    reference = results[BACKEND_TORCH]["transcriptions"]
+    rows = []
+    for backend_name in backends:
+        result = results[backend_name]
+        agreement = [
+            advanced_phoneme_comparison(reference[path], result["transcriptions"][path])
+            for path in audio_files
+        ]
+        exact = sum(1 for path in audio_files if reference[path] == result["transcriptions"][path])
+        latencies = result["latencies_ms"]
+        rows.append({
+            "requested": backend_name,
+            "backend": result["backend"],
+            "load_s": round(result["load_seconds"], 2),
+            "peak_rss_mb": round(result["peak_rss_mb"], 1),
+            "mean_ms": round(statistics.mean(latencies), 1),
+            "p50_ms": round(_percentile(latencies, 50), 1),
+            "p95_ms": round(_percentile(latencies, 95), 1),
+            "accuracy_vs_fp32": round(statistics.mean(agreement), 2),
+            "exact_match": f"{exact}/{len(audio_files)}",
+        })
+
+    columns = list(rows[0].keys())
+    print("\n" + " | ".join(f"{column:>16}" for column in columns))
+    for row in rows:
+        print(" | ".join(f"{str(row[column]):>16}" for column in columns))
+
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nСводка сохранена в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Замер пайплайна проверки произношения по стадиям: куда уходит время simple_pronunciation_check.
+
+Каждая запись проходит те же шаги, что и в боте, но каждый шаг замеряется отдельно:
+    decode      — декодирование файла (torchaudio)
+    resample    — моно и ресемплинг до 16 кГц
+    vad         — обрезка тишины и нормализация громкости
+    features    — подготовка входа модели (Wav2Vec2Processor)
+    forward     — проход модели (бэкенд PHONEME_BACKEND, длинные записи — по окнам)
+    ctc_decode  — argmax и CTC-декодирование в строку IPA
+    espeak      — эталонная транскрипция фразы и её слов через eSpeak NG (без кэша)
+    normalize   — нормализация фонем и перевод в массивы ID (эталон и распознанное)
+    alignment   — пословное выравнивание и разбор ошибок (analyze_word_errors)
+    worker      — всё вместе внутри воркера
+    end_to_end  — от отправки записи в пул до результата (включая ожидание в очереди)
+
+Записи — media/audio (*.mp3, *.wav, *.ogg) и синтетические клипы разной длины
+(в том числе длиннее INFERENCE_CHUNK_SECONDS, чтобы задеть распознавание по окнам).
+Для каждого уровня параллельности (по умолчанию 1, 4, 16) столько же клиентов
+одновременно отправляют записи в пул из --workers процессов (как INFERENCE_WORKERS в боте).
+Для каждой стадии выводятся p50/p95/p99 в миллисекундах и пиковый RSS процесса-воркера.
+
+Сводку можно сохранить (--output) и сравнить с ней следующий прогон (--baseline),
+чтобы проверить, что оптимизация действительно ускоряет нужную стадию.
+
+Запуск:
+    python benchmarks/pronunciation_pipeline.py
+    python benchmarks/pronunciation_pipeline.py --concurrency 1 4 --requests 32 --output baseline.csv
+    python benchmarks/pronunciation_pipeline.py --baseline baseline.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import AUDIO_PATH, DATA_PATH, INFERENCE_WORKERS
+
+STAGES = ("decode", "resample", "vad", "features", "forward", "ctc_decode",
+          "espeak", "normalize", "alignment", "worker", "end_to_end")
+
+# Файлы вида *_1a2b3c4d.mp3 — копии тех же записей с хэшем в имени
+_HASHED_NAME_RE = re.compile(r'_[0-9a-f]{8}$')
+_NAME_PREFIX_RE = re.compile(r'^[a-z_]+?_\d+_')
+
+SYNTHETIC_SECONDS = (1.5, 5.0, 15.0)
+SYNTHETIC_SAMPLE_RATE = 48000  # как у голосовых Telegram, чтобы ресемплинг тоже замерялся
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _rss_mb() -> float:
+    """Текущий RSS процесса (Linux: /proc/self/statm), иначе пиковый по getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # ru_maxrss на Linux в килобайтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _StageTimer:
+    """Копит время (мс) и наибольший RSS после каждой стадии."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.rss: Dict[str, float] = {}
+        self._stage = None
+        self._started = 0.0
+
+    def __call__(self, stage: str):
+        self._stage = stage
+        return self
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self._started) * 1000
+        self.timings[self._stage] = self.timings.get(self._stage, 0.0) + elapsed
+        self.rss[self._stage] = max(self.rss.get(self._stage, 0.0), _rss_mb())
+
+
+def _profile_clip(audio_path: str, text: str) -> Dict:
+    """Проводит запись через пайплайн, замеряя каждую стадию (выполняется в воркере)."""
+    import torch
+    import bot.utils as utils
+    from bot import audio_frontend, phoneme_inventory
+    from bot.phonemizer import phonemizer
+    from config import INFERENCE_CHUNK_SECONDS, INFERENCE_CHUNK_STRIDE_SECONDS
+
+    processor, backend = utils.get_phoneme_model()
+    timer = _StageTimer()
+    started = time.perf_counter()
+
+    with timer("decode"):
+        waveform, sample_rate = audio_frontend.decode_audio(audio_path)
+    with timer("resample"):
+        samples = audio_frontend.resample(audio_frontend.to_mono(waveform), sample_rate).numpy()
+    with timer("vad"):
+        start, end, voiced_seconds = audio_frontend.trim_silence(samples)
+        if voiced_seconds == 0:
+            return {"error": audio_frontend.REJECT_SILENT}
+        samples = audio_frontend.normalize_loudness(samples[start:end])
+
+    # Короткая запись — одно окно; длинная — окна с контекстом, как в _iter_long_waveform_logits
+    chunk = int(INFERENCE_CHUNK_SECONDS * audio_frontend.TARGET_SAMPLE_RATE)
+    stride = int(INFERENCE_CHUNK_STRIDE_SECONDS * audio_frontend.TARGET_SAMPLE_RATE)
+    if utils._is_long_waveform(samples):
+        windows = utils._chunk_windows(len(samples), chunk, stride)
+    else:
+        windows = [(0, len(samples), 0, 0)]
+    frame_ids = []
+    for window_start, window_end, left, right in windows:
+        with timer("features"):
+            input_values = processor(samples[window_start:window_end], return_tensors="pt",
+                                     sampling_rate=16000).input_values
+        with timer("forward"):
+            logits = backend.logits(input_values)[0]
+        with timer("ctc_decode"):
+            frames_per_sample = logits.shape[0] / (window_end - window_start)
+            first = int(round(left * frames_per_sample))
+            last = logits.shape[0] - int(round(right * frames_per_sample))
+            frame_ids.append(torch.argmax(logits[first:last], dim=-1))
+    with timer("ctc_decode"):
+        decoded = processor.decode(torch.cat(frame_ids))
+
+    words = utils._preprocess_text_for_phoneme_splitting(text).split()
+    with timer("espeak"):
+        reference = phonemizer.phonemize_batch([text] + words)
+    # Заполняем кэш транскрипций, чтобы analyze_word_errors не обращался к eSpeak NG
+    utils.get_phonemes_batch_from_espeak([text] + words)
+
+    with timer("normalize"):
+        user_ids = phoneme_inventory.tokenize_recognized(decoded)
+        expected_ids = phoneme_inventory.tokenize(reference[0])
+    with timer("alignment"):
+        utils.analyze_word_errors(words, expected_ids, user_ids)
+
+    timer.timings["worker"] = (time.perf_counter() - started) * 1000
+    timer.rss["worker"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"timings": timer.timings, "rss": timer.rss, "error": None}
+
+
+def _known_texts() -> List[str]:
+    texts = []
+    with open(os.path.join(DATA_PATH, "2_pronouncing_words.json"), 'r', encoding='utf-8') as f:
+        texts.extend(item["english"] for item in json.load(f).get("words", []))
+    with open(os.path.join(DATA_PATH, "listening_phrases_it.json"), 'r', encoding='utf-8') as f:
+        texts.extend(item["phrase"] for item in json.load(f))
+    return texts
+
+
+def _text_for_file(path: str, known_texts: List[str]) -> str:
+    """Текст записи по имени файла (pronunciation_3_house.mp3 → house), дополненный по известным фразам."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    text = _NAME_PREFIX_RE.sub("", name).replace("_", " ").strip()
+    for candidate in known_texts:
+        if candidate.lower().startswith(text.lower()):
+            return candidate
+    if len(text) >= 20 and " " in text:
+        # Имя обрезано до 20 символов: последнее слово, скорее всего, неполное
+        text = text.rsplit(" ", 1)[0]
+    return text
+
+
+def _write_synthetic_clip(path: str, seconds: float, seed: int):
+    """Гармонический сигнал с меняющейся огибающей (похож на речь для VAD) и тишиной по краям."""
+    rng = np.random.default_rng(seed)
+    rate = SYNTHETIC_SAMPLE_RATE
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 3 * t), 0, None) ** 0.5
+    signal = 0.3 * voiced * envelope + 0.01 * rng.standard_normal(len(t))
+    silence = np.zeros(int(0.4 * rate))
+    pcm = (np.concatenate([silence, signal, silence]) * 32767).clip(-32768, 32767).astype(np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(pcm.tobytes())
+
+
+def collect_clips(audio_dir: str, synthetic_dir: Optional[str]) -> List[Tuple[str, str]]:
+    """Список (путь, текст): записи из audio_dir и синтетические клипы."""
+    known_texts = _known_texts()
+    clips = []
+    for pattern in ("*.mp3", "*.wav", "*.ogg"):
+        for path in sorted(glob.glob(os.path.join(audio_dir, pattern))):
+            if _HASHED_NAME_RE.search(os.path.splitext(path)[0]):
+                continue
+            text = _text_for_file(path, known_texts)
+            if re.search(r'[a-zA-Z]', text):  # пропускаем записи без текста в имени
+                clips.append((path, text))
+
+    if synthetic_dir:
+        phrases = [text for text in known_texts if " " in text]
+        for idx, seconds in enumerate(SYNTHETIC_SECONDS):
+            path = os.path.join(synthetic_dir, f"synthetic_{seconds:g}s.wav")
+            _write_synthetic_clip(path, seconds, seed=idx)
+            # Текст длиннее для длинных клипов, чтобы выравнивание было сопоставимого размера
+            repeats = max(1, int(seconds // 5))
+            clips.append((path, " ".join(phrases[idx % len(phrases)] for _ in range(repeats))))
+    return clips
+
+
+def _run_level(executor: ProcessPoolExecutor, clips: List[Tuple[str, str]], concurrency: int,
+               requests: int) -> Dict[str, Dict]:
+    """Прогоняет requests записей при concurrency одновременных клиентах; возвращает замеры по стадиям."""
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    rss: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+    errors = []
+
+    def submit_one(idx: int):
+        path, text = clips[idx % len(clips)]
+        started = time.perf_counter()
+        result = executor.submit(_profile_clip, path, text).result()
+        result["end_to_end"] = (time.perf_counter() - started) * 1000
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        for result in clients.map(submit_one, range(requests)):
+            if result["error"]:
+                errors.append(result["error"])
+                continue
+            for stage, value in result["timings"].items():
+                samples[stage].append(value)
+                rss[stage] = max(rss[stage], result["rss"][stage])
+            samples["end_to_end"].append(result["end_to_end"])
+
+    rss["end_to_end"] = rss["worker"]
+    summary = {}
+    for stage in STAGES:
+        summary[stage] = {
+            "count": len(samples[stage]),
+            "p50_ms": round(_percentile(samples[stage], 50), 2),
+            "p95_ms": round(_percentile(samples[stage], 95), 2),
+            "p99_ms": round(_percentile(samples[stage], 99), 2),
+            "peak_rss_mb": round(rss[stage], 1),
+        }
+    if errors:
+        print(f"  отклонено записей: {len(errors)} ({', '.join(sorted(set(errors)))})")
+    return summary
+
+
+def _load_baseline(path: str) -> Dict[Tuple[int, str], Dict[str, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return {(int(row["concurrency"]), row["stage"]): row for row in csv.DictReader(f)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер пайплайна проверки произношения по стадиям")
+    parser.add_argument("--audio-dir", default=AUDIO_PATH)
+    parser.add_argument("--no-synthetic", action="store_true", help="Не добавлять синтетические клипы")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="Записей на каждый уровень параллельности")
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS, help="Процессов в пуле")
+    parser.add_argument("--threads", type=int, default=1, help="Потоков torch на процесс")
+    parser.add_argument("--output", help="CSV-файл для сохранения сводки")
+    parser.add_argument("--baseline", help="CSV прошлого прогона: показать изменение p95 по стадиям")
+    args = parser.parse_args()
+
+    baseline = _load_baseline(args.baseline) if args.baseline else None
+
+    from bot.inference import _init_worker
+
+    rows = []
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        clips = collect_clips(args.audio_dir, None if args.no_synthetic else synthetic_dir)
+        if not clips:
+            print(f"В {args.audio_dir} нет аудиофайлов")
+            return
+        print(f"Записей: {len(clips)}, процессов: {args.workers}, запросов на уровень: {args.requests}")
+
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(args.threads,)
+        ) as executor:
+            # Прогрев: модель загружена, eSpeak NG и ресемплеры инициализированы в каждом воркере
+            list(executor.map(_profile_clip, *zip(*clips[:args.workers])))
+
+            for concurrency in args.concurrency:
+                print(f"\n⏳ Параллельность {concurrency}...")
+                summary = _run_level(executor, clips, concurrency, args.requests)
+                header = f"{'стадия':>12} | {'p50, мс':>9} | {'p95, мс':>9} | {'p99, мс':>9} | {'RSS, МБ':>8}"
+                if baseline:
+                    header += f" | {'p95 было':>9} | {'Δ p95':>7}"
+                print(header)
+                for stage in STAGES:
+                    stats = summary[stage]
+                    line = (f"{stage:>12} | {stats['p50_ms']:>9.1f} | {stats['p95_ms']:>9.1f} | "
+                            f"{stats['p99_ms']:>9.1f} | {stats['peak_rss_mb']:>8.0f}")
+                    previous = baseline.get((concurrency, stage)) if baseline else None
+                    if previous:
+                        before = float(previous["p95_ms"])
+                        change = (stats["p95_ms"] - before) / before if before else 0.0
+                        line += f" | {before:>9.1f} | {change:>+7.0%}"
+                    print(line)
+                    rows.append({"concurrency": concurrency, "stage": stage, **stats})
+
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nСводка сохранена в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
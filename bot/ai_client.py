@@ -0,0 +1,62 @@
+import os
+import sys
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT,
+                    OPENAI_MAX_RETRIES, OPENAI_MAX_CONNECTIONS, OPENAI_KEEPALIVE_CONNECTIONS,
+                    OPENAI_KEEPALIVE_EXPIRY)
+
+# Один клиент OpenAI на процесс: общий пул соединений httpx с keep-alive,
+# поэтому запросы учеников не платят за новое TCP/TLS-соединение и DNS каждый раз.
+# Таймауты заданы явно, повторы ограничены OPENAI_MAX_RETRIES (SDK повторяет
+# 408/429/5xx и ошибки соединения с экспоненциальной задержкой и случайным разбросом).
+# Клиент создаётся в main() при запуске и закрывается при остановке бота;
+# OPENAI_BASE_URL позволяет направить запросы на локальный mock-сервер.
+
+_client: Optional[AsyncOpenAI] = None
+
+
+def create_ai_client() -> AsyncOpenAI:
+    """Создаёт общий клиент (повторный вызов возвращает уже созданный)."""
+    global _client
+    if _client is None:
+        timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+        http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=timeout,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=http_client,
+        )
+        print(f"DEBUG: Клиент OpenAI создан (base_url={_client.base_url}, "
+              f"соединений до {OPENAI_MAX_CONNECTIONS}, повторов {OPENAI_MAX_RETRIES})")
+    return _client
+
+
+def get_ai_client() -> AsyncOpenAI:
+    """
+    Общий клиент OpenAI. Если main() его ещё не создал (скрипты, отдельные вызовы),
+    создаётся при первом обращении.
+    :raises openai.OpenAIError: если не задан OPENAI_API_KEY.
+    """
+    return _client if _client is not None else create_ai_client()
+
+
+async def close_ai_client():
+    """Закрывает пул соединений (при остановке бота)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
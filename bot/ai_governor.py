@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import itertools
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, OPENAI_MAX_CONCURRENT,
+                    OPENAI_QUEUE_TIMEOUT, OPENAI_RATE_LIMIT_PAUSE, OPENAI_METRICS_LOG_INTERVAL)
+
+# Общий планировщик запросов к OpenAI. Каждый AI-помощник из bot/utils.py берёт «слот»:
+#     async with ai_governor.slot(max_tokens=500, messages=messages, priority=PRIORITY_INTERACTIVE) as grant:
+#         response = await client.chat.completions.create(...)
+#         grant.settle(response.usage.total_tokens)
+# Слот выдаётся, когда хватает бюджета запросов и токенов в минуту (OPENAI_RPM_LIMIT,
+# OPENAI_TPM_LIMIT; токены оцениваются по промпту и объявленному max_tokens, после ответа
+# пересчитываются по usage) и есть свободное место среди OPENAI_MAX_CONCURRENT запросов.
+# Ожидающие запросы обслуживаются по приоритету: вопрос учителю раньше фонетических советов.
+# Так при наплыве учеников запросы ждут своей очереди, а не получают 429 от провайдера
+# и не скатываются в заглушки simple_*.
+# Метрики (stats()) пишутся в лог не чаще раза в OPENAI_METRICS_LOG_INTERVAL секунд, пока есть
+# запросы, и сразу — при отказе по таймауту очереди или ответе 429.
+
+PRIORITY_INTERACTIVE = 0  # ученик ждёт ответа в чате (вопросы по грамматике)
+PRIORITY_FEEDBACK = 1     # проверка письма и говорения, транскрипция
+PRIORITY_BACKGROUND = 2   # фоновые советы AI к уже показанному результату (фонетика)
+
+LANE_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_FEEDBACK: "feedback",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class AIQueueTimeoutError(Exception):
+    """Запрос не дождался слота за OPENAI_QUEUE_TIMEOUT секунд."""
+
+
+def estimate_tokens(messages: Optional[List[Dict[str, str]]], max_tokens: int) -> int:
+    """Грубая оценка токенов запроса: ~3 символа на токен промпта плюс объявленный max_tokens."""
+    prompt_chars = sum(len(message.get("content") or "") for message in messages or [])
+    return prompt_chars // 3 + 4 * len(messages or []) + max_tokens
+
+
+class _MinuteBudget:
+    """
+    Бюджет «N в минуту» как ведро: вмещает N единиц и пополняется со скоростью N/60 в секунду.
+    Уровень может уйти в минус, если фактический расход оказался больше оценки.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Через сколько секунд бюджета хватит на amount (0 — уже хватает; лимит не задан — всегда 0)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount: float):
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def available(self) -> Optional[float]:
+        """Остаток бюджета (None — лимит не задан)."""
+        if self.capacity <= 0:
+            return None
+        self._refill()
+        return round(self.level, 1)
+
+
+class AIGrant:
+    """Выданный слот: сколько токенов на него списано и из какой очереди он получен."""
+
+    def __init__(self, governor: "AIGovernor", tokens: int, priority: int, waited: float):
+        self.governor = governor
+        self.tokens = tokens
+        self.priority = priority
+        self.waited = waited
+
+    def settle(self, actual_tokens: Optional[int]):
+        """Уточняет расход токенов по usage ответа (разница возвращается в бюджет или списывается)."""
+        if actual_tokens is None:
+            return
+        difference = self.tokens - actual_tokens
+        if difference > 0:
+            self.governor._tokens.give(difference)
+        elif difference < 0:
+            self.governor._tokens.take(-difference)
+        self.tokens = actual_tokens
+
+
+class AIGovernor:
+    """
+    Приоритетная очередь запросов к OpenAI с бюджетами RPM/TPM и ограничением параллельности.
+    Используется только из event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, rpm: int = OPENAI_RPM_LIMIT, tpm: int = OPENAI_TPM_LIMIT,
+                 max_concurrent: int = OPENAI_MAX_CONCURRENT, queue_timeout: float = OPENAI_QUEUE_TIMEOUT,
+                 rate_limit_pause: float = OPENAI_RATE_LIMIT_PAUSE,
+                 metrics_log_interval: float = OPENAI_METRICS_LOG_INTERVAL):
+        self.max_concurrent = max_concurrent
+        self.metrics_log_interval = metrics_log_interval
+        self.queue_timeout = queue_timeout
+        self.rate_limit_pause = rate_limit_pause
+        self._requests = _MinuteBudget(rpm)
+        self._tokens = _MinuteBudget(tpm)
+        # (приоритет, порядковый номер, токены, future, время постановки в очередь)
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self.active = 0
+        self.granted = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.throttled = 0
+        self._last_metrics_log = 0.0
+        self._wait_total = 0.0
+        self.max_wait = 0.0
+
+    def _pump(self):
+        """Выдаёт слоты ожидающим, пока хватает места и бюджета; иначе ставит таймер на пополнение."""
+        was_throttled = self._timer is not None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            priority, _, tokens, future, queued_at = self._queue[0]
+            if future.done():  # ожидающий ушёл по таймауту или отмене
+                heapq.heappop(self._queue)
+                continue
+            if self.active >= self.max_concurrent:
+                return  # следующий слот выдаст _release
+            wait = max(self._paused_until - time.monotonic(),
+                       self._requests.wait_time(1), self._tokens.wait_time(tokens))
+            if wait > 0:
+                # Строгий приоритет: пока первый в очереди ждёт бюджет, остальные не обгоняют его
+                if not was_throttled:  # новая пауза, а не пересчёт уже идущей
+                    self.throttled += 1
+                    self._log_metrics(f"ждём бюджет {wait:.1f} с")
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+            heapq.heappop(self._queue)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.active += 1
+            self.granted += 1
+            waited = time.monotonic() - queued_at
+            self._wait_total += waited
+            self.max_wait = max(self.max_wait, waited)
+            future.set_result(AIGrant(self, tokens, priority, waited))
+
+    def _release(self, grant: AIGrant):
+        self.active -= 1
+        self._log_metrics("периодический отчёт")
+        self._pump()
+
+    def _log_metrics(self, reason: str, force: bool = False):
+        """Пишет stats() в лог: с force — сразу, иначе не чаще раза в metrics_log_interval секунд."""
+        now = time.monotonic()
+        if not force and (not self.metrics_log_interval
+                          or now - self._last_metrics_log < self.metrics_log_interval):
+            return
+        self._last_metrics_log = now
+        print(f"DEBUG: Планировщик OpenAI ({reason}): {self.stats()}")
+
+    def _rate_limited(self):
+        """Провайдер всё же ответил 429 (например, лимиты делятся с другим сервисом) — пауза в выдаче."""
+        self.rate_limited += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + self.rate_limit_pause)
+        self._log_metrics(f"OpenAI ответил 429, выдача слотов приостановлена на {self.rate_limit_pause} с",
+                          force=True)
+
+    async def _acquire(self, tokens: int, priority: int, queue_timeout: Optional[float] = None) -> AIGrant:
+        queue_timeout = self.queue_timeout if queue_timeout is None else queue_timeout
+        if self._tokens.capacity > 0:
+            tokens = min(tokens, int(self._tokens.capacity))  # иначе запрос не дождётся бюджета никогда
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), tokens, future, time.monotonic()))
+        self._pump()
+        try:
+            grant = await asyncio.wait_for(future, timeout=queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._last_metrics_log = time.monotonic()
+            print(f"ERROR: Запрос к OpenAI ({LANE_NAMES.get(priority, priority)}) не дождался очереди "
+                  f"за {queue_timeout} с: {self.stats()}")
+            raise AIQueueTimeoutError(f"Очередь запросов к OpenAI: ожидание дольше {queue_timeout} с")
+        except asyncio.CancelledError:
+            # Слот мог быть выдан в момент отмены — возвращаем его
+            if future.done() and not future.cancelled():
+                self._release(future.result())
+            raise
+        if grant.waited > 1:
+            print(f"DEBUG: Запрос к OpenAI ({LANE_NAMES.get(priority, priority)}) ждал слот "
+                  f"{grant.waited:.1f} с, очередь: {self.queue_depth()}")
+        return grant
+
+    @asynccontextmanager
+    async def slot(self, max_tokens: int = 0, messages: Optional[List[Dict[str, str]]] = None,
+                   priority: int = PRIORITY_FEEDBACK, queue_timeout: Optional[float] = None) -> AsyncIterator[AIGrant]:
+        """
+        Слот на один запрос к OpenAI на всё время его выполнения (для потокового ответа —
+        до конца потока). Для запросов без токенов (Whisper) max_tokens=0.
+        queue_timeout — своё ограничение ожидания вместо общего OPENAI_QUEUE_TIMEOUT.
+        :raises AIQueueTimeoutError: если слот не выдан за queue_timeout секунд.
+        """
+        grant = await self._acquire(estimate_tokens(messages, max_tokens) if max_tokens else 0, priority,
+                                    queue_timeout)
+        try:
+            yield grant
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                self._rate_limited()
+            raise
+        finally:
+            self._release(grant)
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Число ожидающих запросов по очередям."""
+        depth = {name: 0 for name in LANE_NAMES.values()}
+        for priority, _, _, future, _ in self._queue:
+            if not future.done():
+                name = LANE_NAMES.get(priority, str(priority))
+                depth[name] = depth.get(name, 0) + 1
+        return depth
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """Метрики планировщика: очереди, активные запросы, остаток бюджетов, ожидание."""
+        return {
+            **{f"queued_{name}": count for name, count in self.queue_depth().items()},
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "granted": self.granted,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+            "throttled": self.throttled,
+            "requests_available": self._requests.available(),
+            "tokens_available": self._tokens.available(),
+            "avg_wait_ms": round(1000 * self._wait_total / self.granted, 1) if self.granted else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait, 1),
+        }
+
+
+# Единый планировщик на процесс
+ai_governor = AIGovernor()
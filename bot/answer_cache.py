@@ -0,0 +1,255 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TEACHER_CACHE_FILE, TEACHER_CACHE_SIZE, TEACHER_CACHE_TTL, TEACHER_CACHE_SIMILARITY
+
+# Кэш ответов AI-учителя по грамматике. Ученики одного урока задают почти одинаковые
+# вопросы («когда использовать», «как образуется отрицание»), поэтому ответ ищется в два шага:
+#   1) точное совпадение нормализованного вопроса (регистр, ё/е, пунктуация, пробелы);
+#   2) лексическая близость: TF-IDF по символьным триграммам слов (устойчиво к окончаниям
+#      русских слов) и косинусное сходство не ниже TEACHER_CACHE_SIMILARITY — но только среди
+#      вопросов с теми же «смысловыми метками» (время, отрицание, вид предложения, вспомогательный
+#      глагол): «отрицание в Present Continuous» и «вопрос в Past Simple» похожи на вопросы
+#      про Present Simple по буквам, но ответ на них другой.
+# Записи живут TEACHER_CACHE_TTL секунд, давно не использованные вытесняются,
+# кэш сохраняется на диск и переживает перезапуск бота.
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Нормализованный вопрос: нижний регистр, ё → е, без пунктуации и лишних пробелов."""
+    text = question.lower().replace("ё", "е")
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+# Слова, различающие вопросы с похожим текстом: слово целиком -> метки
+_EXACT_MARKERS = {
+    "не": ("negation",), "нет": ("negation",), "ни": ("negation",), "нельзя": ("negation",),
+    "not": ("negation",), "never": ("negation",), "no": ("negation",),
+    "do": ("do",), "does": ("does",), "did": ("did",),
+    # don't → «don t» после нормализации
+    "don": ("do", "negation"), "doesn": ("does", "negation"), "didn": ("did", "negation"),
+    "am": ("be",), "is": ("be",), "are": ("be",), "be": ("be",),
+    "was": ("was",), "were": ("was",),
+    "will": ("will",), "won": ("will", "negation"),
+    "have": ("have",), "has": ("have",), "had": ("had",),
+}
+# Начало слова -> метка (времена и вид предложения, с учётом русских окончаний)
+_STEM_MARKERS = (
+    ("present", "present"), ("настоящ", "present"),
+    ("past", "past"), ("прошедш", "past"), ("прошл", "past"),
+    ("future", "future"), ("будущ", "future"),
+    ("simple", "simple"), ("прост", "simple"),
+    ("continuous", "continuous"), ("progressive", "continuous"),
+    ("продолженн", "continuous"), ("длительн", "continuous"),
+    ("perfect", "perfect"), ("совершенн", "perfect"), ("завершенн", "perfect"),
+    ("отрица", "negative_form"), ("вопрос", "question_form"), ("утвержд", "affirmative_form"),
+)
+
+
+def question_markers(normalized: str) -> frozenset:
+    """
+    Смысловые метки вопроса: времена, отрицание, вид предложения, вспомогательные глаголы.
+    Похожий вопрос из кэша подходит, только если метки совпадают полностью.
+    """
+    markers = set()
+    for word in normalized.split():
+        markers.update(_EXACT_MARKERS.get(word, ()))
+        for stem, marker in _STEM_MARKERS:
+            if word.startswith(stem):
+                markers.add(marker)
+    return frozenset(markers)
+
+
+def _features(normalized: str) -> Counter:
+    """Символьные триграммы каждого слова с границами: «как» → « ка», «как», «ак »."""
+    features = Counter()
+    for word in normalized.split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            features[padded[i:i + 3]] += 1
+    return features
+
+
+class TeacherAnswerCache:
+    """
+    Кэш «вопрос → ответ» с TTL, LRU-вытеснением и сохранением в JSON.
+    Матрица TF-IDF сохранённых вопросов пересчитывается лениво, после изменения набора
+    вопросов (их сотни, так что это миллисекунды); поиск — одно умножение матрицы на вектор.
+    """
+
+    def __init__(self, path: str = TEACHER_CACHE_FILE, maxsize: int = TEACHER_CACHE_SIZE,
+                 ttl: float = TEACHER_CACHE_TTL, similarity_threshold: float = TEACHER_CACHE_SIMILARITY):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # нормализованный вопрос -> {"question", "answer", "created_at", "last_used"}; порядок — LRU
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = Lock()
+        self._save_lock = Lock()  # записи на диск по очереди: более поздний снимок не затирается ранним
+        self._index: Optional[Tuple[List[str], List[frozenset], Dict[str, int], np.ndarray, np.ndarray]] = None
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"ERROR: Ошибка чтения кэша ответов учителя {self.path}: {e}. Начинаем с пустого кэша.")
+            return
+        now = time.time()
+        for entry in sorted(entries, key=lambda item: item.get("last_used", 0)):
+            if self._expired(entry, now):
+                continue
+            self._entries[normalize_question(entry["question"])] = entry
+        self._trim()
+        print(f"DEBUG: TeacherAnswerCache: загружено {len(self._entries)} ответов из {self.path}")
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return bool(self.ttl) and entry["created_at"] + self.ttl < now
+
+    def _trim(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._index = None
+
+    def _build_index(self):
+        """Метки вопросов, словарь триграмм, IDF и нормированная матрица TF-IDF сохранённых вопросов."""
+        keys = list(self._entries)
+        markers = [question_markers(key) for key in keys]
+        documents = [_features(key) for key in keys]
+        vocabulary: Dict[str, int] = {}
+        for features in documents:
+            for feature in features:
+                vocabulary.setdefault(feature, len(vocabulary))
+        counts = np.zeros((len(keys), len(vocabulary)), dtype=np.float32)
+        for row, features in enumerate(documents):
+            for feature, count in features.items():
+                counts[row, vocabulary[feature]] = 1 + math.log(count)
+        document_frequency = (counts > 0).sum(axis=0)
+        idf = np.log((1 + len(keys)) / (1 + document_frequency)) + 1
+        matrix = counts * idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1)
+        self._index = (keys, markers, vocabulary, idf.astype(np.float32), matrix)
+
+    def _most_similar(self, normalized: str) -> Tuple[Optional[str], float]:
+        if self._index is None:
+            self._build_index()
+        keys, markers, vocabulary, idf, matrix = self._index
+        query_markers = question_markers(normalized)
+        candidates = np.array([entry_markers == query_markers for entry_markers in markers], dtype=bool)
+        if not candidates.any():
+            return None, 0.0
+        # Триграммы, которых нет ни в одном сохранённом вопросе, не попадают в скалярное
+        # произведение, но входят в норму запроса (с наибольшим IDF — как встречающиеся в 0 вопросах):
+        # иначе «сохранённый вопрос + лишние слова» давал бы сходство 1.0
+        unseen_idf = math.log(1 + len(keys)) + 1
+        vector = np.zeros(len(vocabulary), dtype=np.float32)
+        unseen_squares = 0.0
+        for feature, count in _features(normalized).items():
+            column = vocabulary.get(feature)
+            if column is not None:
+                vector[column] = (1 + math.log(count)) * idf[column]
+            else:
+                unseen_squares += ((1 + math.log(count)) * unseen_idf) ** 2
+        norm = math.sqrt(float(vector @ vector) + unseen_squares)
+        if norm == 0:
+            return None, 0.0
+        scores = np.where(candidates, matrix @ (vector / norm), -1.0)
+        best = int(np.argmax(scores))
+        return keys[best], float(scores[best])
+
+    def get(self, question: str) -> Optional[str]:
+        """Ответ на тот же или достаточно похожий вопрос, если он есть и не устарел."""
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        now = time.time()
+        with self._lock:
+            key = normalized if normalized in self._entries else None
+            similarity = 1.0
+            if key is None:
+                key, similarity = self._most_similar(normalized)
+                if similarity < self.similarity_threshold:
+                    key = None
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                self._index = None
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["last_used"] = now
+            self._entries.move_to_end(key)
+            if similarity == 1.0:
+                self.exact_hits += 1
+            else:
+                self.similar_hits += 1
+        print(f"DEBUG: Ответ учителя из кэша (сходство {similarity:.2f}): '{question}' ≈ '{entry['question']}'")
+        return entry["answer"]
+
+    def put(self, question: str, answer: str):
+        """Запоминает ответ (только в памяти; на диск — save())."""
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        now = time.time()
+        with self._lock:
+            is_new = normalized not in self._entries
+            self._entries[normalized] = {"question": question, "answer": answer,
+                                         "created_at": now, "last_used": now}
+            self._entries.move_to_end(normalized)
+            if is_new:
+                self._index = None
+            self._trim()
+
+    def save(self):
+        """
+        Сохраняет кэш на диск (атомарно, через временный файл). Блокирующий вызов,
+        безопасен при одновременных вызовах из нескольких потоков.
+        """
+        with self._save_lock:
+            # Снимок сериализуется под блокировкой: get() в это время меняет last_used записей
+            with self._lock:
+                payload = json.dumps(list(self._entries.values()), ensure_ascii=False, indent=1)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"ERROR: Ошибка сохранения кэша ответов учителя {self.path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Единый кэш ответов на процесс
+teacher_answer_cache = TeacherAnswerCache()
@@ -0,0 +1,167 @@
+import io
+import os
+import sys
+from functools import lru_cache
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (VAD_FRAME_MS, VAD_THRESHOLD_DB, VAD_MIN_DBFS, VAD_PADDING_MS, VAD_MIN_SPEECH_MS,
+                    PRONUNCIATION_MAX_SECONDS)
+
+# Общий аудио-фронтенд: декодирование, моно, ресемплинг, обрезка тишины и нормализация громкости.
+# Через него проходят все записи, которые попадают в модель произношения
+# (слова блока произношения и фразы блока аудирования), а также конвертация OGG → WAV.
+# torch/torchaudio импортируются внутри функций, чтобы модуль оставался лёгким.
+
+TARGET_SAMPLE_RATE = 16000        # Частота, на которой обучена Wav2Vec2
+TELEGRAM_VOICE_SAMPLE_RATE = 48000  # Голосовые Telegram — почти всегда Opus 48 кГц
+
+# Аудио: путь к файлу или байты голосового сообщения Telegram (OGG/Opus)
+AudioSource = Union[str, bytes]
+
+# Причины отклонения записи до распознавания
+REJECT_DECODE = "decode"      # не удалось декодировать аудио
+REJECT_SILENT = "silent"      # в записи нет речи
+REJECT_TOO_LONG = "too_long"  # речь длиннее PRONUNCIATION_MAX_SECONDS
+
+
+class AudioRejectedError(Exception):
+    """
+    Запись отклонена до распознавания (см. REJECT_*).
+    duration — длительность речи в секундах (если удалось посчитать).
+    Аргументы конструктора совпадают с self.args, поэтому исключение
+    без потерь передаётся из процесса-воркера обратно в бота.
+    """
+
+    def __init__(self, reason: str, duration: float = 0.0):
+        super().__init__(reason, duration)
+        self.reason = reason
+        self.duration = duration
+
+    def __str__(self) -> str:
+        return f"запись отклонена ({self.reason}, речь {self.duration:.2f} с)"
+
+
+@lru_cache(maxsize=16)
+def get_resampler(orig_sr: int, target_sr: int = TARGET_SAMPLE_RATE):
+    """
+    Возвращает Resample для пары частот, создавая его один раз на процесс.
+    Ядро sinc-интерполяции считается в конструкторе, поэтому повторно его не строим.
+    """
+    import torchaudio
+    return torchaudio.transforms.Resample(orig_freq=orig_sr, new_freq=target_sr)
+
+
+def decode_audio(audio: AudioSource):
+    """Декодирует файл или байты OGG в тензор (channels, samples) и частоту дискретизации."""
+    import torchaudio
+    if isinstance(audio, (bytes, bytearray)):
+        return torchaudio.load(io.BytesIO(audio), format="ogg")
+    return torchaudio.load(audio)
+
+
+def to_mono(waveform):
+    """Сводит многоканальную запись (channels, samples) в один канал (samples,)."""
+    if waveform.shape[0] > 1:
+        return waveform.mean(dim=0)
+    return waveform[0]
+
+
+def resample(waveform, orig_sr: int, target_sr: int = TARGET_SAMPLE_RATE):
+    """Приводит запись к target_sr через закэшированный Resample."""
+    if orig_sr == target_sr:
+        return waveform
+    return get_resampler(orig_sr, target_sr)(waveform)
+
+
+def normalize_loudness(waveform):
+    """Нормализация громкости для Wav2Vec2: нулевое среднее и единичная дисперсия."""
+    return (waveform - waveform.mean()) / (waveform.std() + 1e-7)
+
+
+def load_mono(audio: AudioSource, target_sr: int = TARGET_SAMPLE_RATE):
+    """Декодирует запись и возвращает моно-тензор (samples,) с частотой target_sr (без нормализации)."""
+    waveform, sr = decode_audio(audio)
+    return resample(to_mono(waveform), sr, target_sr)
+
+
+def trim_silence(
+    samples: np.ndarray,
+    sample_rate: int = TARGET_SAMPLE_RATE,
+    frame_ms: int = VAD_FRAME_MS,
+    threshold_db: float = VAD_THRESHOLD_DB,
+    min_dbfs: float = VAD_MIN_DBFS,
+    padding_ms: int = VAD_PADDING_MS
+) -> Tuple[int, int, float]:
+    """
+    Энергетический VAD: находит границы речи в записи.
+    Запись режется на кадры по frame_ms; кадр считается речью, если его RMS
+    не ниже самого громкого кадра более чем на threshold_db и выше абсолютного порога min_dbfs.
+    Возвращает (start, end, voiced_seconds): границы в сэмплах с запасом padding_ms по краям
+    и суммарную длительность кадров речи; (0, 0, 0.0) — речи нет.
+    """
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    n_frames = int(np.ceil(len(samples) / frame))
+    if n_frames == 0:
+        return 0, 0, 0.0
+
+    padded = np.zeros(n_frames * frame, dtype=np.float32)
+    padded[:len(samples)] = samples
+    rms = np.sqrt(np.mean(padded.reshape(n_frames, frame) ** 2, axis=1))
+    levels_db = 20 * np.log10(rms + 1e-10)
+
+    voiced = np.flatnonzero((levels_db >= levels_db.max() - threshold_db) & (levels_db >= min_dbfs))
+    if voiced.size == 0:
+        return 0, 0, 0.0
+
+    padding = int(sample_rate * padding_ms / 1000)
+    start = max(0, voiced[0] * frame - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame + padding)
+    return int(start), int(end), voiced.size * frame / sample_rate
+
+
+def prepare_for_model(
+    audio: AudioSource,
+    max_seconds: float = PRONUNCIATION_MAX_SECONDS,
+    min_speech_ms: int = VAD_MIN_SPEECH_MS
+) -> Tuple[np.ndarray, Dict[str, float]]:
+    """
+    Полный путь записи к модели: декодирование → моно → 16 кГц → обрезка тишины → нормализация.
+    Возвращает (waveform, stats), где stats = {"duration": вся запись, "speech_duration": после обрезки}
+    в секундах — для метрик.
+    :raises AudioRejectedError: запись не декодируется, в ней нет речи или речь длиннее max_seconds.
+    """
+    try:
+        samples = load_mono(audio).numpy()
+    except Exception as e:
+        print(f"Ошибка декодирования аудио: {e}")
+        raise AudioRejectedError(REJECT_DECODE)
+
+    start, end, voiced_seconds = trim_silence(samples)
+    speech_duration = (end - start) / TARGET_SAMPLE_RATE
+    stats = {"duration": len(samples) / TARGET_SAMPLE_RATE, "speech_duration": speech_duration}
+
+    if voiced_seconds * 1000 < min_speech_ms:
+        raise AudioRejectedError(REJECT_SILENT, speech_duration)
+    if max_seconds and speech_duration > max_seconds:
+        raise AudioRejectedError(REJECT_TOO_LONG, speech_duration)
+
+    return normalize_loudness(samples[start:end]), stats
+
+
+def load_for_model(audio: AudioSource) -> np.ndarray:
+    """То же, что prepare_for_model, но без статистики."""
+    return prepare_for_model(audio)[0]
+
+
+def warm_up():
+    """Строит ресемплер для типичного голосового Telegram (48 → 16 кГц) заранее, до первого запроса."""
+    get_resampler(TELEGRAM_VOICE_SAMPLE_RATE, TARGET_SAMPLE_RATE)
+
+
+def frontend_info() -> Tuple[int, int]:
+    """(число закэшированных ресемплеров, число промахов кэша) — для отладки и бенчмарков."""
+    info = get_resampler.cache_info()
+    return info.currsize, info.misses
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import AI_BREAKER_FAILURES, AI_BREAKER_LATENCY_SLO, AI_BREAKER_OPEN_SECONDS, AI_BREAKER_CALL_TIMEOUT
+
+# Предохранитель (circuit breaker) для запросов к AI. Когда провайдер деградирует, каждый
+# обработчик иначе ждал бы свой длинный таймаут и только потом отвечал заглушкой.
+#   closed    — запросы идут как обычно; ошибки и ответы медленнее AI_BREAKER_LATENCY_SLO
+#               считаются подряд, после AI_BREAKER_FAILURES таких случаев предохранитель размыкается;
+#   open      — AI_BREAKER_OPEN_SECONDS секунд запросы не отправляются: вызывающий сразу
+#               получает CircuitOpenError и отвечает локальной заглушкой;
+#   half_open — после паузы пропускается один пробный запрос: успех замыкает предохранитель,
+#               ошибка снова размыкает его.
+# Каждый вызов через предохранитель ограничен AI_BREAKER_CALL_TIMEOUT секундами.
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: запрос к AI не отправлялся."""
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """
+    Ошибка говорит о недоступности провайдера (таймаут, соединение, 408/429/5xx),
+    а не о нашем запросе (остальные 4xx не размыкают предохранитель).
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        return True
+    return status_code in (408, 429) or status_code >= 500
+
+
+class CircuitBreaker:
+    """Общий предохранитель для группы запросов. Используется только из event loop."""
+
+    def __init__(self, name: str, failure_threshold: int = AI_BREAKER_FAILURES,
+                 latency_slo: float = AI_BREAKER_LATENCY_SLO, open_seconds: float = AI_BREAKER_OPEN_SECONDS,
+                 call_timeout: float = AI_BREAKER_CALL_TIMEOUT):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.latency_slo = latency_slo
+        self.open_seconds = open_seconds
+        self.call_timeout = call_timeout
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.short_circuited = 0
+        self.times_opened = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return STATE_HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """Запросы сейчас не пропускаются (пауза после размыкания или идёт пробный запрос)."""
+        state = self.state
+        return state == STATE_OPEN or (state == STATE_HALF_OPEN and self._probe_in_flight)
+
+    def ensure_available(self):
+        """:raises CircuitOpenError: если запрос сейчас не будет пропущен (без расхода пробного запроса)."""
+        if self.is_open:
+            self.short_circuited += 1
+            raise CircuitOpenError(f"{self.name}: предохранитель разомкнут")
+
+    def _transition(self, state: str):
+        if state != self._state:
+            print(f"DEBUG: Предохранитель {self.name}: {self._state} -> {state} "
+                  f"(ошибок подряд: {self.consecutive_failures}, последняя: {self.last_error})")
+        self._state = state
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+
+    def _allow(self) -> bool:
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN and not self._probe_in_flight:
+            self._transition(STATE_HALF_OPEN)
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self, latency: float):
+        self._probe_in_flight = False
+        if self.latency_slo and latency > self.latency_slo:
+            self.slow_calls += 1
+            self._record_breach(f"медленный ответ {latency:.1f} с")
+            return
+        self.consecutive_failures = 0
+        if self._state != STATE_CLOSED:
+            self._transition(STATE_CLOSED)
+
+    def record_failure(self, error: BaseException):
+        self._probe_in_flight = False
+        if not is_provider_failure(error):
+            return
+        self.failures += 1
+        self._record_breach(f"{type(error).__name__}: {error}")
+
+    def _record_breach(self, reason: str):
+        self.consecutive_failures += 1
+        self.last_error = reason
+        if self._state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._transition(STATE_OPEN)
+
+    async def call(self, awaitable: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет запрос через предохранитель с ограничением call_timeout
+        (или timeout — остатком общего срока, часть которого ушла на ожидание очереди).
+        :raises CircuitOpenError: если предохранитель разомкнут (запрос не выполнялся).
+        """
+        if not self._allow():
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            self.short_circuited += 1
+            raise CircuitOpenError(f"{self.name}: предохранитель разомкнут")
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=self.call_timeout if timeout is None else timeout)
+        except asyncio.CancelledError:
+            self._probe_in_flight = False  # отменён вызывающим — это не вердикт о провайдере
+            raise
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние предохранителя для мониторинга."""
+        state = self.state
+        return {
+            "name": self.name,
+            "state": state,
+            "open_for_seconds": round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+            if state == STATE_OPEN else 0.0,
+            "consecutive_failures": self.consecutive_failures,
+            "failures": self.failures,
+            "slow_calls": self.slow_calls,
+            "short_circuited": self.short_circuited,
+            "times_opened": self.times_opened,
+            "last_error": self.last_error,
+        }
+
+
+# Общий предохранитель для проверок письма, говорения и транскрипции Whisper
+ai_breaker = CircuitBreaker("openai")
@@ -0,0 +1,95 @@
+import math
+from typing import Any, Dict, List, Tuple
+
+# Оценка произношения по логитам модели (Goodness of Pronunciation, GOP).
+# Эталонная последовательность фонем eSpeak NG принудительно выравнивается по логитам
+# Wav2Vec2 (CTC Viterbi, torchaudio.functional.forced_align). Для каждой эталонной фонемы
+# известны её кадры, а значит и время, и уверенность модели именно в этой фонеме:
+#   GOP = среднее по кадрам фонемы (log P(эталонная фонема) − max log P(любая фонема)).
+# GOP = 0, если в каждом кадре эталонная фонема самая вероятная; чем ниже — тем хуже.
+# Оценка фонемы в процентах — exp(GOP) * 100. torch/torchaudio импортируются внутри функций.
+
+# Ударения и пробелы в транскрипции eSpeak NG не являются токенами модели
+_STRIP_TABLE = str.maketrans({char: None for char in "ˈˌ '`"})
+
+
+def reference_tokens(word_ipas: List[str], vocab: Dict[str, int]) -> Tuple[List[int], List[int], List[str]]:
+    """
+    Переводит транскрипции слов в токены словаря модели (жадно, самым длинным совпадением:
+    'tʃ', 'aɪ', 'iː' — один токен, если он есть в словаре). Символы вне словаря пропускаются.
+    Возвращает (ID токенов, номер слова для каждого токена, сами токены).
+    """
+    phoneme_vocab = {token: idx for token, idx in vocab.items()
+                     if token and not token.startswith('<') and token not in ('|', ' ')}
+    max_length = max((len(token) for token in phoneme_vocab), default=1)
+
+    token_ids, token_words, symbols = [], [], []
+    for word_idx, ipa in enumerate(word_ipas):
+        text = ipa.translate(_STRIP_TABLE)
+        pos = 0
+        while pos < len(text):
+            for size in range(min(max_length, len(text) - pos), 0, -1):
+                piece = text[pos:pos + size]
+                if piece in phoneme_vocab:
+                    token_ids.append(phoneme_vocab[piece])
+                    token_words.append(word_idx)
+                    symbols.append(piece)
+                    pos += size
+                    break
+            else:
+                pos += 1
+    return token_ids, token_words, symbols
+
+
+def score_phonemes(log_probs, token_ids: List[int], symbols: List[str], blank: int,
+                   seconds_per_frame: float) -> List[Dict[str, Any]]:
+    """
+    Принудительно выравнивает эталонные токены по log-вероятностям (frames, vocab)
+    и считает GOP каждой эталонной фонемы.
+    Возвращает по фонеме: {"phoneme", "start", "end" (сек), "start_frame", "end_frame",
+    "log_posterior", "gop", "score" (0–100)}.
+    :raises RuntimeError: если запись слишком короткая для эталона (кадров меньше, чем нужно CTC).
+    """
+    import torch
+    import torchaudio.functional as F
+
+    targets = torch.tensor([token_ids], dtype=torch.int32)
+    alignment, frame_scores = F.forced_align(log_probs.unsqueeze(0), targets, blank=blank)
+    spans = F.merge_tokens(alignment[0], frame_scores[0], blank=blank)
+
+    best = log_probs.max(dim=-1).values
+    phonemes = []
+    for token_id, phoneme, span in zip(token_ids, symbols, spans):
+        frames = slice(span.start, span.end)
+        target = log_probs[frames, token_id]
+        gop = float((target - best[frames]).mean())
+        phonemes.append({
+            "phoneme": phoneme,
+            "start_frame": span.start,
+            "end_frame": span.end,
+            "start": round(span.start * seconds_per_frame, 3),
+            "end": round(span.end * seconds_per_frame, 3),
+            "log_posterior": float(target.mean()),
+            "gop": gop,
+            "score": math.exp(gop) * 100,
+        })
+    return phonemes
+
+
+def score_words(phonemes: List[Dict[str, Any]], token_words: List[int], word_count: int) -> List[Dict[str, Any]]:
+    """
+    Собирает оценки фонем по словам: оценка слова — среднее оценок его фонем,
+    границы слова — от начала первой до конца последней фонемы.
+    """
+    words = [{"phonemes": [], "score": 0.0, "start": None, "end": None,
+              "start_frame": None, "end_frame": None} for _ in range(word_count)]
+    for phoneme, word_idx in zip(phonemes, token_words):
+        word = words[word_idx]
+        word["phonemes"].append(phoneme)
+        if word["start"] is None:
+            word["start"], word["start_frame"] = phoneme["start"], phoneme["start_frame"]
+        word["end"], word["end_frame"] = phoneme["end"], phoneme["end_frame"]
+    for word in words:
+        if word["phonemes"]:
+            word["score"] = sum(p["score"] for p in word["phonemes"]) / len(word["phonemes"])
+    return words
@@ -16,15 +16,21 @@ from bot.keyboards import (get_next_keyboard, get_pronunciation_keyboard, get_pr
                          get_speaking_keyboard, get_speaking_result_keyboard, get_final_keyboard, get_word_build_keyboard)
 from bot.states import LessonStates
 from bot.utils import (load_json_data, UserProgress, generate_audio, simple_pronunciation_check,
-                       get_teacher_response, check_writing_with_ai, analyze_speaking_with_ai,
+                       stream_teacher_response, check_writing_with_ai, stream_speaking_analysis,
                        transcribe_audio_simple, analyze_phonemes_with_gpt)
 
 from config import MESSAGES, IMAGES_PATH, CURRENT_LESSON_ID
-from config import OPENAI_API_KEY
-from bot.utils import convert_ogg_to_wav
+from config import OPENAI_API_KEY, ARCHIVE_VOICES, PRONUNCIATION_MAX_SECONDS, SPEAKING_MAX_SECONDS
+from config import PRONUNCIATION_SCORING
+from bot.utils import archive_voice, spawn_background_task, pronunciation_thresholds, get_cached_pronunciation_result
+from bot.utils import _sanitize_filename
+from bot.inference import InferenceBusyError, InferenceTimeoutError
+from bot.audio_frontend import AudioRejectedError, REJECT_SILENT, REJECT_TOO_LONG
+from bot.throttling import EXPENSIVE_PRONUNCIATION, EXPENSIVE_SPEAKING
+from bot.stream_render import ThrottledMessageEditor
 from aiogram.exceptions import TelegramBadRequest
 from datetime import datetime # Добавьте, если нет
-from typing import Callable, Awaitable, Dict, List, Tuple, Any
+from typing import Callable, Awaitable, Dict, List, Tuple, Any, Optional
 import shutil
 import logging
 import os
@@ -356,7 +362,7 @@ async def next_term(
 
 
 
-@router.message(F.voice, LessonStates.PRONUNCIATION_RECORD)
+@router.message(F.voice, LessonStates.PRONUNCIATION_RECORD, flags={"expensive": EXPENSIVE_PRONUNCIATION})
 async def process_pronunciation_recording(message: Message, state: FSMContext, user_progress: UserProgress,
     user_statistics: UserStatistics):
     data = await state.get_data()
@@ -375,59 +381,69 @@ async def process_pronunciation_recording(message: Message, state: FSMContext, u
         if overall_accuracy < 85.0 and analysis_text: # Условие для показа точности и обычного анализа
              full_response += f"\n\n🎯 <b>Точность:</b> {overall_accuracy:.1f}%\n{analysis_text}"
 
-        gpt_analysis_output = None
         # Вызов GPT-анализа только если verdict не "Отлично" и не "Неразборчиво",
         # и если есть word_results для анализа
         # (это означает, что overall_accuracy находится между порогами)
-        if word_results and analysis_text: # Проверяем, что есть ошибки, для которых делался анализ
-            gpt_analysis_output = await analyze_phonemes_with_gpt(
-                original_text=text_to_check,
-                expected_phonemes=expected_phonemes,
-                user_phonemes=user_phonemes,
-                overall_accuracy=overall_accuracy,
-                word_errors_analysis=word_results
-            )
-
-        if gpt_analysis_output:
-            full_response += f"\n\n---\n🤖 <b>Советы от AI:</b>\n{gpt_analysis_output}"
+        wants_gpt_analysis = bool(word_results and analysis_text and OPENAI_API_KEY)
 
-        # Сохраняем детальные данные произношения
+        # Статистика обновляется в памяти сразу, а файл пишется в фоне
         user_statistics.save_pronunciation_data(
             user_id=message.from_user.id,
             word=text_to_check,
             user_phonemes=user_phonemes,
             expected_phonemes=expected_phonemes,
-            accuracy=overall_accuracy
+            accuracy=overall_accuracy,
+            save=False
         )
-
-        # Логируем результат
-        log_user_result(
-            user_id=str(message.from_user.id),
-            result_type="pronunciation_check",
-            result_data={
-                "text": text_to_check,
-                "accuracy": overall_accuracy,
-                "verdict": verdict,
-                "analysis": analysis_text,
-                "gpt_analysis": gpt_analysis_output,
-                "user_phonemes": user_phonemes
-            }
-        )
-
         # ИЗМЕНЕНИЕ: Добавляем каждую попытку произношения в статистику (lesson_id по умолчанию)
         user_statistics.add_pronunciation_attempt(
             user_id=message.from_user.id,
             word=text_to_check,
-            score=overall_accuracy
+            score=overall_accuracy,
+            save=False
         )
+        spawn_background_task(user_statistics.save_data_async())
 
-        await message.answer(
-            full_response,
-            reply_markup=get_keyboard_with_menu(get_pronunciation_result_keyboard()),
+        # Вердикт и разбор уходят ученику сразу, советы AI дописываются в то же сообщение позже
+        reply_markup = get_keyboard_with_menu(get_pronunciation_result_keyboard())
+        result_message = await message.answer(
+            full_response + ("\n\n🤖 <i>Готовлю советы от AI...</i>" if wants_gpt_analysis else ""),
+            reply_markup=reply_markup,
             parse_mode='HTML'
         )
         await state.set_state(LessonStates.PRONUNCIATION_LISTEN)
 
+        async def deliver_gpt_analysis():
+            gpt_analysis_output = None
+            if wants_gpt_analysis:
+                try:
+                    gpt_analysis_output = await analyze_phonemes_with_gpt(
+                        original_text=text_to_check,
+                        expected_phonemes=expected_phonemes,
+                        user_phonemes=user_phonemes,
+                        overall_accuracy=overall_accuracy,
+                        word_errors_analysis=word_results
+                    )
+                except Exception as e:
+                    print(f"ERROR: Ошибка GPT-анализа произношения: {e}")
+                await _append_gpt_analysis(message, result_message, full_response, gpt_analysis_output, reply_markup)
+
+            # Логируем результат
+            log_user_result(
+                user_id=str(message.from_user.id),
+                result_type="pronunciation_check",
+                result_data={
+                    "text": text_to_check,
+                    "accuracy": overall_accuracy,
+                    "verdict": verdict,
+                    "analysis": analysis_text,
+                    "gpt_analysis": gpt_analysis_output,
+                    "user_phonemes": user_phonemes
+                }
+            )
+
+        spawn_background_task(deliver_gpt_analysis())
+
     await analyze_pronunciation(
         message=message,
         text_to_check=text_to_check,
@@ -435,6 +451,23 @@ async def process_pronunciation_recording(message: Message, state: FSMContext, u
         state=state
     )
 
+
+async def _append_gpt_analysis(message: Message, result_message: Message, full_response: str,
+                              gpt_analysis_output: Optional[str], reply_markup):
+    """
+    Дописывает советы AI в уже отправленное сообщение с результатом (или убирает пометку
+    «Готовлю советы», если советов нет). Если сообщение нельзя отредактировать
+    (например, текст стал длиннее лимита Telegram), советы приходят отдельным сообщением.
+    """
+    gpt_block = f"\n\n---\n🤖 <b>Советы от AI:</b>\n{gpt_analysis_output}" if gpt_analysis_output else ""
+    try:
+        await result_message.edit_text(full_response + gpt_block, reply_markup=reply_markup, parse_mode='HTML')
+    except TelegramBadRequest as e:
+        print(f"Не удалось дописать советы AI в сообщение: {e}")
+        if gpt_analysis_output:
+            await message.answer(gpt_block.lstrip(), parse_mode='HTML')
+
+
 async def analyze_pronunciation(
     message: Message,
     text_to_check: str,
@@ -442,70 +475,77 @@ async def analyze_pronunciation(
     state: FSMContext
 ):
     """Общая функция для анализа произношения (может использоваться в разных блоках)"""
+    # Слишком длинные записи не скачиваем и не отправляем в воркер: длительность известна из Telegram
+    if message.voice.duration and message.voice.duration > PRONUNCIATION_MAX_SECONDS:
+        await message.answer(f"⏱ Запись слишком длинная ({message.voice.duration} сек). Произнеси только "
+                             f"нужное слово или фразу (не дольше {PRONUNCIATION_MAX_SECONDS:.0f} секунд).")
+        return
+
     processing_msg = await message.answer("🔄 Анализирую твоё произношение...")
 
     # Настройка порогов
-    base_lower_threshold = 68.0
-    base_upper_threshold = 84.0
-    sensitivity_factor = -1.0
-    num_words = len(text_to_check.split())
-
-    adjusted_lower_threshold = base_lower_threshold
-    adjusted_upper_threshold = base_upper_threshold
-
-    if num_words <= 2:
-        adjusted_lower_threshold += 3.0 * sensitivity_factor
-    elif num_words >= 5:
-        adjusted_lower_threshold += -3.0 * sensitivity_factor
-
-    adjusted_lower_threshold = max(0.0, min(100.0, adjusted_lower_threshold))
-    adjusted_upper_threshold = max(0.0, min(100.0, adjusted_upper_threshold))
-
-    timestamp_str = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    voice_path_ogg = os.path.join("media", "audio", f"voice_{message.from_user.id}_{timestamp_str}.ogg")
-    voice_path_wav = voice_path_ogg.replace(".ogg", ".wav")
+    adjusted_lower_threshold, adjusted_upper_threshold = pronunciation_thresholds(text_to_check)
 
     try:
-        voice_file = await message.bot.get_file(message.voice.file_id)
-        os.makedirs(os.path.dirname(voice_path_ogg), exist_ok=True)
-        await message.bot.download_file(voice_file.file_path, voice_path_ogg)
-
-        if not await convert_ogg_to_wav(voice_path_ogg, voice_path_wav):
-            if processing_msg:
-                try:
-                    await processing_msg.delete()
-                except TelegramBadRequest as e:
-                    print(f"Ошибка удаления сообщения при неудачной конвертации: {e}")
-            await message.answer("⚠️ Не удалось обработать аудио. Пожалуйста, попробуйте еще раз.")
-            return
-
-        # ⬇️ Основной анализ
-        overall_accuracy, verdict, analysis_text, expected_phonemes, user_phonemes, word_results = await simple_pronunciation_check(
-            text_to_check,
-            voice_path_wav,
-            adjusted_lower_threshold,
-            adjusted_upper_threshold
-        )
+        # То же голосовое (пересланное или отправленное повторно) для той же фразы уже проверено:
+        # отвечаем сразу, не скачивая файл и не обращаясь к модели
+        voice_bytes = None
+        cached_result = get_cached_pronunciation_result(text_to_check, message.voice.file_unique_id)
+        if cached_result is not None:
+            print(f"DEBUG: Произношение: повторная запись {message.voice.file_unique_id}, результат из кэша")
+            overall_accuracy, verdict, analysis_text, expected_phonemes, user_phonemes, word_results = cached_result
+        else:
+            # Голосовое скачивается в память: OGG/Opus декодируется прямо из байтов, без временных файлов
+            voice_buffer = await message.bot.download(message.voice)
+            voice_bytes = voice_buffer.getvalue()
+
+            # ⬇️ Основной анализ
+            overall_accuracy, verdict, analysis_text, expected_phonemes, user_phonemes, word_results = await simple_pronunciation_check(
+                text_to_check,
+                voice_bytes,
+                adjusted_lower_threshold,
+                adjusted_upper_threshold,
+                file_unique_id=message.voice.file_unique_id
+            )
 
         # ⬇️ Вызываем callback для UI
         await callback(overall_accuracy, verdict, analysis_text, expected_phonemes, user_phonemes, word_results)
 
-        # ⬇️ Архивация голоса
-        save_dir = os.path.join("media", "archived_voices")
-        os.makedirs(save_dir, exist_ok=True)
-        unique_name = f"{message.from_user.id}_acc_{round(overall_accuracy)}_%_{_sanitize_filename(text_to_check)[:20]}.ogg" # ИЗМЕНЕНИЕ: Используем _sanitize_filename
-        shutil.copyfile(voice_path_ogg, os.path.join(save_dir, unique_name))
-
+        # ⬇️ Архивация голоса (в фоне, не задерживая ответ); повторы из кэша не архивируются
+        if ARCHIVE_VOICES and voice_bytes is not None:
+            # Время и id сообщения в имени: новая попытка той же фразы не затирает прежнюю запись
+            created_at = datetime.now()
+            unique_name = (f"{message.from_user.id}_acc_{round(overall_accuracy)}_%_"
+                           f"{_sanitize_filename(text_to_check)[:20]}_"
+                           f"{created_at.strftime('%Y%m%d_%H%M%S')}_{message.message_id}.ogg")
+            spawn_background_task(archive_voice(voice_bytes, unique_name, {
+                "user_id": message.from_user.id,
+                "text": text_to_check,
+                "accuracy": overall_accuracy,
+                "scoring": PRONUNCIATION_SCORING,
+                "created_at": created_at.isoformat(timespec="seconds"),
+            }))
+
+    except AudioRejectedError as e:
+        if e.reason == REJECT_SILENT:
+            await message.answer("🔇 Не слышно голоса. Запиши голосовое ещё раз и говори чуть громче или ближе к микрофону.")
+        elif e.reason == REJECT_TOO_LONG:
+            await message.answer(f"⏱ Запись слишком длинная. Произнеси только нужное слово или фразу "
+                                 f"(не дольше {PRONUNCIATION_MAX_SECONDS:.0f} секунд).")
+        else:
+            await message.answer("⚠️ Не удалось обработать аудио. Пожалуйста, попробуйте еще раз.")
+        print(f"Запись отклонена до распознавания: {e}")
+    except InferenceBusyError as e:
+        await message.answer("⏳ Сейчас очень много записей на проверке. Пожалуйста, отправь голосовое ещё раз через минуту.")
+        print(f"Очередь распознавания переполнена: {e}")
+    except InferenceTimeoutError as e:
+        await message.answer("⌛ Анализ занял слишком много времени. Попробуй записать голосовое ещё раз.")
+        print(f"Таймаут распознавания: {e}")
     except Exception as e:
         await message.answer("Произошла ошибка при обработке вашего голосового сообщения.")
         print(f"Ошибка: {e}")
 
     finally:
-        if voice_path_ogg and os.path.exists(voice_path_ogg):
-            os.remove(voice_path_ogg)
-        if voice_path_wav and os.path.exists(voice_path_wav):
-            os.remove(voice_path_wav)
-
         if processing_msg:
             try:
                 await processing_msg.delete()
@@ -551,17 +591,6 @@ async def start_pronunciation_lesson_from_callback(callback: CallbackQuery, stat
     await start_pronunciation_block(callback.from_user.id, callback.message, state, user_statistics, user_progress)
     await callback.answer()
 
-def _sanitize_filename(text: str, max_length: int = 50) -> str:
-    """
-    Очищает строку для использования в качестве части имени файла.
-    Удаляет недопустимые символы и обрезает строку до max_length.
-    """
-    sanitized = re.sub(r'[^\w\s-]', '', text).strip()
-    sanitized = re.sub(r'\s+', '_', sanitized)
-    sanitized = re.sub(r'__+', '_', sanitized)
-    sanitized = sanitized.strip('_')
-    return sanitized[:max_length]
-
 async def show_pronunciation_word(user_id: int, message: Message, state: FSMContext, user_statistics: UserStatistics, user_progress: UserProgress): # ИСПРАВЛЕНО: Добавлен user_id
     """Показать текущее слово для произношения"""
     data = await state.get_data()
@@ -1470,22 +1499,23 @@ async def process_grammar_question(message: Message, state: FSMContext, user_sta
     # Показываем, что обрабатываем вопрос
     thinking_msg = await message.answer(MESSAGES["teacher_thinking"])
 
+    editor = ThrottledMessageEditor(thinking_msg)
     try:
-        # Получаем ответ от AI агента-учителя
-        teacher_response = await get_teacher_response(user_question)
+        # Ответ AI агента-учителя появляется в сообщении "думаю" по мере генерации
+        teacher_response = ""
+        async for teacher_response in stream_teacher_response(user_question):
+            await editor.update(teacher_response)
 
-        # Удаляем сообщение "думаю"
-        await thinking_msg.delete()
-
-        # Отправляем ответ учителя
-        await message.answer(
+        # Окончательный ответ учителя с клавиатурой
+        await editor.finish(
             teacher_response,
             reply_markup=get_keyboard_with_menu(get_grammar_qa_keyboard())
         )
         print(f"DEBUG: Пользователь {user_id} получил ответ на вопрос по грамматике.")
 
     except Exception as e:
-        await thinking_msg.delete()
+        if not editor.finished:
+            await thinking_msg.delete()
         await message.answer(
             "Извини, произошла ошибка при обработке твоего вопроса. "
             "Попробуй переформулировать вопрос.",
@@ -2655,7 +2685,7 @@ async def request_phrase_recording(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.message(F.voice, LessonStates.LISTENING_PHRASES_RECORD)
+@router.message(F.voice, LessonStates.LISTENING_PHRASES_RECORD, flags={"expensive": EXPENSIVE_PRONUNCIATION})
 async def process_phrase_recording(message: Message, state: FSMContext, user_statistics: UserStatistics):
     """Обработка записи произношения фразы в блоке аудирования"""
     user_id = message.from_user.id
@@ -3184,7 +3214,7 @@ async def request_speaking_recording(callback: CallbackQuery, state: FSMContext)
     await callback.answer()
 
 
-@router.message(F.voice, LessonStates.SPEAKING_RECORD)
+@router.message(F.voice, LessonStates.SPEAKING_RECORD, flags={"expensive": EXPENSIVE_SPEAKING})
 async def process_speaking_recording(message: Message, state: FSMContext, user_statistics: UserStatistics):
     """Обработка записи говорения"""
     user_id = message.from_user.id
@@ -3197,8 +3227,17 @@ async def process_speaking_recording(message: Message, state: FSMContext, user_s
 
     current_topic = topics[current_index]
 
+    # Слишком длинные ответы не отправляем на транскрипцию: длительность известна из Telegram без скачивания
+    if message.voice.duration and message.voice.duration > SPEAKING_MAX_SECONDS:
+        await message.answer(
+            f"⏱ Запись слишком длинная ({message.voice.duration} сек). "
+            f"Пожалуйста, уложись в {SPEAKING_MAX_SECONDS // 60} мин и запиши ответ ещё раз."
+        )
+        return
+
     # Показываем, что анализируем
     analyzing_msg = await message.answer(MESSAGES["speaking_analyzing"])
+    editor = ThrottledMessageEditor(analyzing_msg, parse_mode="Markdown")
 
     try:
         # Скачиваем голосовое сообщение
@@ -3210,8 +3249,23 @@ async def process_speaking_recording(message: Message, state: FSMContext, user_s
         # Простая транскрипция (в реальности - Whisper API)
         transcribed_text = await transcribe_audio_simple(voice_path)
 
-        # Анализируем с помощью AI
-        analysis = await analyze_speaking_with_ai(transcribed_text, current_topic)
+        # Удаляем временный файл
+        if os.path.exists(voice_path):
+            os.remove(voice_path)
+
+        # Анализ AI появляется в сообщении об анализе по мере генерации
+        result_header = (f"**Твоя тема:** {current_topic}\n\n"
+                         f"**Твое высказывание** {transcribed_text}\n\n")
+        analysis = ""
+        async for analysis in stream_speaking_analysis(transcribed_text, current_topic):
+            await editor.update(result_header + analysis)
+
+        # Окончательный анализ с клавиатурой
+        await editor.finish(
+            result_header + analysis,
+            reply_markup=get_keyboard_with_menu(get_speaking_result_keyboard())
+        )
+
         # Простая эвристика для определения корректности (например, если AI дал положительный отзыв)
         is_correct = "✅" in analysis or "хорошо" in analysis.lower() or "отлично" in analysis.lower()
 
@@ -3240,29 +3294,15 @@ async def process_speaking_recording(message: Message, state: FSMContext, user_s
         )
         user_statistics.add_speaking_attempt(user_id, "topics", current_topic, is_correct, CURRENT_LESSON_ID)
 
-        # Удаляем временный файл
-        if os.path.exists(voice_path):
-            os.remove(voice_path)
-
-        # Удаляем сообщение об анализе
-        await analyzing_msg.delete()
-
-        # Отправляем анализ
-        await message.answer(
-            f"**Твоя тема:** {current_topic}\n\n"
-            f"**Твое высказывание** {transcribed_text}\n\n"
-            f"{analysis}",
-            parse_mode="Markdown",
-            reply_markup=get_keyboard_with_menu(get_speaking_result_keyboard())
-)
-
         # Увеличиваем счетчик выполненных, если ответ правильный
         if is_correct:
             completed = data.get("speaking_complete_count", 0)
             await state.update_data(speaking_complete_count=completed + 1)
 
     except Exception as e:
-        await analyzing_msg.delete()
+        # Если анализ уже показан, сообщение с ним не удаляем
+        if not editor.finished:
+            await analyzing_msg.delete()
         await message.answer(
             "Произошла ошибка при анализе высказывания.",
             reply_markup=get_keyboard_with_menu(get_speaking_result_keyboard())
@@ -0,0 +1,321 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_TIMEOUT,
+                    INFERENCE_THREADS_PER_WORKER, INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT_MS)
+
+
+class InferenceBusyError(Exception):
+    """Очередь распознавания переполнена, запрос отклонён."""
+
+
+class InferenceTimeoutError(Exception):
+    """Распознавание не уложилось в отведённое время."""
+
+
+# --- Функции, выполняемые внутри процессов-воркеров ---
+
+def _init_worker(num_threads: int):
+    """
+    Инициализация процесса-воркера.
+    Модель Wav2Vec2 и ресемплер 48 → 16 кГц создаются здесь один раз и живут до конца процесса.
+    """
+    import torch
+    torch.set_num_threads(max(1, num_threads))
+    from bot.utils import get_phoneme_model
+    from bot import audio_frontend
+    get_phoneme_model()
+    audio_frontend.warm_up()
+
+
+def _worker_ping() -> int:
+    """Пустая задача для прогрева: к её выполнению воркер уже запущен и загрузил модель."""
+    return os.getpid()
+
+
+def _worker_recognize(audio: Union[str, bytes], time_limit: Optional[float] = None) -> Dict[str, Any]:
+    """Распознаёт фонемы в записи — пути к файлу или байтах OGG (выполняется в воркере)."""
+    from bot.utils import recognize_audio_sync
+    return recognize_audio_sync(audio, time_limit)
+
+
+def _worker_recognize_batch(audios: List[Union[str, bytes]], time_limit: Optional[float] = None) -> List[Any]:
+    """
+    Распознаёт пачку записей одним проходом модели (выполняется в воркере).
+    Для каждой записи — словарь с результатом или исключение.
+    time_limit ограничивает распознавание длинных записей по окнам: воркер не будет
+    занят одной записью дольше, чем бот готов ждать ответа.
+    """
+    from bot.utils import recognize_audio_batch_sync
+    return recognize_audio_batch_sync(audios, time_limit)
+
+
+def _worker_score_gop(audio: Union[str, bytes], word_ipas: List[str],
+                      time_limit: Optional[float] = None) -> Dict[str, Any]:
+    """Распознаёт запись и оценивает эталонные фонемы по логитам (GOP), выполняется в воркере."""
+    from bot.utils import score_pronunciation_gop_sync
+    return score_pronunciation_gop_sync(audio, word_ipas, time_limit)
+
+
+def _consume_result(future: asyncio.Future):
+    """Забирает результат брошенного future, чтобы asyncio не ругался на необработанное исключение."""
+    if not future.cancelled():
+        future.exception()
+
+
+class InferencePool:
+    """
+    Пул процессов для тяжёлого распознавания речи.
+
+    Обработчики aiogram ожидают результат через recognize()/run(), а сама модель
+    работает в отдельных процессах, поэтому event loop остаётся свободным.
+    Одновременные запросы на распознавание копятся batch_wait_ms миллисекунд
+    (или до batch_size штук) и уходят в воркер одной пачкой.
+    Число принятых, но не завершённых записей ограничено: при переполнении
+    сразу выбрасывается InferenceBusyError, а не копится бесконечная очередь.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float, threads_per_worker: int = 1,
+                 batch_size: int = 1, batch_wait_ms: float = 0.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait_ms) / 1000
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._batch: List[Tuple[Union[str, bytes], asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks = set()
+
+    @property
+    def capacity(self) -> int:
+        """Максимум одновременно принятых записей (распознаются + ждут)."""
+        return max(1, self.workers) * self.batch_size + self.queue_size
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        """Запускает пул процессов (если он включён в настройках)."""
+        if self._executor is not None or self.workers <= 0:
+            return
+        # spawn вместо fork: форк процесса с уже загруженным torch и потоками небезопасен
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker,)
+        )
+        print(f"DEBUG: InferencePool: запущено воркеров: {self.workers}, очередь: {self.queue_size}, "
+              f"пачка: до {self.batch_size} записей / {self.batch_wait * 1000:.0f} мс")
+
+    def shutdown(self, wait: bool = False):
+        """Останавливает пул процессов."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+            print("DEBUG: InferencePool: пул остановлен.")
+
+    async def _export_onnx_model(self):
+        """
+        ONNX-модель экспортируется один раз до прогрева воркеров, а не каждым воркером
+        параллельно. Экспорт загружает torch и всю модель, поэтому идёт в отдельном
+        одноразовом процессе: процесс бота остаётся лёгким, а event loop свободным.
+        """
+        from bot.utils import phoneme_onnx_export_needed, export_phoneme_onnx_model
+        if not phoneme_onnx_export_needed():
+            return
+        print("DEBUG: InferencePool: экспорт ONNX-модели в отдельном процессе...")
+        loop = asyncio.get_running_loop()
+        exporter = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            await loop.run_in_executor(exporter, export_phoneme_onnx_model)
+        except Exception as e:
+            # Воркеры экспортируют модель сами (под файловой блокировкой) при загрузке
+            print(f"ERROR: InferencePool: не удалось заранее экспортировать ONNX-модель: {e}")
+        finally:
+            # Без ожидания: при отмене прогрева event loop не должен ждать конца экспорта
+            exporter.shutdown(wait=False)
+
+    async def warm_up(self):
+        """
+        Заранее запускает все воркеры и загружает в них модель,
+        чтобы первый студент не ждал загрузки. Вызывается фоновой задачей из main().
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if self.workers <= 0:
+                from bot.utils import get_phoneme_model
+                await loop.run_in_executor(None, get_phoneme_model)
+            else:
+                await self._export_onnx_model()
+                self.start()
+                # Каждая задача занимает свободный воркер, поэтому поднимаются все процессы пула
+                pids = await asyncio.gather(*[
+                    loop.run_in_executor(self._executor, _worker_ping) for _ in range(self.workers)
+                ])
+                print(f"DEBUG: InferencePool: воркеры прогреты: {sorted(set(pids))}")
+        except Exception as e:
+            print(f"ERROR: InferencePool: ошибка прогрева модели: {e}")
+
+    def _restart(self, broken: Optional[ProcessPoolExecutor]):
+        """
+        Воркер упал (например, из-за нехватки памяти) — пересоздаём пул для следующих запросов.
+        broken — пул, в который была отправлена упавшая задача: если его уже заменили
+        (о поломке сообщила другая задача), новый исправный пул не трогаем.
+        """
+        if broken is None or self._executor is not broken:
+            return
+        print("ERROR: InferencePool: пул процессов повреждён, перезапуск.")
+        self.shutdown()
+        self.start()
+        # shutdown() снял таймер пачки — записи, ждавшие в накопителе, отправляем в новый пул сразу
+        if self._batch:
+            self._flush_batch()
+
+    def _reserve(self, count: int = 1):
+        if self._pending + count > self.capacity:
+            raise InferenceBusyError(f"Очередь распознавания заполнена ({self._pending}/{self.capacity})")
+        self._pending += count
+
+    def _release(self, count: int = 1):
+        self._pending -= count
+
+    async def _wait(self, future: asyncio.Future) -> Any:
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            future.add_done_callback(_consume_result)
+            raise InferenceTimeoutError(f"Распознавание не завершилось за {self.timeout:.0f} с")
+        except asyncio.CancelledError:
+            if future.cancelled():  # задачу снял перезапуск пула, а не отмена вызывающего
+                raise BrokenProcessPool("Задача распознавания отменена при перезапуске пула")
+            raise
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполняет func(*args) в пуле и возвращает результат.
+        :raises InferenceBusyError: если очередь переполнена.
+        :raises InferenceTimeoutError: если результат не получен за self.timeout секунд.
+        """
+        self._reserve()
+        if self._executor is None:
+            self.start()
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        # Если пул выключен (workers=0), выполняем в стандартном пуле потоков
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+        except Exception:
+            self._release()
+            raise
+        # Слот освобождается только когда задача реально завершилась,
+        # даже если ожидающий обработчик уже ушёл по таймауту
+        future.add_done_callback(lambda _future: self._release())
+
+        try:
+            return await self._wait(future)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    async def recognize(self, audio: Union[str, bytes]) -> Dict[str, Any]:
+        """
+        Распознаёт фонемы в записи (путь к файлу или байты OGG — байты передаются
+        в воркер напрямую, без временных файлов).
+        Возвращает {"phonemes", "duration", "speech_duration"}; записи без речи
+        или слишком длинные отклоняются в воркере до модели (AudioRejectedError).
+        Запрос попадает в текущую пачку; пачка отправляется в воркер,
+        когда наберётся batch_size записей или истечёт batch_wait_ms.
+        """
+        if self.batch_size <= 1:
+            return await self.run(_worker_recognize, audio, self.timeout)
+
+        self._reserve()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((audio, future))
+
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_wait, self._flush_batch)
+
+        return await self._wait(future)
+
+    async def score_gop(self, audio: Union[str, bytes], word_ipas: List[str]) -> Dict[str, Any]:
+        """
+        Распознаёт запись и оценивает произношение эталона по логитам модели (режим gop).
+        Принудительное выравнивание делается для каждой записи отдельно, поэтому такие
+        запросы не объединяются в пачки, но занимают место в общей очереди.
+        """
+        return await self.run(_worker_score_gop, audio, word_ipas, self.timeout)
+
+    def _flush_batch(self):
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(batch))
+        # Держим ссылку на задачу, чтобы её не собрал сборщик мусора
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Union[str, bytes], asyncio.Future]]):
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            results = await loop.run_in_executor(
+                executor, _worker_recognize_batch, [audio for audio, _ in batch], self.timeout
+            )
+        except asyncio.CancelledError:
+            # Пачку снял перезапуск пула (или бот останавливается) — ожидающие получают ошибку сразу,
+            # а не ждут таймаута
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(BrokenProcessPool("Пачка распознавания отменена при перезапуске пула"))
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._restart(executor)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._release(len(batch))
+
+
+# Единый пул распознавания на процесс бота
+inference_pool = InferencePool(
+    workers=INFERENCE_WORKERS,
+    queue_size=INFERENCE_QUEUE_SIZE,
+    timeout=INFERENCE_TIMEOUT,
+    threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+    batch_size=INFERENCE_BATCH_SIZE,
+    batch_wait_ms=INFERENCE_BATCH_WAIT_MS
+)
@@ -0,0 +1,178 @@
+from itertools import groupby
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bot import phoneme_inventory
+
+# Выравнивание эталонных и распознанных фонем (взвешенное расстояние Левенштейна,
+# Needleman–Wunsch). Замена фонемы на похожую (из одной группы similar_groups) стоит
+# дешевле замены на непохожую, поэтому выравнивание не «съезжает» из-за близких звуков.
+# Стоимости целые (в половинах операции), чтобы расчёт был точным.
+
+# Группы похожих фонем для более точного сравнения
+similar_groups = [
+    ['i', 'ɪ', 'iː'],
+    ['e', 'ɛ', 'eː'],
+    ['æ', 'a', 'ʌ'],
+    ['o', 'ɔ', 'oː', 'ʊ'],
+    ['u', 'uː', 'ʊ'],
+    ['ɚ', 'ər', 'ɜr', 'ɜː'],
+    ['θ', 'f'],
+    ['ð', 'v'],
+    ['s', 'z'],
+    ['ʃ', 'ʒ'],
+    ['t', 'd'],
+    ['k', 'g'],
+    ['p', 'b'],
+    ['r', 'ɹ', 'ɻ'],
+    ['l', 'ɫ'],
+]
+
+GAP_COST = 2           # пропуск или лишняя фонема
+SUBSTITUTION_COST = 2  # замена на непохожую фонему
+SIMILAR_COST = 1       # замена на похожую фонему
+
+# Операции выравнивания — как теги difflib.SequenceMatcher
+EQUAL = 'equal'
+REPLACE = 'replace'
+DELETE = 'delete'  # фонема из эталона не произнесена
+INSERT = 'insert'  # лишняя произнесённая фонема
+
+# Шаг выравнивания: (операция, индекс в эталоне или None, индекс в распознанном или None)
+AlignmentStep = Tuple[str, Optional[int], Optional[int]]
+
+
+# Похожие фонемы по ID инвентаря (bot/phoneme_inventory.py) — считается один раз при импорте
+_SIMILAR_IDS = phoneme_inventory.similarity_matrix(similar_groups)
+
+
+def _id_substitution_costs(expected_ids: np.ndarray, user_ids: np.ndarray) -> np.ndarray:
+    """Стоимости замены для массивов ID фонем: выборка из готовой матрицы похожих фонем."""
+    inventory_size = len(phoneme_inventory.PHONEMES)
+    known_expected = expected_ids < inventory_size
+    known_user = user_ids < inventory_size
+    similar = _SIMILAR_IDS[
+        np.where(known_expected, expected_ids, 0)[:, None],
+        np.where(known_user, user_ids, 0)[None, :]
+    ] & known_expected[:, None] & known_user[None, :]
+    costs = np.where(similar, SIMILAR_COST, SUBSTITUTION_COST).astype(np.int64)
+    costs[expected_ids[:, None] == user_ids[None, :]] = 0
+    return costs
+
+
+def substitution_costs(expected: Sequence[Hashable], user: Sequence[Hashable],
+                       groups: List[List[str]] = similar_groups) -> np.ndarray:
+    """
+    Матрица стоимостей замены (len(expected) × len(user)) с учётом групп похожих фонем.
+    Для массивов ID фонем (основной путь) используется готовая матрица инвентаря;
+    произвольные последовательности символов сравниваются через groups.
+    """
+    if isinstance(expected, np.ndarray) and isinstance(user, np.ndarray) and groups is similar_groups:
+        return _id_substitution_costs(expected.astype(np.int64), user.astype(np.int64))
+
+    vocab: Dict[Hashable, int] = {}
+    expected_ids = np.array([vocab.setdefault(token, len(vocab)) for token in expected], dtype=np.int64)
+    user_ids = np.array([vocab.setdefault(token, len(vocab)) for token in user], dtype=np.int64)
+
+    membership = np.zeros((len(vocab), len(groups)), dtype=np.int32)
+    for group_idx, group in enumerate(groups):
+        for token in group:
+            if token in vocab:
+                membership[vocab[token], group_idx] = 1
+    similar = (membership @ membership.T) > 0
+
+    costs = np.where(similar, SIMILAR_COST, SUBSTITUTION_COST).astype(np.int64)
+    np.fill_diagonal(costs, 0)
+    return costs[expected_ids[:, None], user_ids[None, :]]
+
+
+def align(expected: Sequence[Hashable], user: Sequence[Hashable],
+          groups: List[List[str]] = similar_groups) -> List[AlignmentStep]:
+    """
+    Глобальное выравнивание двух последовательностей фонем (массивов ID или строк).
+    Таблица динамического программирования считается построчно средствами NumPy:
+    замены и пропуски — поэлементно по строке, а цепочки вставок — через
+    накопленный минимум (np.minimum.accumulate), так что внутри строки нет цикла Python.
+    Возвращает шаги выравнивания по порядку.
+    """
+    n, m = len(expected), len(user)
+    if n == 0 or m == 0:
+        return [(DELETE, i, None) for i in range(n)] + [(INSERT, None, j) for j in range(m)]
+
+    sub = substitution_costs(expected, user, groups)
+    gaps = np.arange(m + 1, dtype=np.int64) * GAP_COST
+    table = np.empty((n + 1, m + 1), dtype=np.int64)
+    table[0] = gaps
+    best = np.empty(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        prev = table[i - 1]
+        best[0] = prev[0] + GAP_COST
+        np.minimum(prev[:-1] + sub[i - 1], prev[1:] + GAP_COST, out=best[1:])
+        # D[j] = min(best[j], D[j-1] + GAP) = min по k ≤ j (best[k] + (j - k) * GAP)
+        best -= gaps
+        np.minimum.accumulate(best, out=table[i])
+        table[i] += gaps
+
+    # Обратный проход по готовой таблице: на каждом шаге выбираем ход, который даёт
+    # значение клетки (при равенстве — замена/совпадение, затем пропуск, затем вставка)
+    table = table.tolist()
+    sub = sub.tolist()
+    if isinstance(expected, np.ndarray):
+        expected = expected.tolist()
+    if isinstance(user, np.ndarray):
+        user = user.tolist()
+    steps: List[AlignmentStep] = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        current = table[i][j]
+        if i > 0 and j > 0 and current == table[i - 1][j - 1] + sub[i - 1][j - 1]:
+            steps.append((EQUAL if expected[i - 1] == user[j - 1] else REPLACE, i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif i > 0 and current == table[i - 1][j] + GAP_COST:
+            steps.append((DELETE, i - 1, None))
+            i -= 1
+        else:
+            steps.append((INSERT, None, j - 1))
+            j -= 1
+    steps.reverse()
+    return steps
+
+
+def split_by_words(steps: List[AlignmentStep], word_lengths: List[int]) -> List[List[AlignmentStep]]:
+    """
+    Делит выравнивание на слова по длинам эталонных слов (в фонемах) за один проход.
+    Лишние фонемы между словами относятся к предыдущему слову (до первого слова — к первому).
+    """
+    word_of = np.repeat(np.arange(len(word_lengths)), word_lengths)
+    words: List[List[AlignmentStep]] = [[] for _ in word_lengths]
+    if not words:
+        return words
+
+    current = 0
+    for step in steps:
+        expected_idx = step[1]
+        if expected_idx is not None:
+            current = int(word_of[expected_idx])
+        words[current].append(step)
+    return words
+
+
+def runs(steps: List[AlignmentStep]) -> List[Tuple[str, List[int], List[int]]]:
+    """Склеивает подряд идущие одинаковые операции: [(операция, индексы эталона, индексы распознанного)]."""
+    result = []
+    for tag, group in groupby(steps, key=lambda step: step[0]):
+        group = list(group)
+        result.append((
+            tag,
+            [i for _, i, _ in group if i is not None],
+            [j for _, _, j in group if j is not None],
+        ))
+    return result
+
+
+def similarity(steps: List[AlignmentStep]) -> float:
+    """Доля совпадений, как SequenceMatcher.ratio(): 2 * совпадения / (длина эталона + длина распознанного)."""
+    matches = sum(1 for tag, _, _ in steps if tag == EQUAL)
+    total = sum((i is not None) + (j is not None) for _, i, j in steps)
+    return 2 * matches / total if total else 1.0
@@ -0,0 +1,181 @@
+import os
+import time
+from typing import Optional
+
+# Бэкенды инференса для модели распознавания фонем Wav2Vec2.
+# Все бэкенды возвращают логиты одинаковой формы (batch, frames, vocab),
+# поэтому audio_to_phonemes не зависит от выбранного бэкенда.
+# torch и onnxruntime импортируются внутри классов, чтобы модуль оставался лёгким.
+
+BACKEND_TORCH = "torch"
+BACKEND_TORCH_INT8 = "torch_int8"
+BACKEND_ONNX = "onnx"
+AVAILABLE_BACKENDS = (BACKEND_TORCH, BACKEND_TORCH_INT8, BACKEND_ONNX)
+
+
+def _conv_output_length(length, config):
+    """Длина выхода свёрточного энкодера Wav2Vec2 (число кадров) для входа длиной length."""
+    for kernel_size, stride in zip(config.conv_kernel, config.conv_stride):
+        length = (length - kernel_size) // stride + 1
+    return length
+
+
+class TorchPhonemeBackend:
+    """Исходный вариант: модель PyTorch в полной точности (fp32)."""
+    name = BACKEND_TORCH
+
+    def __init__(self, model):
+        self.model = model
+        self.model.eval()
+
+    def logits(self, input_values, attention_mask=None):
+        import torch
+        with torch.no_grad():
+            return self.model(input_values, attention_mask=attention_mask).logits
+
+    def output_lengths(self, input_lengths):
+        """Число кадров логитов для каждой записи по её длине в сэмплах."""
+        return self.model._get_feat_extract_output_lengths(input_lengths)
+
+
+class QuantizedTorchPhonemeBackend(TorchPhonemeBackend):
+    """
+    Динамически квантованная модель PyTorch: веса линейных слоёв хранятся в int8,
+    активации квантуются на лету. Меньше памяти и быстрее на CPU ценой небольшой потери точности.
+    """
+    name = BACKEND_TORCH_INT8
+
+    def __init__(self, model):
+        import torch
+        model.eval()
+        quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(quantized)
+
+
+class OnnxPhonemeBackend:
+    """
+    Модель, экспортированная в ONNX и выполняемая через ONNX Runtime на CPU.
+    Экспорт делается один раз и сохраняется на диск; после экспорта модель PyTorch не нужна.
+    """
+    name = BACKEND_ONNX
+
+    def __init__(self, model, onnx_path: str, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        self.config = model.config
+        if not os.path.exists(onnx_path):
+            export_onnx_model(model, onnx_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def logits(self, input_values, attention_mask=None):
+        import torch
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_values, dtype=torch.long)
+        outputs = self.session.run(
+            ["logits"],
+            {
+                "input_values": input_values.numpy(),
+                "attention_mask": attention_mask.numpy().astype("int64"),
+            }
+        )
+        return torch.from_numpy(outputs[0])
+
+    def output_lengths(self, input_lengths):
+        return _conv_output_length(input_lengths, self.config)
+
+
+# Блокировка экспорта считается брошенной (процесс упал посреди экспорта) через столько секунд
+EXPORT_LOCK_STALE_SECONDS = 3600
+
+
+def _acquire_export_lock(lock_path: str, poll_seconds: float = 1.0):
+    """
+    Файловая блокировка между процессами (O_EXCL работает одинаково на Linux и Windows).
+    Пока другой процесс экспортирует модель, ждём; брошенную блокировку снимаем.
+    """
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > EXPORT_LOCK_STALE_SECONDS:
+                    print(f"Внимание: снимаем брошенную блокировку экспорта {lock_path}")
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue  # блокировку только что сняли — пробуем снова
+            time.sleep(poll_seconds)
+        else:
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return
+
+
+def export_onnx_model(model, onnx_path: str, opset_version: int = 14):
+    """
+    Экспортирует Wav2Vec2ForCTC в ONNX с динамическими размерами пачки и длины записи.
+    Экспорт идёт под файловой блокировкой во временный файл, который затем атомарно
+    переименовывается: другие процессы не увидят недописанную модель и не станут
+    экспортировать её второй раз.
+    """
+    import torch
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    lock_path = f"{onnx_path}.lock"
+    _acquire_export_lock(lock_path)
+    try:
+        if os.path.exists(onnx_path):
+            return  # пока ждали блокировку, модель экспортировал другой процесс
+        model.eval()
+        dummy_input = torch.zeros(1, 16000, dtype=torch.float32)
+        dummy_mask = torch.ones(1, 16000, dtype=torch.long)
+        tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+        print(f"DEBUG: Экспорт модели в ONNX: {onnx_path}...")
+        try:
+            torch.onnx.export(
+                model,
+                (dummy_input, dummy_mask),
+                tmp_path,
+                input_names=["input_values", "attention_mask"],
+                output_names=["logits"],
+                dynamic_axes={
+                    "input_values": {0: "batch", 1: "samples"},
+                    "attention_mask": {0: "batch", 1: "samples"},
+                    "logits": {0: "batch", 1: "frames"},
+                },
+                opset_version=opset_version,
+            )
+            os.replace(tmp_path, onnx_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"DEBUG: Модель экспортирована в ONNX: {onnx_path}")
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+def create_phoneme_backend(name: str, model, onnx_path: Optional[str] = None, num_threads: Optional[int] = None):
+    """
+    Создаёт бэкенд инференса по имени из настроек.
+    Если выбранный бэкенд недоступен (нет onnxruntime, не удался экспорт), используется torch.
+    """
+    try:
+        if name == BACKEND_TORCH_INT8:
+            return QuantizedTorchPhonemeBackend(model)
+        if name == BACKEND_ONNX:
+            return OnnxPhonemeBackend(model, onnx_path, num_threads=num_threads)
+        if name != BACKEND_TORCH:
+            print(f"Внимание: неизвестный бэкенд распознавания '{name}'. Используется '{BACKEND_TORCH}'.")
+    except ImportError as e:
+        print(f"Внимание: бэкенд '{name}' недоступен ({e}). Используется '{BACKEND_TORCH}'.")
+    except Exception as e:
+        print(f"Ошибка инициализации бэкенда '{name}': {e}. Используется '{BACKEND_TORCH}'.")
+    return TorchPhonemeBackend(model)
@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+from threading import Lock
+from typing import Dict, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import PHONEME_CACHE_FILE, PHONEME_CACHE_SIZE
+from bot.cache import LRUCache
+
+
+class ReferencePhonemeStore:
+    """
+    Хранилище эталонных транскрипций eSpeak NG.
+
+    Ключ — (текст, голос, версия espeak-ng): при обновлении eSpeak NG старые
+    транскрипции автоматически перестают использоваться.
+    Перед диском стоит LRU-кэш в памяти; на диске данные хранятся в JSON
+    вида {версия: {голос: {текст: IPA}}}.
+    """
+
+    def __init__(self, path: str = PHONEME_CACHE_FILE, memory_size: int = PHONEME_CACHE_SIZE):
+        self.path = path
+        self._memory = LRUCache(maxsize=memory_size)
+        self._disk: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._lock = Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._disk = json.load(f)
+            total = sum(len(texts) for voices in self._disk.values() for texts in voices.values())
+            print(f"DEBUG: ReferencePhonemeStore: загружено {total} транскрипций из {self.path}")
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"ERROR: Ошибка чтения кэша фонем {self.path}: {e}. Начинаем с пустого кэша.")
+            self._disk = {}
+
+    def get(self, text: str, voice: str, version: str) -> Optional[str]:
+        """Возвращает сохранённую транскрипцию или None."""
+        key = (text, voice, version)
+        ipa = self._memory.get(key)
+        if ipa is not None:
+            return ipa
+        with self._lock:
+            ipa = self._disk.get(version, {}).get(voice, {}).get(text)
+        if ipa is not None:
+            self._memory.set(key, ipa)
+        return ipa
+
+    def put(self, text: str, voice: str, version: str, ipa: str, save: bool = True):
+        """Сохраняет транскрипцию в память и (по умолчанию сразу) на диск."""
+        self._memory.set((text, voice, version), ipa)
+        with self._lock:
+            self._disk.setdefault(version, {}).setdefault(voice, {})[text] = ipa
+            self._dirty = True
+        if save:
+            self.save()
+
+    def save(self):
+        """Записывает накопленные транскрипции на диск (атомарно, через временный файл)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._disk, f, ensure_ascii=False, indent=1)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"ERROR: Ошибка записи кэша фонем {self.path}: {e}")
+
+
+# Единое хранилище эталонных транскрипций на процесс
+phoneme_store = ReferencePhonemeStore()
@@ -0,0 +1,113 @@
+import re
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+# Инвентарь фонем: каждая (нормализованная) фонема — целое число.
+# Эталон eSpeak NG и распознанная речь приводятся к массивам ID одним проходом,
+# и все сравнения работают с небольшими массивами int32, а не со строками.
+# Многосимвольные фонемы (tʃ, aɪ, oʊ, ...) — один токен, а не несколько символов.
+
+# Список диакритических знаков IPA для удаления/нормализации
+DIACRITICS = [
+    'ː', 'ˑ', 'ˈ', 'ˌ', 'ʰ', 'ʷ', 'ʲ',
+    '\u0325', '\u032C', '\u0303', '\u0329', '\u0361', '˞'
+]
+# Знаки ударения/апострофы, которые тоже удаляются
+STRESS_MARKS = ['ˈ', 'ˌ', '`', '´', 'ʼ', "'"]
+
+# Фонемы после нормализации. Порядок задаёт ID, поэтому новые фонемы добавляются только в конец
+PHONEMES = [
+    # аффрикаты и дифтонги (один токен на фонему)
+    'tʃ', 'dʒ', 'aɪ', 'aʊ', 'eɪ', 'oʊ', 'ɔɪ',
+    # согласные
+    'p', 'b', 't', 'd', 'k', 'g', 'f', 'v', 'θ', 'ð', 's', 'z', 'ʃ', 'ʒ', 'h',
+    'm', 'n', 'ŋ', 'l', 'ɫ', 'ɹ', 'ɻ', 'j', 'w', 'ʔ', 'ɾ', 'x',
+    # гласные
+    'i', 'e', 'æ', 'a', 'ɑ', 'ɒ', 'ɔ', 'o', 'ʊ', 'u', 'ʌ', 'ə', 'ɚ', 'ɜ', 'ɐ', 'ᵻ', 'ɨ',
+]
+
+# Упрощение фонем (как раньше в normalize_phonemes): входной символ → фонема инвентаря
+PHONEME_MAPPING = {
+    'əʊ': 'oʊ', 'ɛ': 'e', 'ɪ': 'i', 'r': 'ɹ',
+    'ɡ': 'g',  # IPA ɡ (U+0261) и латинская g — одна фонема
+}
+
+# Символы вне инвентаря получают ID UNKNOWN_OFFSET + код символа: так ID одинаковы
+# во всех процессах (воркеры распознавания возвращают массивы ID в основной процесс)
+UNKNOWN_OFFSET = 1 << 16
+
+# Массив ID фонем (или строка IPA, которая будет токенизирована)
+PhonemeSeq = Union[str, np.ndarray]
+
+PHONEME_IDS: Dict[str, int] = {phoneme: idx for idx, phoneme in enumerate(PHONEMES)}
+_TOKEN_IDS: Dict[str, int] = dict(PHONEME_IDS)
+_TOKEN_IDS.update({source: PHONEME_IDS[target] for source, target in PHONEME_MAPPING.items()})
+
+_STRIP_TABLE = str.maketrans({char: None for char in DIACRITICS + STRESS_MARKS + [' ', '\t', '\n']})
+_MULTI_CHAR_TOKENS = sorted((token for token in _TOKEN_IDS if len(token) > 1), key=len, reverse=True)
+_TOKEN_RE = re.compile('|'.join(map(re.escape, _MULTI_CHAR_TOKENS)) + '|.', re.DOTALL)
+
+
+def _token_id(token: str) -> int:
+    token_id = _TOKEN_IDS.get(token)
+    if token_id is None:
+        # Неизвестный многосимвольный токен невозможен: регулярка выделяет их только из инвентаря
+        token_id = UNKNOWN_OFFSET + ord(token)
+    return token_id
+
+
+def tokenize(ipa: str) -> np.ndarray:
+    """
+    Нормализует строку IPA и превращает её в массив ID фонем за один проход регулярного выражения:
+    диакритика, ударения и пробелы удаляются, схожие фонемы упрощаются (PHONEME_MAPPING).
+    Для эталона eSpeak NG; вывод распознавателя — через tokenize_recognized().
+    """
+    cleaned = ipa.lower().translate(_STRIP_TABLE)
+    return np.fromiter((_token_id(token) for token in _TOKEN_RE.findall(cleaned)), dtype=np.int32)
+
+
+def tokenize_recognized(decoded: str) -> np.ndarray:
+    """
+    Массив ID фонем из вывода распознавателя: декодер CTC разделяет токены модели пробелами,
+    и каждый токен токенизируется отдельно. Так раздельно распознанные «t ʃ» или «a ɪ» остаются
+    двумя фонемами и не склеиваются в аффрикату или дифтонг, как в tokenize() для eSpeak.
+    """
+    ids = [tokenize(token) for token in decoded.split()]
+    return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+
+
+def symbol(phoneme_id: int) -> str:
+    """Фонема по её ID."""
+    if phoneme_id >= UNKNOWN_OFFSET:
+        return chr(phoneme_id - UNKNOWN_OFFSET)
+    return PHONEMES[phoneme_id]
+
+
+def to_string(ids: Sequence[int]) -> str:
+    """Массив ID → строка фонем (для показа пользователю и промптов GPT)."""
+    return ''.join(symbol(int(phoneme_id)) for phoneme_id in ids)
+
+
+def as_ids(phonemes: PhonemeSeq) -> np.ndarray:
+    """Принимает строку IPA или готовый массив ID и возвращает массив ID."""
+    if isinstance(phonemes, str):
+        return tokenize(phonemes)
+    return np.asarray(phonemes, dtype=np.int32)
+
+
+def similarity_matrix(groups: List[List[str]]) -> np.ndarray:
+    """
+    Матрица len(PHONEMES) × len(PHONEMES): True, если фонемы из одной группы похожих.
+    Участники групп нормализуются так же, как фонемы (например, 'ɪ' → 'i', 'r' → 'ɹ').
+    """
+    similar = np.zeros((len(PHONEMES), len(PHONEMES)), dtype=bool)
+    for group in groups:
+        members = set()
+        for phoneme in group:
+            ids = tokenize(phoneme)
+            if len(ids) == 1 and ids[0] < UNKNOWN_OFFSET:
+                members.add(int(ids[0]))
+        members = sorted(members)
+        similar[np.ix_(members, members)] = True
+    return similar
@@ -0,0 +1,250 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import ESPEAK_VOICE, ESPEAK_LIBRARY_PATH
+
+# --- Установка переменной окружения для eSpeak NG ---
+# Автоматическое определение операционной системы и установка пути к eSpeak NG.
+# Убедитесь, что eSpeak NG установлен в стандартных местах или указан в системных переменных PATH.
+
+espeak_path = None # Инициализируем None, чтобы потом проверить, установлен ли путь
+
+if sys.platform.startswith('win'):
+    # Для Windows: ищем espeak-ng.exe в PATH или используем стандартный путь
+    # Можно добавить переменную окружения ESPEAK_NG_PATH для гибкости
+    espeak_ng_executable = "espeak-ng.exe"
+    # Попробуем найти в PATH
+    from shutil import which
+    espeak_path = which(espeak_ng_executable)
+    if not espeak_path:
+        # Если не найдено в PATH, можно указать предполагаемый путь
+        # Пользователь может задать свою переменную окружения ESPEAK_NG_PATH
+        # или изменить этот путь
+        default_win_path = os.environ.get('ESPEAK_NG_PATH', 'C:\\Program Files\\eSpeak NG\\espeak-ng.exe')
+        if os.path.exists(default_win_path):
+            espeak_path = default_win_path
+        else:
+            print(f"Внимание: eSpeak-ng.exe не найден в PATH и по пути '{default_win_path}'. "
+                  "Убедитесь, что eSpeak NG установлен и доступен, или задайте переменную окружения ESPEAK_NG_PATH.")
+            espeak_path = 'espeak-ng' # Попытка использовать как команду, если не найден полный путь
+elif sys.platform.startswith('linux') or sys.platform.startswith('darwin'): # Linux или macOS
+    # Для Linux/macOS: espeak-ng обычно в /usr/bin/ или доступен в PATH
+    espeak_ng_executable = "espeak-ng"
+    # Попробуем найти в PATH
+    from shutil import which
+    espeak_path = which(espeak_ng_executable)
+    if not espeak_path:
+        # Если не найдено в PATH, можно указать предполагаемый путь
+        # Или просто использовать 'espeak-ng' как команду, если она в PATH, но which не сработал
+        default_unix_path = os.environ.get('ESPEAK_NG_PATH', '/usr/bin/espeak-ng')
+        if os.path.exists(default_unix_path):
+            espeak_path = default_unix_path
+        else:
+            print(f"Внимание: espeak-ng не найден в PATH и по пути '{default_unix_path}'. "
+                  "Убедитесь, что eSpeak NG установлен и доступен, или задайте переменную окружения ESPEAK_NG_PATH.")
+            espeak_path = 'espeak-ng' # Попытка использовать как команду
+else:
+    print(f"Внимание: Неизвестная операционная система '{sys.platform}'. "
+          "Проверьте путь к eSpeak NG вручную.")
+    espeak_path = 'espeak-ng' # Попытка использовать как команду по умолчанию
+
+
+def _run_espeak_subprocess(text: str, voice: str) -> str:
+    """Запускает отдельный процесс espeak-ng для одного текста и возвращает IPA."""
+    try:
+        result = subprocess.run(
+            [espeak_path, '-q', '-v', voice, '--ipa', text],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            encoding="utf-8",
+            errors="replace",
+            check=True
+        )
+        return result.stdout.strip()
+    except FileNotFoundError as e:
+        print(f"Ошибка: {e}")
+        return ""
+    except subprocess.CalledProcessError as e:
+        print(f"Ошибка выполнения espeak-ng (код: {e.returncode}): {e.stderr}")
+        return ""
+    except Exception as e:
+        print(f"Общая ошибка при вызове espeak-ng: {e}")
+        return ""
+
+
+def _find_espeak_library() -> Optional[str]:
+    """Ищет разделяемую библиотеку libespeak-ng."""
+    if ESPEAK_LIBRARY_PATH:
+        return ESPEAK_LIBRARY_PATH
+    found = ctypes.util.find_library('espeak-ng')
+    if found:
+        return found
+    if espeak_path and os.path.isabs(espeak_path):
+        # Windows: libespeak-ng.dll лежит рядом с espeak-ng.exe
+        candidate = os.path.join(os.path.dirname(espeak_path), 'libespeak-ng.dll')
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+# Константы из speak_lib.h
+_AUDIO_OUTPUT_SYNCHRONOUS = 0x02
+_CHARS_UTF8 = 1
+_PHONEMES_IPA = 0x02  # phonememode: бит 1 — фонемы в IPA (UTF-8)
+
+
+class EspeakLibrary:
+    """
+    Привязка к libespeak-ng через ctypes: фонемизация внутри процесса бота,
+    без запуска espeak-ng на каждый вызов.
+    Библиотека не потокобезопасна, поэтому все вызовы идут под блокировкой.
+    """
+
+    def __init__(self, library_path: str, voice: str):
+        self._lib = ctypes.cdll.LoadLibrary(library_path)
+        self._lib.espeak_Initialize.restype = ctypes.c_int
+        self._lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        self._lib.espeak_SetVoiceByName.restype = ctypes.c_int
+        self._lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        self._lib.espeak_TextToPhonemes.restype = ctypes.c_char_p
+        self._lib.espeak_TextToPhonemes.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_int, ctypes.c_int]
+        self._lib.espeak_Info.restype = ctypes.c_char_p
+        self._lib.espeak_Info.argtypes = [ctypes.c_void_p]
+        self._lock = Lock()
+        self.voice = None
+
+        if self._lib.espeak_Initialize(_AUDIO_OUTPUT_SYNCHRONOUS, 0, None, 0) <= 0:
+            raise RuntimeError("espeak_Initialize завершилась с ошибкой")
+        self.set_voice(voice)
+        self.version = self._lib.espeak_Info(None).decode('utf-8', errors='replace')
+
+    def set_voice(self, voice: str):
+        if voice == self.voice:
+            return
+        if self._lib.espeak_SetVoiceByName(voice.encode('utf-8')) != 0:
+            raise RuntimeError(f"Голос eSpeak NG '{voice}' не найден")
+        self.voice = voice
+
+    def phonemize(self, text: str, voice: str) -> str:
+        """Возвращает IPA для текста (фразы разных клауз объединяются пробелом)."""
+        with self._lock:
+            self.set_voice(voice)
+            return self._text_to_phonemes(text)
+
+    def phonemize_batch(self, texts: List[str], voice: str) -> List[str]:
+        """Фонемизирует несколько текстов за одно взятие блокировки, сохраняя соответствие текстам."""
+        with self._lock:
+            self.set_voice(voice)
+            return [self._text_to_phonemes(text) for text in texts]
+
+    def _text_to_phonemes(self, text: str) -> str:
+        buffer = ctypes.create_string_buffer(text.encode('utf-8'))
+        text_ptr = ctypes.c_void_p(ctypes.addressof(buffer))
+        clauses = []
+        # espeak_TextToPhonemes обрабатывает текст по клаузам и обнуляет указатель в конце
+        while text_ptr.value:
+            phonemes = self._lib.espeak_TextToPhonemes(ctypes.byref(text_ptr), _CHARS_UTF8, _PHONEMES_IPA)
+            if phonemes:
+                clauses.append(phonemes.decode('utf-8', errors='replace').strip())
+        return ' '.join(clause for clause in clauses if clause)
+
+
+class EspeakPhonemizer:
+    """
+    Долгоживущий фонемизатор eSpeak NG.
+
+    Если доступна libespeak-ng — работает внутри процесса через ctypes;
+    иначе запускает espeak-ng на каждый текст (как раньше).
+    Асинхронные методы выполняются в отдельном потоке и не блокируют event loop.
+    """
+
+    def __init__(self, voice: str = ESPEAK_VOICE):
+        self.voice = voice
+        self._library: Optional[EspeakLibrary] = None
+        self._version: Optional[str] = None
+        # Один поток: библиотека всё равно сериализует вызовы, а очередь остаётся честной
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="espeak")
+
+        library_path = _find_espeak_library()
+        if library_path:
+            try:
+                self._library = EspeakLibrary(library_path, voice)
+                print(f"DEBUG: EspeakPhonemizer: используется libespeak-ng {self._library.version} ({library_path})")
+            except Exception as e:
+                print(f"Внимание: не удалось загрузить libespeak-ng ({library_path}): {e}. "
+                      "Используется запуск espeak-ng на каждый вызов.")
+        else:
+            print("Внимание: libespeak-ng не найдена, используется запуск espeak-ng на каждый вызов.")
+
+    @property
+    def backend(self) -> str:
+        return "library" if self._library else "subprocess"
+
+    @property
+    def version(self) -> str:
+        """Номер версии eSpeak NG (например, '1.51'), определяется один раз."""
+        if self._version is None:
+            if self._library:
+                raw = self._library.version
+            else:
+                try:
+                    raw = subprocess.run(
+                        [espeak_path, '--version'],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        encoding="utf-8",
+                        errors="replace",
+                        check=True
+                    ).stdout
+                except Exception as e:
+                    print(f"Не удалось определить версию espeak-ng: {e}")
+                    raw = ""
+            # "eSpeak NG text-to-speech: 1.51  Data at: ..." -> "1.51"
+            match = re.search(r'\d+\.\d+[\w.\-]*', raw)
+            self._version = match.group(0) if match else "unknown"
+        return self._version
+
+    def phonemize(self, text: str, voice: Optional[str] = None) -> str:
+        """Возвращает IPA для текста (блокирующий вызов)."""
+        voice = voice or self.voice
+        if self._library:
+            try:
+                return self._library.phonemize(text, voice)
+            except Exception as e:
+                print(f"Ошибка libespeak-ng: {e}. Повтор через espeak-ng.")
+        return _run_espeak_subprocess(text, voice)
+
+    def phonemize_batch(self, texts: List[str], voice: Optional[str] = None) -> List[str]:
+        """
+        Возвращает IPA для каждого текста из списка (например, для всех слов фразы),
+        сохраняя границы: i-й результат соответствует i-му тексту.
+        """
+        voice = voice or self.voice
+        if self._library:
+            try:
+                return self._library.phonemize_batch(texts, voice)
+            except Exception as e:
+                print(f"Ошибка libespeak-ng: {e}. Повтор через espeak-ng.")
+        return [_run_espeak_subprocess(text, voice) for text in texts]
+
+    async def phonemize_async(self, text: str, voice: Optional[str] = None) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.phonemize, text, voice)
+
+    async def phonemize_batch_async(self, texts: List[str], voice: Optional[str] = None) -> List[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.phonemize_batch, texts, voice)
+
+
+# Единый фонемизатор на процесс
+phonemizer = EspeakPhonemizer(ESPEAK_VOICE)
@@ -0,0 +1,53 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from bot import phoneme_inventory
+
+# Эталон фразы для проверки произношения: всё, что зависит только от текста задания
+# (транскрипции eSpeak NG фразы и слов, массивы ID, границы слов, пороги оценки),
+# считается один раз на фразу и живёт до конца процесса. Проверка попытки ученика
+# после этого работает только с его записью.
+
+# Сколько фраз держать в памяти (фраз в уроках заметно меньше)
+REFERENCE_CACHE_SIZE = 4096
+
+
+class ReferencePhrase:
+    """
+    Неизменяемый эталон фразы.
+
+    text            — исходный текст задания;
+    words           — слова после _preprocess_text_for_phoneme_splitting;
+    ipa, word_ipas  — транскрипции eSpeak NG фразы и каждого слова (как есть);
+    phoneme_ids     — массив ID фонем всей фразы, phonemes — его строковая форма;
+    word_ids        — массивы ID по словам, flat_ids — они же подряд (для пословного выравнивания);
+    word_lengths    — длины слов в фонемах, word_offsets — начало каждого слова в flat_ids
+                      (последний элемент — общая длина);
+    lower_threshold, upper_threshold — пороги оценки для этой фразы.
+    """
+
+    def __init__(self, text: str, ipa: str, words: List[str], word_ipas: List[str],
+                 thresholds: Tuple[float, float]):
+        self.text = text
+        self.ipa = ipa
+        self.words = list(words)
+        self.word_ipas = list(word_ipas)
+        self.lower_threshold, self.upper_threshold = thresholds
+
+        self.phoneme_ids = phoneme_inventory.tokenize(ipa)
+        self.phonemes = phoneme_inventory.to_string(self.phoneme_ids)
+        self.word_ids = [phoneme_inventory.tokenize(word_ipa) for word_ipa in self.word_ipas]
+        self.word_phonemes = [phoneme_inventory.to_string(ids) for ids in self.word_ids]
+        self.word_lengths = [len(ids) for ids in self.word_ids]
+        self.word_offsets = np.concatenate(([0], np.cumsum(self.word_lengths, dtype=np.int64)))
+        if self.word_ids:
+            self.flat_ids = np.concatenate(self.word_ids)
+        else:
+            self.flat_ids = np.zeros(0, dtype=np.int32)
+
+        for array in [self.phoneme_ids, self.flat_ids, self.word_offsets, *self.word_ids]:
+            array.setflags(write=False)  # общий объект для всех пользователей — только чтение
+
+    def __repr__(self) -> str:
+        return f"ReferencePhrase({self.text!r}, {len(self.words)} слов, {len(self.phoneme_ids)} фонем)"
@@ -1,14 +1,22 @@
+import asyncio
 import json
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from config import DATA_PATH, CURRENT_LESSON_ID
 from datetime import datetime
 from collections import defaultdict
-from typing import Dict, Any, Tuple, List
+from threading import Lock
+from typing import Dict, Any, Tuple, List, Optional
 import traceback
 
 class UserStatistics:
     def __init__(self, data_file="user_statistics.json"):
         self.data_file = os.path.join(DATA_PATH, data_file)
+        # Все записи файла идут через один поток, поэтому строго по порядку (см. _schedule_save)
+        self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="statistics-save")
+        self._save_lock = Lock()
+        self._pending_save: Optional[Future] = None
+        self._pending_snapshot: Optional[str] = None
         self._load_data()
 
     def _load_data(self):
@@ -99,21 +107,64 @@ class UserStatistics:
         else:
             self.data = {}
 
-    def _save_data(self):
-        """Сохраняет данные статистики в файл."""
-        print(f"DEBUG: Вход в _save_data. Путь файла: {self.data_file}") # НОВОЕ ОТЛАДОЧНОЕ СООБЩЕНИЕ
+    def _schedule_save(self) -> Future:
+        """
+        Ставит запись файла в очередь единственного потока _save_executor и возвращает её Future.
+        Снимок данных делается сразу, в потоке вызывающего (event loop, где обработчики меняют
+        self.data), компактным json.dumps — его выполняет быстрый C-кодировщик. Пока запись ещё
+        не началась, новый снимок заменяет прежний (запросы объединяются); если запись уже идёт,
+        ставится следующая. Поэтому записи идут строго по порядку и последняя всегда содержит
+        самое свежее состояние.
+        """
         try:
-            os.makedirs(DATA_PATH, exist_ok=True)
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=4, ensure_ascii=False)
-            print(f"DEBUG: Данные успешно сохранены в {self.data_file}.") # НОВОЕ ОТЛАДОЧНОЕ СООБЩЕНИЕ
-        except IOError as e:
-            print(f"ERROR: Ошибка ввода/вывода при сохранении данных: {e}")
+            snapshot = json.dumps(self.data, ensure_ascii=False)
+        except Exception as e:
+            print(f"ERROR: Ошибка сериализации статистики: {e}")
             print(traceback.format_exc())
+            failed = Future()
+            failed.set_result(None)
+            return failed
+        with self._save_lock:
+            self._pending_snapshot = snapshot
+            if self._pending_save is None:
+                self._pending_save = self._save_executor.submit(self._flush)
+            return self._pending_save
+
+    def _flush(self):
+        """Записывает последний снимок в прежнем формате, с отступами (в потоке _save_executor)."""
+        with self._save_lock:
+            snapshot, self._pending_snapshot = self._pending_snapshot, None
+            self._pending_save = None  # снимки после этой точки запишет следующая запись
+        # Форматирование с indent выполняет медленный Python-кодировщик — здесь, вне event loop
+        self._write_snapshot(json.dumps(json.loads(snapshot), indent=4, ensure_ascii=False))
+
+    def _write_snapshot(self, payload: str):
+        """Записывает готовый JSON в файл (атомарно, через временный файл)."""
+        try:
+            os.makedirs(DATA_PATH, exist_ok=True)
+            tmp_path = f"{self.data_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.data_file)
         except Exception as e:
-            print(f"ERROR: Неизвестная ошибка при сохранении данных: {e}")
+            print(f"ERROR: Ошибка сохранения статистики в {self.data_file}: {e}")
             print(traceback.format_exc())
-        print(f"DEBUG: Выход из _save_data.") # НОВОЕ ОТЛАДОЧНОЕ СООБЩЕНИЕ
+
+    def _save_data(self):
+        """Сохраняет данные статистики в файл (в фоновом потоке, не блокируя вызывающего)."""
+        self._schedule_save()
+
+    def save_data(self):
+        """Публичный вариант _save_data (используется обработчиками)."""
+        self._schedule_save()
+
+    async def save_data_async(self):
+        """Сохраняет статистику в фоновом потоке и дожидается окончания записи."""
+        await asyncio.wrap_future(self._schedule_save())
+
+    def flush(self):
+        """Дожидается записи всех изменений на диск (при остановке бота)."""
+        self._schedule_save().result()
 
     def get_user_stats(self, user_id: int):
         """Возвращает статистику для конкретного пользователя, инициализируя если нет."""
@@ -214,10 +265,12 @@ class UserStatistics:
             self._update_overall_speaking_status(user_id, lesson_id)
 
 
-    def add_pronunciation_attempt(self, user_id: int, word: str, score: float, lesson_id: str = CURRENT_LESSON_ID):
+    def add_pronunciation_attempt(self, user_id: int, word: str, score: float, lesson_id: str = CURRENT_LESSON_ID,
+                                  save: bool = True):
         """
         Добавляет/обновляет результат одной попытки произношения для конкретного слова
         в текущем блоке произношения текущего урока.
+        save=False — только в памяти (файл сохранит последующий save_data_async).
         """
         lesson_stats = self.get_lesson_stats(user_id, lesson_id)
         pronunciation_block = lesson_stats["blocks"]["pronunciation"]
@@ -238,7 +291,8 @@ class UserStatistics:
                 "score": score,
                 "timestamp": datetime.now().isoformat()
             })
-        self._save_data()
+        if save:
+            self._save_data()
 
     def get_current_pronunciation_attempts(self, user_id: int, lesson_id: str = CURRENT_LESSON_ID) -> list:
         """Возвращает список всех сохраненных попыток произношения для текущего урока."""
@@ -938,7 +992,7 @@ class UserStatistics:
     # --- Новые методы для сбора детальной статистики ---
     
     def save_pronunciation_data(self, user_id: int, word: str, user_phonemes: str, 
-                               expected_phonemes: str, accuracy: float):
+                               expected_phonemes: str, accuracy: float, save: bool = True):
         """
         Сохраняет детальные данные о произношении пользователя в существующую структуру attempts.
         
@@ -948,6 +1002,7 @@ class UserStatistics:
             user_phonemes: фонемы, произнесенные пользователем
             expected_phonemes: ожидаемые фонемы
             accuracy: точность произношения (0.0-100.0)
+            save: False — только в памяти (файл сохранит последующий save_data_async)
         """
         lesson_stats = self.get_lesson_stats(user_id)
         
@@ -972,7 +1027,8 @@ class UserStatistics:
             }
             pronunciation_attempts.append(new_attempt)
         
-        self._save_data()
+        if save:
+            self._save_data()
         
         print(f"DEBUG: Сохранены фонемы произношения для пользователя {user_id}: "
               f"слово '{word}', пользователь: '{user_phonemes}', ожидаемые: '{expected_phonemes}'")
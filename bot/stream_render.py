@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import STREAM_EDIT_INTERVAL
+
+# Отрисовка потокового ответа AI в одном сообщении Telegram: текст копится по мере
+# прихода токенов, а сообщение редактируется не чаще раза в STREAM_EDIT_INTERVAL секунд.
+# Первое обновление уходит сразу, поэтому ученик видит начало ответа почти без задержки.
+
+TELEGRAM_TEXT_LIMIT = 4096
+STREAM_CURSOR = " ▌"
+
+
+class ThrottledMessageEditor:
+    """
+    Редактирует сообщение-заглушку («Подумаю...») по мере роста текста.
+
+    update(text) — промежуточный снимок (лишние пропускаются, если правка была недавно);
+    finish(text, reply_markup) — окончательный текст с клавиатурой; если отредактировать
+    не удалось, ответ приходит новым сообщением.
+    Промежуточный текст с незакрытой разметкой Telegram может не принять — такой кадр
+    просто пропускается, следующий снимок его заменит.
+    """
+
+    def __init__(self, message: Message, parse_mode: Optional[str] = None,
+                 interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.parse_mode = parse_mode
+        self.interval = interval
+        self._last_edit = 0.0
+        self._last_text = ""
+        self.edits = 0
+        self.finished = False
+
+    async def update(self, text: str):
+        if not text or text == self._last_text or time.monotonic() - self._last_edit < self.interval:
+            return
+        self._last_edit = time.monotonic()
+        self._last_text = text
+        preview = text[:TELEGRAM_TEXT_LIMIT - len(STREAM_CURSOR)] + STREAM_CURSOR
+        try:
+            await self.message.edit_text(preview, parse_mode=self.parse_mode)
+            self.edits += 1
+        except TelegramRetryAfter as e:
+            # Превысили частоту правок — пропускаем кадры до истечения паузы
+            self._last_edit = time.monotonic() + e.retry_after
+            print(f"DEBUG: Telegram просит паузу {e.retry_after} с при потоковом ответе")
+        except TelegramBadRequest as e:
+            print(f"DEBUG: Промежуточный кадр потокового ответа пропущен: {e}")
+
+    async def finish(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """Показывает окончательный ответ; возвращает сообщение, в котором он оказался."""
+        self.finished = True
+        try:
+            await self.message.edit_text(text, parse_mode=self.parse_mode, reply_markup=reply_markup)
+            self.edits += 1
+            return self.message
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return self.message
+            print(f"Не удалось показать итоговый потоковый ответ правкой сообщения: {e}")
+        except TelegramRetryAfter as e:
+            print(f"DEBUG: Telegram просит паузу {e.retry_after} с, итоговый ответ отправляется новым сообщением")
+        try:
+            await self.message.delete()
+        except TelegramBadRequest:
+            pass
+        return await self.message.answer(text, parse_mode=self.parse_mode, reply_markup=reply_markup)
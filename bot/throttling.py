@@ -0,0 +1,151 @@
+import asyncio
+import math
+import os
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (PRONUNCIATION_RATE_PER_MINUTE, PRONUNCIATION_RATE_BURST,
+                    SPEAKING_RATE_PER_MINUTE, SPEAKING_RATE_BURST,
+                    VOICE_MAX_CONCURRENT, VOICE_ADMISSION_WAIT_SECONDS)
+from bot.cache import LRUCache
+
+# Ограничение дорогих обработчиков голосовых (модель произношения, Whisper, GPT).
+# Обработчик помечается флагом expensive с именем класса нагрузки:
+#     @router.message(F.voice, ..., flags={"expensive": EXPENSIVE_PRONUNCIATION})
+# и проходит через VoiceAdmissionMiddleware: у каждого пользователя своё «ведро токенов»
+# на каждый класс, а число одновременно выполняемых дорогих обработчиков ограничено
+# общим семафором. Если лимит исчерпан, пользователь сразу получает ответ «занято»,
+# а не ждёт в очереди за десятками чужих (или своих же) записей.
+
+EXPENSIVE_PRONUNCIATION = "pronunciation"  # распознавание произношения (пул модели)
+EXPENSIVE_SPEAKING = "speaking"            # Whisper + GPT в блоке говорения
+
+DEFAULT_LIMITS = {
+    EXPENSIVE_PRONUNCIATION: (PRONUNCIATION_RATE_PER_MINUTE, PRONUNCIATION_RATE_BURST),
+    EXPENSIVE_SPEAKING: (SPEAKING_RATE_PER_MINUTE, SPEAKING_RATE_BURST),
+}
+
+
+class TokenBucket:
+    """
+    Ведро токенов: вмещает до burst запросов подряд и пополняется со скоростью
+    rate_per_minute. Используется только из event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def refund(self):
+        """Возвращает токен (запрос не был выполнен не по вине пользователя)."""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def retry_after(self) -> float:
+        """Через сколько секунд появится следующий токен."""
+        self._refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class VoiceAdmissionMiddleware(BaseMiddleware):
+    """
+    Inner-middleware для сообщений: пропускает обработчики с флагом expensive,
+    только если у пользователя есть токен для этого класса и есть свободное место
+    под общим семафором (ждёт его не дольше wait_seconds).
+    Обработчики без флага проходят без проверок.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, int]]] = None,
+                 max_concurrent: int = VOICE_MAX_CONCURRENT,
+                 wait_seconds: float = VOICE_ADMISSION_WAIT_SECONDS):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.max_concurrent = max_concurrent
+        self.wait_seconds = wait_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # Ведра по (пользователь, класс); ведро, не трогавшееся час, и так было бы полным
+        self._buckets = LRUCache(maxsize=10000, ttl=3600)
+        self.active = 0
+        self.rejected_rate = 0
+        self.rejected_busy = 0
+
+    def _bucket(self, user_id: int, kind: str) -> Optional[TokenBucket]:
+        if kind not in self.limits:
+            return None
+        bucket = self._buckets.get((user_id, kind))
+        if bucket is None:
+            bucket = TokenBucket(*self.limits[kind])
+        # set при каждом обращении продлевает TTL активного ведра
+        self._buckets.set((user_id, kind), bucket)
+        return bucket
+
+    def stats(self) -> Dict[str, int]:
+        """Текущая нагрузка и число отказов (для логов и отладки)."""
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "rejected_rate": self.rejected_rate,
+            "rejected_busy": self.rejected_busy,
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        kind = get_flag(data, "expensive")
+        if not kind or not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        bucket = self._bucket(user_id, kind)
+        if bucket is not None and not bucket.try_acquire():
+            self.rejected_rate += 1
+            wait = math.ceil(bucket.retry_after())
+            print(f"DEBUG: Лимит голосовых ({kind}) для пользователя {user_id}, повтор через {wait} с")
+            await event.answer(f"⏳ Слишком много голосовых подряд. Подожди {wait} сек. и отправь запись ещё раз.")
+            return None
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_seconds)
+        except asyncio.TimeoutError:
+            self.rejected_busy += 1
+            if bucket is not None:
+                bucket.refund()
+            print(f"DEBUG: Все слоты дорогих обработчиков заняты ({self.max_concurrent}), "
+                  f"отказ пользователю {user_id} ({kind})")
+            await event.answer("⏳ Сейчас очень много записей на проверке. "
+                               "Пожалуйста, отправь голосовое ещё раз через минуту.")
+            return None
+
+        self.active += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+
+# Единый экземпляр на процесс (регистрируется в main.py)
+voice_admission = VoiceAdmissionMiddleware()
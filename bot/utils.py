@@ -1,80 +1,116 @@
 import json
 import os
 import asyncio
+import hashlib
 import sys
 import re
 import random
+import threading
+import time
 import numpy as np
-import librosa
-import torch
-import torchaudio
 import subprocess
 import sys
-from typing import Dict, List, Tuple, Any, Optional
+from typing import AsyncIterator, Dict, List, Tuple, Any, Optional
+from contextlib import asynccontextmanager
 from gtts import gTTS
 import aiofiles
-from openai import AsyncOpenAI
 import tempfile
 from aiogram import types # Оставляем types, так как он нужен для handle_voice_message
 from aiogram.types import FSInputFile # Добавляем для работы с файлами, если потребуется в других функциях
-from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC, Wav2Vec2FeatureExtractor, Wav2Vec2CTCTokenizer
 from difflib import SequenceMatcher
 import subprocess
 from datetime import datetime # Добавляем datetime для создания уникальных имен файлов
 from bot.statistics import UserStatistics
-# --- Установка переменной окружения для eSpeak NG ---
-# Автоматическое определение операционной системы и установка пути к eSpeak NG.
-# Убедитесь, что eSpeak NG установлен в стандартных местах или указан в системных переменных PATH.
-
-espeak_path = None # Инициализируем None, чтобы потом проверить, установлен ли путь
-
-if sys.platform.startswith('win'):
-    # Для Windows: ищем espeak-ng.exe в PATH или используем стандартный путь
-    # Можно добавить переменную окружения ESPEAK_NG_PATH для гибкости
-    espeak_ng_executable = "espeak-ng.exe"
-    # Попробуем найти в PATH
-    from shutil import which
-    espeak_path = which(espeak_ng_executable)
-    if not espeak_path:
-        # Если не найдено в PATH, можно указать предполагаемый путь
-        # Пользователь может задать свою переменную окружения ESPEAK_NG_PATH
-        # или изменить этот путь
-        default_win_path = os.environ.get('ESPEAK_NG_PATH', 'C:\\Program Files\\eSpeak NG\\espeak-ng.exe')
-        if os.path.exists(default_win_path):
-            espeak_path = default_win_path
-        else:
-            print(f"Внимание: eSpeak-ng.exe не найден в PATH и по пути '{default_win_path}'. "
-                  "Убедитесь, что eSpeak NG установлен и доступен, или задайте переменную окружения ESPEAK_NG_PATH.")
-            espeak_path = 'espeak-ng' # Попытка использовать как команду, если не найден полный путь
-elif sys.platform.startswith('linux') or sys.platform.startswith('darwin'): # Linux или macOS
-    # Для Linux/macOS: espeak-ng обычно в /usr/bin/ или доступен в PATH
-    espeak_ng_executable = "espeak-ng"
-    # Попробуем найти в PATH
-    from shutil import which
-    espeak_path = which(espeak_ng_executable)
-    if not espeak_path:
-        # Если не найдено в PATH, можно указать предполагаемый путь
-        # Или просто использовать 'espeak-ng' как команду, если она в PATH, но which не сработал
-        default_unix_path = os.environ.get('ESPEAK_NG_PATH', '/usr/bin/espeak-ng')
-        if os.path.exists(default_unix_path):
-            espeak_path = default_unix_path
-        else:
-            print(f"Внимание: espeak-ng не найден в PATH и по пути '{default_unix_path}'. "
-                  "Убедитесь, что eSpeak NG установлен и доступен, или задайте переменную окружения ESPEAK_NG_PATH.")
-            espeak_path = 'espeak-ng' # Попытка использовать как команду
-else:
-    print(f"Внимание: Неизвестная операционная система '{sys.platform}'. "
-          "Проверьте путь к eSpeak NG вручную.")
-    espeak_path = 'espeak-ng' # Попытка использовать как команду по умолчанию
-# --- Загрузка моделей один раз при старте приложения ---
-# Эти модели используются для фонетического анализа Wav2Vec2
-feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained("facebook/wav2vec2-lv-60-espeak-cv-ft")
-tokenizer = Wav2Vec2CTCTokenizer.from_pretrained("facebook/wav2vec2-lv-60-espeak-cv-ft")
-processor = Wav2Vec2Processor(feature_extractor=feature_extractor, tokenizer=tokenizer)
-model = Wav2Vec2ForCTC.from_pretrained("facebook/wav2vec2-lv-60-espeak-cv-ft")
-
+from bot.inference import inference_pool, InferenceTimeoutError
+from bot.ai_client import get_ai_client
+from bot.ai_governor import (ai_governor, AIQueueTimeoutError, PRIORITY_INTERACTIVE, PRIORITY_FEEDBACK,
+                             PRIORITY_BACKGROUND)
+from bot.circuit_breaker import CircuitBreaker, ai_breaker
+from bot.answer_cache import teacher_answer_cache
+from bot.writing_feedback import WritingFeedbackService
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DATA_PATH, AUDIO_PATH, OPENAI_API_KEY
+from config import (DATA_PATH, AUDIO_PATH, OPENAI_API_KEY, PHONEME_BACKEND, PHONEME_ONNX_PATH, ESPEAK_VOICE,
+                    INFERENCE_CHUNK_SECONDS, INFERENCE_CHUNK_STRIDE_SECONDS,
+                    PRONUNCIATION_SCORING, GOP_PHONEME_THRESHOLD,
+                    PRONUNCIATION_RESULT_CACHE_SIZE, PRONUNCIATION_RESULT_CACHE_TTL,
+                    ARCHIVED_VOICES_PATH)
+from bot.phoneme_cache import phoneme_store
+from bot.phonemizer import phonemizer, espeak_path
+from bot import audio_frontend
+from bot.audio_frontend import AudioSource, AudioRejectedError
+from bot import phoneme_alignment
+from bot.phoneme_alignment import similar_groups
+from bot import phoneme_inventory
+from bot.phoneme_inventory import DIACRITICS, PhonemeSeq
+from bot import gop
+from bot.cache import LRUCache
+from bot.reference_phrase import ReferencePhrase, REFERENCE_CACHE_SIZE
+
+# --- Ленивая загрузка моделей ---
+# Модели Wav2Vec2 для фонетического анализа (и сами torch/transformers) загружаются
+# при первом обращении, а не при импорте модуля: бот начинает отвечать сразу после
+# запуска, а блоки без произношения не платят за модель ни временем, ни памятью.
+PHONEME_MODEL_NAME = "facebook/wav2vec2-lv-60-espeak-cv-ft"
+_phoneme_model = None  # (processor, backend) после первой загрузки
+_phoneme_model_lock = threading.Lock()
+
+
+def load_phoneme_model(backend_name: str = PHONEME_BACKEND):
+    """
+    Загружает процессор Wav2Vec2 и бэкенд инференса (torch, torch_int8 или onnx).
+    Каждый вызов загружает модель заново; в боте используйте get_phoneme_model().
+    """
+    import torch
+    from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC, Wav2Vec2FeatureExtractor, Wav2Vec2CTCTokenizer
+    from bot.phoneme_backends import create_phoneme_backend
+
+    print(f"DEBUG: Загрузка модели {PHONEME_MODEL_NAME} (бэкенд: {backend_name})...")
+    feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(PHONEME_MODEL_NAME)
+    tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(PHONEME_MODEL_NAME)
+    processor = Wav2Vec2Processor(feature_extractor=feature_extractor, tokenizer=tokenizer)
+    model = Wav2Vec2ForCTC.from_pretrained(PHONEME_MODEL_NAME)
+    backend = create_phoneme_backend(backend_name, model, onnx_path=PHONEME_ONNX_PATH,
+                                     num_threads=torch.get_num_threads())
+    print(f"DEBUG: Модель {PHONEME_MODEL_NAME} загружена (бэкенд: {backend.name}).")
+    return processor, backend
+
+
+def phoneme_onnx_export_needed(backend_name: str = PHONEME_BACKEND) -> bool:
+    """Выбран бэкенд onnx, а файла модели ещё нет (проверка без импорта torch)."""
+    from bot.phoneme_backends import BACKEND_ONNX
+    return backend_name == BACKEND_ONNX and not os.path.exists(PHONEME_ONNX_PATH)
+
+
+def export_phoneme_onnx_model(backend_name: str = PHONEME_BACKEND):
+    """
+    Для бэкенда onnx экспортирует модель заранее, чтобы воркеры загружали готовый файл,
+    а не экспортировали его одновременно. Тяжёлый вызов (transformers, torch): пул
+    распознавания выполняет его в отдельном процессе, а не в процессе бота.
+    """
+    from bot.phoneme_backends import export_onnx_model
+
+    if not phoneme_onnx_export_needed(backend_name):
+        return
+    from transformers import Wav2Vec2ForCTC
+
+    model = Wav2Vec2ForCTC.from_pretrained(PHONEME_MODEL_NAME)
+    export_onnx_model(model, PHONEME_ONNX_PATH)
+    del model
+
+
+def get_phoneme_model():
+    """
+    Возвращает (processor, backend) для распознавания фонем, загружая их один раз при первом вызове.
+    Бэкенд выбирается настройкой PHONEME_BACKEND. Потокобезопасно: параллельные вызовы
+    дождутся одной и той же загрузки.
+    """
+    global _phoneme_model
+    if _phoneme_model is None:
+        with _phoneme_model_lock:
+            if _phoneme_model is None:
+                _phoneme_model = load_phoneme_model(PHONEME_BACKEND)
+    return _phoneme_model
+
 
 # Проверяем доступность OpenAI API
 OPENAI_AVAILABLE = bool(OPENAI_API_KEY)
@@ -256,141 +292,520 @@ class UserProgress:
 
 # --- Функции для обработки произношения ---
 
-async def convert_ogg_to_wav(input_path: str, output_path: str):
-    """Конвертирует OGG аудиофайл в WAV."""
+def _convert_ogg_to_wav_sync(input_path: str, output_path: str) -> bool:
+    """Синхронная часть конвертации OGG → WAV (выполняется вне event loop)."""
+    import torchaudio
     try:
-        waveform, sample_rate = torchaudio.load(input_path)
-        if waveform.shape[0] > 1:
-            waveform = torch.mean(waveform, dim=0, keepdim=True)  # Конвертируем стерео в моно
-        if sample_rate != 16000:
-            resampler = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=16000)
-            waveform = resampler(waveform)
-        torchaudio.save(output_path, waveform, 16000, format="wav")
+        waveform = audio_frontend.load_mono(input_path)  # моно, 16 кГц
+        torchaudio.save(output_path, waveform.unsqueeze(0), audio_frontend.TARGET_SAMPLE_RATE, format="wav")
         return True
     except Exception as e:
         print(f"Ошибка конвертации ogg → wav: {e}")
         return False
 
 
-# Список диакритических знаков IPA для удаления/нормализации
-DIACRITICS = [
-    'ː', 'ˑ', 'ˈ', 'ˌ', 'ʰ', 'ʷ', 'ʲ',
-    '\u0325', '\u032C', '\u0303', '\u0329', '\u0361', '˞'
-]
-
-# Группы похожих фонем для более точного сравнения
-similar_groups = [
-    ['i', 'ɪ', 'iː'],
-    ['e', 'ɛ', 'eː'],
-    ['æ', 'a', 'ʌ'],
-    ['o', 'ɔ', 'oː', 'ʊ'],
-    ['u', 'uː', 'ʊ'],
-    ['ɚ', 'ər', 'ɜr', 'ɜː'],
-    ['θ', 'f'],
-    ['ð', 'v'],
-    ['s', 'z'],
-    ['ʃ', 'ʒ'],
-    ['t', 'd'],
-    ['k', 'g'],
-    ['p', 'b'],
-    ['r', 'ɹ', 'ɻ'],
-    ['l', 'ɫ'],
-]
+async def convert_ogg_to_wav(input_path: str, output_path: str):
+    """Конвертирует OGG аудиофайл в WAV."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, _convert_ogg_to_wav_sync, input_path, output_path)
 
 
-def normalize_phonemes(phonemes: str) -> str:
-    """Нормализует фонемы, удаляя диакритические знаки и преобразуя схожие фонемы."""
-    s = phonemes.strip()
-    for d in DIACRITICS:
-        esc = re.escape(d)
-        s = re.sub(rf'([^\s])\s*{esc}', r'\1', s)  # Удаляем диакритику, если она следует за фонемой без пробела
-    s = re.sub(r'[ˈˌ`´ʼ\']', '', s)  # Удаляем знаки ударения/апострофы
-
-    # Карта для упрощения фонем
-    phoneme_mapping = {
-        'ɜː': 'ɚ', 'əʊ': 'oʊ', 'ɛ': 'e', 'ɔː': 'ɑː', 'ɪ': 'i', 'ʌ': 'ʌ',
-        'aɪ': 'aɪ', 'æ': 'æ', 'ð': 'ð', 'θ': 'θ', 'ŋ': 'ŋ', 'ʃ': 'ʃ',
-        'ʒ': 'ʒ', 'tʃ': 'tʃ', 'dʒ': 'dʒ', 'j': 'j', 'w': 'w', 'r': 'ɹ',
-        'l': 'l',
-    }
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks = set()
 
-    for old, new in phoneme_mapping.items():
-        s = s.replace(old, new)
 
-    s = ''.join(s.split()).lower()  # Удаляем все пробелы и приводим к нижнему регистру
-    return s.strip()
+def _background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"ERROR: Ошибка фоновой задачи {task.get_name()}: {task.exception()!r}")
+
+
+def spawn_background_task(coro) -> asyncio.Task:
+    """
+    Запускает корутину в фоне (побочные эффекты, не влияющие на ответ пользователю).
+    Ошибка задачи только логируется.
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def _sanitize_filename(text: str, max_length: int = 50) -> str:
+    """
+    Очищает строку для использования в качестве части имени файла.
+    Удаляет недопустимые символы и обрезает строку до max_length.
+    """
+    sanitized = re.sub(r'[^\w\s-]', '', text).strip()
+    sanitized = re.sub(r'\s+', '_', sanitized)
+    sanitized = re.sub(r'__+', '_', sanitized)
+    sanitized = sanitized.strip('_')
+    return sanitized[:max_length]
 
 
-def get_phonemes_from_espeak(text: str) -> str:
-    """Получает фонемы (IPA) для текста с помощью eSpeak NG."""
+async def archive_voice(voice_bytes: bytes, filename: str, metadata: Optional[Dict[str, Any]] = None):
+    """
+    Сохраняет копию голосового сообщения в media/archived_voices.
+    metadata (полный текст задания, оценка и т.п.) пишется рядом в <filename>.json —
+    по нему scripts/rescore_archived_voices.py перепроверяет запись.
+    """
     try:
-        result = subprocess.run(
-            [espeak_path, '-q', '--ipa', text],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding="utf-8",
-            errors="replace",
-            check=True
-        )
-        return result.stdout.strip()
-    except FileNotFoundError as e:
-        print(f"Ошибка: {e}")
-        return ""
-    except subprocess.CalledProcessError as e:
-        print(f"Ошибка выполнения espeak-ng (код: {e.returncode}): {e.stderr}")
-        return ""
+        os.makedirs(ARCHIVED_VOICES_PATH, exist_ok=True)
+        voice_path = os.path.join(ARCHIVED_VOICES_PATH, filename)
+        async with aiofiles.open(voice_path, 'wb') as f:
+            await f.write(voice_bytes)
+        if metadata is not None:
+            async with aiofiles.open(f"{voice_path}.json", 'w', encoding='utf-8') as f:
+                await f.write(json.dumps(metadata, ensure_ascii=False, indent=2))
     except Exception as e:
-        print(f"Общая ошибка при вызове espeak-ng: {e}")
-        return ""
+        print(f"Ошибка архивации голосового сообщения {filename}: {e}")
+
+
+def normalize_phonemes(phonemes: str) -> str:
+    """
+    Нормализует фонемы, удаляя диакритические знаки и преобразуя схожие фонемы.
+    Строковая форма phoneme_inventory.tokenize(): для сравнений используйте массивы ID.
+    """
+    return phoneme_inventory.to_string(phoneme_inventory.tokenize(phonemes))
+
+
+def get_espeak_version() -> str:
+    """Версия eSpeak NG — часть ключа кэша эталонных транскрипций."""
+    return phonemizer.version
+
+
+def get_phonemes_from_espeak(text: str, voice: str = ESPEAK_VOICE) -> str:
+    """
+    Получает фонемы (IPA) для текста с помощью eSpeak NG.
+    Результат кэшируется (в памяти и на диске) по (текст, голос, версия espeak-ng),
+    поэтому для известных фраз eSpeak NG не вызывается вовсе.
+    """
+    version = get_espeak_version()
+    cached = phoneme_store.get(text, voice, version)
+    if cached is not None:
+        return cached
+
+    ipa = phonemizer.phonemize(text, voice)
+    if ipa:  # Ошибки не кэшируем
+        phoneme_store.put(text, voice, version, ipa)
+    return ipa
+
+
+def _store_phonemes(texts: List[str], results: List[str], voice: str, version: str):
+    for text, ipa in zip(texts, results):
+        if ipa:
+            phoneme_store.put(text, voice, version, ipa, save=False)
+    phoneme_store.save()
+
+
+def get_phonemes_batch_from_espeak(texts: List[str], voice: str = ESPEAK_VOICE) -> List[str]:
+    """
+    Получает фонемы (IPA) для списка текстов одним обращением к фонемизатору.
+    i-й результат соответствует i-му тексту; уже известные тексты берутся из кэша.
+    """
+    version = get_espeak_version()
+    results = [phoneme_store.get(text, voice, version) for text in texts]
+    missing = [text for text, ipa in zip(texts, results) if ipa is None]
+    if missing:
+        fresh = dict(zip(missing, phonemizer.phonemize_batch(missing, voice)))
+        _store_phonemes(missing, [fresh[text] for text in missing], voice, version)
+        results = [ipa if ipa is not None else fresh[text] for text, ipa in zip(texts, results)]
+    return results
+
+
+async def get_phonemes_batch_from_espeak_async(texts: List[str], voice: str = ESPEAK_VOICE) -> List[str]:
+    """Асинхронная версия get_phonemes_batch_from_espeak: фонемизация не блокирует event loop."""
+    version = get_espeak_version()
+    results = [phoneme_store.get(text, voice, version) for text in texts]
+    missing = [text for text, ipa in zip(texts, results) if ipa is None]
+    if missing:
+        fresh = dict(zip(missing, await phonemizer.phonemize_batch_async(missing, voice)))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, _store_phonemes, missing, [fresh[text] for text in missing], voice, version
+        )
+        results = [ipa if ipa is not None else fresh[text] for text, ipa in zip(texts, results)]
+    return results
+
+
+async def prepare_reference_phonemes_async(target_text: str):
+    """
+    Готовит в кэше транскрипции фразы целиком и каждого её слова,
+    чтобы дальнейший (синхронный) анализ брал их из кэша, не блокируя event loop.
+    """
+    words = _preprocess_text_for_phoneme_splitting(target_text).split()
+    await get_phonemes_batch_from_espeak_async(list(dict.fromkeys([target_text] + words)))
+
+
+# Эталоны фраз (bot/reference_phrase.py) по (текст, голос, версия eSpeak NG)
+_reference_phrases = LRUCache(maxsize=REFERENCE_CACHE_SIZE)
+
+
+def get_reference_phrase(target_text: str, voice: str = ESPEAK_VOICE) -> ReferencePhrase:
+    """
+    Возвращает эталон фразы, собирая его при первом обращении: транскрипции фразы и слов,
+    массивы ID фонем, границы слов и пороги оценки считаются один раз на процесс.
+    Блокирующая функция (при промахе кэша может вызвать eSpeak NG).
+    """
+    key = (target_text, voice, get_espeak_version())
+    reference = _reference_phrases.get(key)
+    if reference is not None:
+        return reference
+
+    words = _preprocess_text_for_phoneme_splitting(target_text).split()
+    texts = list(dict.fromkeys([target_text] + words))
+    ipa_by_text = dict(zip(texts, get_phonemes_batch_from_espeak(texts, voice)))
+    reference = ReferencePhrase(
+        target_text,
+        ipa_by_text[target_text],
+        words,
+        [ipa_by_text[word] for word in words],
+        pronunciation_thresholds(target_text)
+    )
+    if reference.ipa:  # Ошибки eSpeak NG не кэшируем, как и в хранилище транскрипций
+        _reference_phrases.set(key, reference)
+    return reference
+
+
+async def get_reference_phrase_async(target_text: str, voice: str = ESPEAK_VOICE) -> ReferencePhrase:
+    """Эталон фразы без блокировки event loop: при промахе транскрипции готовятся в фоне."""
+    reference = _reference_phrases.get((target_text, voice, get_espeak_version()))
+    if reference is None:
+        await prepare_reference_phonemes_async(target_text)
+        reference = get_reference_phrase(target_text, voice)
+    return reference
+
+
+def precompute_reference_phonemes() -> int:
+    """
+    Заранее получает транскрипции eSpeak NG для всех слов и фраз блока произношения
+    и фраз блока аудирования (целиком и по отдельным словам), чтобы проверка
+    известной фразы не обращалась к eSpeak NG. Возвращает число подготовленных текстов.
+    Блокирующая функция: из async-кода вызывайте через run_in_executor.
+    """
+    texts = []
+    sources = (("2_pronouncing_words.json", "english"), ("listening_phrases_it.json", "phrase"))
+    for filename, field in sources:
+        try:
+            with open(os.path.join(DATA_PATH, filename), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Не удалось загрузить {filename} для подготовки фонем: {e}")
+            continue
+        items = data.get("words", []) if isinstance(data, dict) else data
+        texts.extend(item[field] for item in items if isinstance(item, dict) and item.get(field))
+
+    unique_texts = []
+    for text in texts:
+        for candidate in [text] + _preprocess_text_for_phoneme_splitting(text).split():
+            if candidate not in unique_texts:
+                unique_texts.append(candidate)
+
+    results = get_phonemes_batch_from_espeak(unique_texts)
+    prepared = sum(1 for ipa in results if ipa)
+    # Эталоны фраз собираются сразу: все транскрипции уже в кэше
+    for text in dict.fromkeys(texts):
+        get_reference_phrase(text)
+    print(f"DEBUG: Эталонные фонемы подготовлены: {prepared}/{len(unique_texts)}, "
+          f"эталонов фраз: {len(_reference_phrases)} (eSpeak NG: {phonemizer.backend})")
+    return prepared
+
+
+def text_to_phoneme_ids(text: str) -> np.ndarray:
+    """Преобразует текст в массив ID фонем (эталон eSpeak NG, см. bot/phoneme_inventory.py)."""
+    return phoneme_inventory.tokenize(get_phonemes_from_espeak(text))
 
 
 def text_to_phonemes_simplified(text: str) -> str:
     """Преобразует текст в упрощенные фонемы."""
-    ipa_output = get_phonemes_from_espeak(text)
-    normalized = normalize_phonemes(ipa_output)
-    return normalized
+    return phoneme_inventory.to_string(text_to_phoneme_ids(text))
+
+
+def _load_waveform_for_model(audio: AudioSource) -> np.ndarray:
+    """
+    Загружает аудио, приводит к моно 16 кГц и нормализует громкость для Wav2Vec2.
+    :param audio: путь к файлу или байты голосового сообщения Telegram (OGG/Opus),
+                  которые декодируются прямо в памяти.
+    """
+    return audio_frontend.load_for_model(audio)
+
+
+def _phoneme_ids_from_waveforms(waveforms: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Распознаёт фонемы (массивы ID) для нескольких записей одним проходом модели.
+    Записи дополняются нулями до общей длины, а attention_mask исключает
+    дополнение из расчёта, поэтому результат для каждой записи совпадает
+    с распознаванием этой записи по отдельности.
+    """
+    import torch
+    processor, backend = get_phoneme_model()
+
+    if len(waveforms) == 1:
+        input_values = processor(waveforms[0], return_tensors="pt", sampling_rate=16000).input_values
+        logits = backend.logits(input_values)
+        predicted_ids = torch.argmax(logits, dim=-1)
+        return [phoneme_inventory.tokenize_recognized(processor.decode(predicted_ids[0]))]
+
+    inputs = processor(
+        waveforms,
+        return_tensors="pt",
+        sampling_rate=16000,
+        padding=True,
+        return_attention_mask=True
+    )
+    logits = backend.logits(inputs.input_values, attention_mask=inputs.attention_mask)
+    predicted_ids = torch.argmax(logits, dim=-1)
+    # Число кадров модели, соответствующих реальной (не дополненной) длине каждой записи
+    frame_lengths = backend.output_lengths(inputs.attention_mask.sum(dim=-1))
+
+    transcriptions = []
+    for ids, length in zip(predicted_ids, frame_lengths):
+        transcriptions.append(phoneme_inventory.tokenize_recognized(processor.decode(ids[:int(length)])))
+    return transcriptions
+
+
+def _chunk_windows(length: int, chunk: int, stride: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Делит запись длиной length сэмплов на окна не длиннее chunk.
+    Каждое окно — (start, end, left, right): центральная часть окна плюс контекст
+    до stride сэмплов слева и справа (left/right — сколько контекста реально взято).
+    Центральные части окон идут встык и покрывают всю запись.
+    """
+    step = max(1, chunk - 2 * stride)
+    windows = []
+    core_start = 0
+    while core_start < length:
+        core_end = min(length, core_start + step)
+        start = max(0, core_start - stride)
+        end = min(length, core_end + stride)
+        windows.append((start, end, core_start - start, end - core_end))
+        core_start = core_end
+    return windows
+
+
+def _iter_long_waveform_logits(waveform: np.ndarray, deadline: Optional[float] = None):
+    """
+    Прогоняет длинную запись через модель по перекрывающимся окнам INFERENCE_CHUNK_SECONDS
+    и по очереди отдаёт логиты (frames, vocab) центральной части каждого окна:
+    контекст по краям нужен модели, но отбрасывается, а центральные части идут встык.
+    Пиковая память определяется длиной окна, а не всей записи.
+    :raises InferenceTimeoutError: если запись не распознана к моменту deadline (time.monotonic()).
+    """
+    processor, backend = get_phoneme_model()
+
+    chunk = int(INFERENCE_CHUNK_SECONDS * audio_frontend.TARGET_SAMPLE_RATE)
+    stride = int(INFERENCE_CHUNK_STRIDE_SECONDS * audio_frontend.TARGET_SAMPLE_RATE)
+    windows = _chunk_windows(len(waveform), chunk, stride)
+
+    for done, (start, end, left, right) in enumerate(windows):
+        if deadline is not None and time.monotonic() > deadline:
+            raise InferenceTimeoutError(
+                f"Распознавание длинной записи прервано по времени ({done}/{len(windows)} окон)"
+            )
+        input_values = processor(waveform[start:end], return_tensors="pt", sampling_rate=16000).input_values
+        logits = backend.logits(input_values)[0]
+        frames_per_sample = logits.shape[0] / (end - start)
+        first = int(round(left * frames_per_sample))
+        last = logits.shape[0] - int(round(right * frames_per_sample))
+        yield logits[first:last]
+
+
+def _phoneme_ids_from_long_waveform(waveform: np.ndarray, deadline: Optional[float] = None) -> np.ndarray:
+    """
+    Распознаёт длинную запись по окнам (см. _iter_long_waveform_logits).
+    От каждого окна сохраняются только индексы argmax; индексы всех окон склеиваются
+    и декодируются CTC-декодером один раз: повторы и пустые символы на стыках
+    схлопываются так же, как внутри окна.
+    """
+    import torch
+    processor, _ = get_phoneme_model()
+    frame_ids = [torch.argmax(logits, dim=-1) for logits in _iter_long_waveform_logits(waveform, deadline)]
+    return phoneme_inventory.tokenize_recognized(processor.decode(torch.cat(frame_ids)))
+
+
+def _is_long_waveform(waveform: np.ndarray) -> bool:
+    return len(waveform) > INFERENCE_CHUNK_SECONDS * audio_frontend.TARGET_SAMPLE_RATE
 
 
-async def audio_to_phonemes(audio_path: str) -> str:
-    """Транскрибирует аудио в фонемы с использованием Wav2Vec2 модели."""
+def _recognition_result(phoneme_ids: np.ndarray, stats: Dict[str, float]) -> Dict[str, Any]:
+    return {"phoneme_ids": phoneme_ids, "phonemes": phoneme_inventory.to_string(phoneme_ids), **stats}
+
+
+def recognize_audio_sync(audio: AudioSource, time_limit: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Распознаёт фонемы в записи (путь к файлу или байты OGG) после обрезки тишины.
+    Возвращает {"phoneme_ids", "phonemes", "duration", "speech_duration"}:
+    массив ID фонем, его строковую форму и длительности в секундах.
+    Блокирующая версия: вызывается в процессах пула распознавания (bot/inference.py).
+    Записи длиннее INFERENCE_CHUNK_SECONDS распознаются по окнам, не дольше time_limit секунд.
+    :raises AudioRejectedError: запись не декодируется, в ней нет речи или она слишком длинная.
+    :raises InferenceTimeoutError: длинная запись не уложилась в time_limit.
+    """
+    deadline = time.monotonic() + time_limit if time_limit else None
+    waveform, stats = audio_frontend.prepare_for_model(audio)
+    if _is_long_waveform(waveform):
+        phoneme_ids = _phoneme_ids_from_long_waveform(waveform, deadline)
+    else:
+        phoneme_ids = _phoneme_ids_from_waveforms([waveform])[0]
+    return _recognition_result(phoneme_ids, stats)
+
+
+def recognize_audio_batch_sync(audios: List[AudioSource], time_limit: Optional[float] = None) -> List[Any]:
+    """
+    Распознаёт пачку записей одним проходом модели (только тех, что прошли обрезку тишины).
+    Длинные записи распознаются по окнам отдельно от пачки, не дольше time_limit секунд.
+    Для каждой записи возвращается словарь, как в recognize_audio_sync, либо исключение
+    (AudioRejectedError, InferenceTimeoutError или ошибка распознавания) — оно не влияет на остальные записи.
+    """
+    deadline = time.monotonic() + time_limit if time_limit else None
+    results: List[Any] = [None] * len(audios)
+    loaded_indices = []
+    waveforms = []
+    for idx, audio in enumerate(audios):
+        try:
+            waveform, stats = audio_frontend.prepare_for_model(audio)
+        except AudioRejectedError as e:
+            results[idx] = e
+            continue
+        if _is_long_waveform(waveform):
+            try:
+                results[idx] = _recognition_result(_phoneme_ids_from_long_waveform(waveform, deadline), stats)
+            except Exception as e:
+                print(f"Ошибка распознавания длинной записи: {e}")
+                results[idx] = e
+            continue
+        waveforms.append(waveform)
+        results[idx] = stats
+        loaded_indices.append(idx)
+
+    if not waveforms:
+        return results
+
     try:
-        # torchaudio.load() может быть более универсальным для разных форматов
-        waveform, sr = torchaudio.load(audio_path)
+        batch_results = _phoneme_ids_from_waveforms(waveforms)
+    except Exception as e:
+        # Если общий проход не удался, распознаём записи по одной
+        print(f"Ошибка пакетного распознавания ({len(waveforms)} записей): {e}. Распознаём по одной.")
+        batch_results = []
+        for waveform in waveforms:
+            try:
+                batch_results.append(_phoneme_ids_from_waveforms([waveform])[0])
+            except Exception as single_error:
+                print(f"Ошибка обработки аудио в фонемы: {single_error}")
+                batch_results.append(single_error)
+
+    for idx, transcription in zip(loaded_indices, batch_results):
+        if isinstance(transcription, Exception):
+            results[idx] = transcription
+        else:
+            results[idx] = _recognition_result(transcription, results[idx])
+    return results
 
-        if waveform.shape[0] > 1:
-            waveform = torch.mean(waveform, dim=0)  # Конвертация стерео в моно
 
-        if sr != 16000:
-            resampler = torchaudio.transforms.Resample(orig_freq=sr, new_freq=16000)
-            waveform = resampler(waveform)
+def _waveform_log_probs(waveform: np.ndarray, deadline: Optional[float] = None):
+    """Log-вероятности фонем (frames, vocab) для всей записи; длинные записи — по окнам."""
+    import torch
+    processor, backend = get_phoneme_model()
+    if _is_long_waveform(waveform):
+        logits = torch.cat(list(_iter_long_waveform_logits(waveform, deadline)))
+    else:
+        input_values = processor(waveform, return_tensors="pt", sampling_rate=16000).input_values
+        logits = backend.logits(input_values)[0]
+    return torch.log_softmax(logits.float(), dim=-1)
 
-        # Нормализация громкости для Wav2Vec2
-        waveform = (waveform - waveform.mean()) / (waveform.std() + 1e-7)
 
-        input_values = processor(waveform.numpy(), return_tensors="pt", sampling_rate=16000).input_values
-        with torch.no_grad():
-            logits = model(input_values).logits
-        predicted_ids = torch.argmax(logits, dim=-1)
-        transcription = processor.decode(predicted_ids[0])
-        normalized = normalize_phonemes(transcription)
-        return normalized
+def score_pronunciation_gop_sync(audio: AudioSource, word_ipas: List[str],
+                                 time_limit: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Режим gop: один проход модели даёт и распознанные фонемы (argmax), и оценку эталона.
+    word_ipas — транскрипции eSpeak NG слов фразы по порядку.
+    Возвращает то же, что recognize_audio_sync, плюс "gop": {"overall", "words"}, где у каждого
+    слова есть оценка, фонемы с GOP и временем (секунды от начала обрезанной записи)
+    и "detected" — распознанные фонемы в кадрах этого слова. Если выровнять эталон
+    не удалось (например, запись короче эталона), "gop" равен None.
+    Блокирующая версия: вызывается в процессах пула распознавания (bot/inference.py).
+    """
+    import torch
+    deadline = time.monotonic() + time_limit if time_limit else None
+    waveform, stats = audio_frontend.prepare_for_model(audio)
+    processor, _ = get_phoneme_model()
+
+    log_probs = _waveform_log_probs(waveform, deadline)
+    predicted_ids = torch.argmax(log_probs, dim=-1)
+    result = _recognition_result(phoneme_inventory.tokenize_recognized(processor.decode(predicted_ids)), stats)
+    result["gop"] = None
+
+    token_ids, token_words, symbols = gop.reference_tokens(word_ipas, processor.tokenizer.get_vocab())
+    if not token_ids:
+        return result
+    seconds_per_frame = len(waveform) / audio_frontend.TARGET_SAMPLE_RATE / log_probs.shape[0]
+    try:
+        phonemes = gop.score_phonemes(log_probs, token_ids, symbols, processor.tokenizer.pad_token_id,
+                                      seconds_per_frame)
+    except Exception as e:
+        print(f"Ошибка GOP-оценки ({len(token_ids)} фонем, {log_probs.shape[0]} кадров): {e}")
+        return result
+
+    words = gop.score_words(phonemes, token_words, len(word_ipas))
+    for word in words:
+        word["detected"] = phoneme_inventory.to_string(phoneme_inventory.tokenize_recognized(
+            processor.decode(predicted_ids[word["start_frame"]:word["end_frame"]])
+        )) if word["phonemes"] else ""
+    result["gop"] = {
+        "overall": sum(p["score"] for p in phonemes) / len(phonemes),
+        "words": words,
+    }
+    return result
+
+
+def audio_to_phonemes_sync(audio: AudioSource) -> str:
+    """
+    Транскрибирует аудио (путь к файлу или байты OGG) в фонемы с использованием Wav2Vec2 модели.
+    Блокирующая версия без пула; при ошибке или отклонённой записи возвращает пустую строку.
+    """
+    try:
+        return recognize_audio_sync(audio)["phonemes"]
     except Exception as e:
         print(f"Ошибка обработки аудио в фонемы: {e}")
         return ""
 
 
-def advanced_phoneme_comparison(expected: str, user: str) -> float:
+async def recognize_audio(audio: AudioSource) -> Dict[str, Any]:
     """
-    Сравнивает две строки фонем, используя SequenceMatcher.ratio()
-    для получения общей точности.
+    Распознаёт запись, не блокируя event loop: распознавание выполняется в пуле процессов
+    с ограниченной очередью; одновременные запросы разных пользователей объединяются в пачки.
+    Возвращает {"phoneme_ids", "phonemes", "duration", "speech_duration"}.
+    :raises AudioRejectedError: запись отклонена до распознавания (тишина, слишком длинная, не декодируется).
+    :raises InferenceBusyError: если очередь распознавания переполнена.
+    :raises InferenceTimeoutError: если распознавание не уложилось в таймаут.
     """
-    if not expected and not user:
+    return await inference_pool.recognize(audio)
+
+
+async def score_pronunciation_gop(audio: AudioSource, word_ipas: List[str]) -> Dict[str, Any]:
+    """Асинхронная версия score_pronunciation_gop_sync (выполняется в пуле распознавания)."""
+    return await inference_pool.score_gop(audio, word_ipas)
+
+
+async def audio_to_phonemes(audio: AudioSource) -> str:
+    """Транскрибирует аудио (путь к файлу или байты OGG) в фонемы, не блокируя event loop."""
+    return (await recognize_audio(audio))["phonemes"]
+
+
+def advanced_phoneme_comparison(expected: PhonemeSeq, user: PhonemeSeq) -> float:
+    """
+    Сравнивает две последовательности фонем (массивы ID или строки IPA),
+    используя SequenceMatcher.ratio() для получения общей точности.
+    Сравниваются ID фонем, поэтому tʃ, aɪ, oʊ считаются одной фонемой, а не двумя символами.
+    """
+    expected_ids = phoneme_inventory.as_ids(expected)
+    user_ids = phoneme_inventory.as_ids(user)
+    if not len(expected_ids) and not len(user_ids):
         return 100.0
-    if not expected or not user:
+    if not len(expected_ids) or not len(user_ids):
         return 0.0  # Если одна строка пуста, а другая нет
 
-    matcher = SequenceMatcher(None, expected, user)
+    matcher = SequenceMatcher(None, expected_ids.tolist(), user_ids.tolist())
     return round(matcher.ratio() * 100, 1)
 
 
@@ -407,104 +822,56 @@ def _preprocess_text_for_phoneme_splitting(text: str) -> str:
 
 def analyze_word_errors(
         text_words: List[str],
-        orig_phonemes: str,  # Это flat строка
-        user_phonemes: str  # Это flat строка
+        orig_phonemes: PhonemeSeq,  # Фонемы всей фразы (массив ID или строка)
+        user_phonemes: PhonemeSeq,  # Распознанные фонемы (массив ID или строка)
+        reference: Optional[ReferencePhrase] = None  # Готовый эталон фразы (слова и их фонемы)
 ) -> List[Dict]:
     """Анализ ошибок произношения по отдельным словам."""
 
-    # Если orig_phonemes не был получен с пробелами между словами,
-    # нам нужно получить фонемное представление каждого слова отдельно
-    # для корректного разделения на границы слов.
-    # orig_phonemes, переданная сюда, уже является "плоской" строкой из `text_to_phonemes_simplified`.
-    # Поэтому для пословного анализа нам нужно снова сгенерировать фонемы для каждого слова.
-    orig_words_phonemes_separated = [text_to_phonemes_simplified(word) for word in text_words]
-
-    # Создаем "плоскую" версию эталонных фонем, но теперь гарантированно разбитую по словам,
-    # чтобы сопоставить границы слов.
-    orig_flat_with_word_boundaries = "".join(orig_words_phonemes_separated)
-    user_flat = user_phonemes  # user_phonemes уже нормализованы и без пробелов
+    # Фонемы всей фразы не содержат границ слов, поэтому для пословного анализа
+    # берём эталон каждого слова отдельно и склеиваем массивы ID — из готового
+    # эталона фразы или (без него) из кэша eSpeak NG.
+    if reference is not None:
+        orig_words_ids = reference.word_ids
+        orig_flat_ids = reference.flat_ids
+        words_raw_ipa = reference.word_ipas
+    else:
+        orig_words_ids = [text_to_phoneme_ids(word) for word in text_words]
+        orig_flat_ids = np.concatenate(orig_words_ids) if orig_words_ids else np.zeros(0, dtype=np.int32)
+        words_raw_ipa = [get_phonemes_from_espeak(word) for word in text_words]
+    user_ids = phoneme_inventory.as_ids(user_phonemes)
+    to_string = phoneme_inventory.to_string
 
     # Проверяем, чтобы длины фонем соответствовали ожидаемым
-    if not orig_flat_with_word_boundaries and not user_flat:  # Обе строки пусты
+    if not len(orig_flat_ids) and not len(user_ids):  # Обе последовательности пусты
         return []
-    if not orig_flat_with_word_boundaries or not user_flat:  # Одна строка пуста, другая нет
+    if not len(orig_flat_ids) or not len(user_ids):  # Одна пуста, другая нет
         # В этом случае пословный анализ может быть неинформативен,
         # но мы должны хотя бы указать, что что-то не так.
         # Это крайний случай, который обычно обрабатывается на уровне overall_accuracy.
         # Для простоты, если есть слова в text_words, вернем по ним 0%
         return [{
             'word': word,
-            'expected': text_to_phonemes_simplified(word),
-            'expected_ipa_raw': get_phonemes_from_espeak(word), # Add raw IPA for better GPT analysis
-            'detected': user_flat,  # detected_word_phonemes не получится точно выделить
+            'expected': to_string(word_ids),
+            'expected_ipa_raw': word_raw_ipa, # Add raw IPA for better GPT analysis
+            'detected': to_string(user_ids),  # detected_word_phonemes не получится точно выделить
             'accuracy': 0.0,
             'errors': ["Значительные расхождения с ожидаемым произношением всего предложения."]
-        } for word in text_words]
-
-    word_boundaries = []
-    current_pos = 0
-    for word_ph_separated in orig_words_phonemes_separated:
-        start = current_pos
-        end = start + len(word_ph_separated)
-        word_boundaries.append((start, end))
-        current_pos = end
+        } for word, word_ids, word_raw_ipa in zip(text_words, orig_words_ids, words_raw_ipa)]
 
-    # Используем SequenceMatcher для общего выравнивания двух полных строк фонем
-    matcher = SequenceMatcher(None, orig_flat_with_word_boundaries, user_flat)
-    alignment = matcher.get_opcodes()
+    # Одно глобальное выравнивание (с учётом похожих фонем) сразу даёт точные границы слов:
+    # каждой фонеме эталона сопоставлена фонема пользователя, пропуск или замена
+    alignment = phoneme_alignment.align(orig_flat_ids, user_ids)
+    word_alignments = phoneme_alignment.split_by_words(alignment, [len(word_ids) for word_ids in orig_words_ids])
 
     results = []
 
-    for idx, (start, end) in enumerate(word_boundaries):
-        if idx >= len(text_words):
-            break
-
-        word = text_words[idx]
-        expected_word_phonemes = orig_flat_with_word_boundaries[start:end]
-        expected_word_phonemes_raw_ipa = get_phonemes_from_espeak(word) # Get raw IPA for the word
-
-
-        detected_word_phonemes = ''
-
-        # Собираем фонемы, произнесенные пользователем, для текущего слова
-        # Идем по общему выравниванию и извлекаем те части, которые соответствуют текущему слову
-        for tag, i1, i2, j1, j2 in alignment:
-            # i1, i2 относятся к orig_flat_with_word_boundaries
-            # j1, j2 относятся к user_flat
-
-            # Если блок выравнивания полностью до начала текущего слова
-            if i2 <= start:
-                continue
-            # Если блок выравнивания полностью после конца текущего слова
-            if i1 >= end:
-                break
-
-            # Находим пересечение блока выравнивания с границами текущего слова
-            clip_start_orig = max(i1, start)
-            clip_end_orig = min(i2, end)
-
-            if clip_end_orig <= clip_start_orig:  # Если нет пересечения или оно нулевое
-                continue
-
-            # Определяем, какую часть из user_flat нужно взять
-            # Это приблизительный расчет, основанный на пропорции
-            # Более точное сопоставление требует построения нового SequenceMatcher для каждой пары слово-пользователь
-
-            # Пропорция текущего совпадения/различия в контексте всего блока
-            ratio_in_block = (clip_end_orig - clip_start_orig) / (i2 - i1) if (i2 - i1) > 0 else 0
-
-            # Часть, которая была произнесена пользователем для этой части блока
-            detected_segment_length = int((j2 - j1) * ratio_in_block)
+    for word, word_ids, expected_word_phonemes_raw_ipa, word_steps in zip(
+            text_words, orig_words_ids, words_raw_ipa, word_alignments):
+        expected_word_phonemes = to_string(word_ids)
+        detected_word_phonemes = to_string(user_ids[[j for _, _, j in word_steps if j is not None]])
 
-            # Если tag - 'equal' или 'replace', берем соответствующую часть из произнесенных
-            if tag in ('equal', 'replace'):
-                # Добавляем часть, которая совпадает или является заменой
-                detected_word_phonemes += user_flat[j1: j1 + detected_segment_length]
-            elif tag == 'insert' and (i1 >= start and i1 < end):
-                # Если это "вставка" в ожидаемом тексте, но фактически в произнесенном, и она попадает в границы слова
-                detected_word_phonemes += user_flat[j1: j2]  # Вставка целиком
-
-        # Теперь, когда у нас есть предположительно произнесенные фонемы для слова, сравниваем их
+        # Теперь, когда у нас есть произнесенные фонемы для слова, сравниваем их
         if not detected_word_phonemes and expected_word_phonemes:
             # Случай, когда слово было полностью пропущено или не распознано
             accuracy = 0.0
@@ -523,17 +890,14 @@ def analyze_word_errors(
             highlighted_expected = [""]
             highlighted_detected = [""]
         else:
-            # Детальное сравнение для конкретного слова
-            matcher_word = SequenceMatcher(None, expected_word_phonemes, detected_word_phonemes)
-            word_alignment = matcher_word.get_opcodes()
-
+            # Детальное сравнение для конкретного слова — по тому же глобальному выравниванию
             highlighted_expected = []
             highlighted_detected = []
             errors = []
 
-            for tag, i1, i2, j1, j2 in word_alignment:
-                exp_chunk = expected_word_phonemes[i1:i2]
-                det_chunk = detected_word_phonemes[j1:j2]
+            for tag, orig_indices, user_indices in phoneme_alignment.runs(word_steps):
+                exp_chunk = to_string(orig_flat_ids[orig_indices])
+                det_chunk = to_string(user_ids[user_indices])
 
                 if tag == 'equal':
                     highlighted_expected.append(exp_chunk)
@@ -549,7 +913,7 @@ def analyze_word_errors(
                     highlighted_detected.append(f"<b>{det_chunk}</b>")
                     errors.append(f"Добавили лишнее '{det_chunk}'")
 
-            accuracy = matcher_word.ratio() * 100
+            accuracy = phoneme_alignment.similarity(word_steps) * 100
 
         results.append({
             'word': word,
@@ -564,22 +928,80 @@ def analyze_word_errors(
 
 
 
-async def simple_pronunciation_check(
-    target_text: str,
-    user_audio_path: str,
-    lower_threshold: float,
-    upper_threshold: float
+def _word_results_from_gop(text_words: List[str], word_ipas: List[str], gop_result: Dict[str, Any]) -> List[Dict]:
+    """Пословный анализ в режиме gop: в том же формате, что analyze_word_errors."""
+    results = []
+    for word, ipa, scored in zip(text_words, word_ipas, gop_result["words"]):
+        highlighted_expected = []
+        errors = []
+        for phoneme in scored["phonemes"]:
+            if phoneme["score"] < GOP_PHONEME_THRESHOLD:
+                highlighted_expected.append(f"<b>{phoneme['phoneme']}</b>")
+                errors.append(f"Звук '{phoneme['phoneme']}' произнесён неуверенно ({phoneme['score']:.0f}%)")
+            else:
+                highlighted_expected.append(phoneme["phoneme"])
+        if not scored["phonemes"]:
+            errors.append("Полностью пропустили или сильно исказили произношение.")
+        results.append({
+            'word': word,
+            'expected': ''.join(highlighted_expected),
+            'expected_ipa_raw': ipa,
+            'detected': scored["detected"] or "-",
+            'accuracy': scored["score"],
+            'errors': errors,
+            'start': scored["start"],
+            'end': scored["end"],
+        })
+    return results
+
+
+def pronunciation_thresholds(text: str) -> Tuple[float, float]:
+    """
+    Пороги оценки произношения (нижний, верхний) с поправкой на длину фразы:
+    для одного-двух слов требования чуть строже, для длинных фраз — мягче.
+    """
+    base_lower_threshold = 68.0
+    base_upper_threshold = 84.0
+    sensitivity_factor = -1.0
+    num_words = len(text.split())
+
+    adjusted_lower_threshold = base_lower_threshold
+    adjusted_upper_threshold = base_upper_threshold
+
+    if num_words <= 2:
+        adjusted_lower_threshold += 3.0 * sensitivity_factor
+    elif num_words >= 5:
+        adjusted_lower_threshold += -3.0 * sensitivity_factor
+
+    adjusted_lower_threshold = max(0.0, min(100.0, adjusted_lower_threshold))
+    adjusted_upper_threshold = max(0.0, min(100.0, adjusted_upper_threshold))
+    return adjusted_lower_threshold, adjusted_upper_threshold
+
+
+def evaluate_pronunciation(
+    reference: ReferencePhrase,
+    recognition: Dict[str, Any],
+    lower_threshold: Optional[float] = None
 ) -> Tuple[float, str, str, str, str, List[Dict]]:
     """
-    Проверяет произношение и формирует ответ:
-      • overall_accuracy — численное значение;
-      • verdict          — короткий итог (без процентов при "Отлично" и "Плохо");
-      • analysis_text    — подробности (если нужно);
-      • expected_phonemes, user_phonemes, word_results — служебные данные.
+    Оценивает уже распознанную запись (результат recognize_audio или score_pronunciation_gop)
+    по эталону фразы и формирует ответ в формате simple_pronunciation_check.
+    Синхронная и без обращения к пулу: её же использует пакетная перепроверка архива
+    (scripts/rescore_archived_voices.py). По умолчанию нижний порог — порог эталона.
     """
-    expected_phonemes = text_to_phonemes_simplified(target_text)
-    user_phonemes = await audio_to_phonemes(user_audio_path)
-    overall_accuracy = advanced_phoneme_comparison(expected_phonemes, user_phonemes)
+    if lower_threshold is None:
+        lower_threshold = reference.lower_threshold
+    expected_ids = reference.phoneme_ids
+    expected_phonemes = reference.phonemes
+    text_words_processed = reference.words
+    user_ids = recognition["phoneme_ids"]
+    user_phonemes = recognition["phonemes"]
+
+    gop_result = recognition.get("gop")
+    if gop_result is not None:
+        overall_accuracy = round(gop_result["overall"], 1)
+    else:
+        overall_accuracy = advanced_phoneme_comparison(expected_ids, user_ids)
 
     PERFECT_THRESHOLD = 85.0
     verdict: str = ""
@@ -593,8 +1015,10 @@ async def simple_pronunciation_check(
     elif overall_accuracy >= lower_threshold:
         verdict = "👍 <b>Хорошо, но можно лучше!</b>"
 
-        text_words_processed = _preprocess_text_for_phoneme_splitting(target_text).split()
-        word_results = analyze_word_errors(text_words_processed, expected_phonemes, user_phonemes)
+        if gop_result is not None:
+            word_results = _word_results_from_gop(text_words_processed, reference.word_ipas, gop_result)
+        else:
+            word_results = analyze_word_errors(text_words_processed, expected_ids, user_ids, reference)
 
         analysis = ["\n\n📝 <b>Обнаружены следующие ошибки произношения:</b>"]
         for result in word_results:
@@ -614,6 +1038,79 @@ async def simple_pronunciation_check(
 
     return overall_accuracy, verdict, analysis_text, expected_phonemes, user_phonemes, word_results
 
+
+# Результаты simple_pronunciation_check по (способ оценки, фраза, отпечаток записи).
+# Отпечаток — file_unique_id Telegram (одинаков у пересланных копий и известен до скачивания)
+# или SHA-256 содержимого, если одно и то же аудио пришло под другим file_unique_id
+_pronunciation_results = LRUCache(maxsize=PRONUNCIATION_RESULT_CACHE_SIZE, ttl=PRONUNCIATION_RESULT_CACHE_TTL)
+
+
+def _pronunciation_result_key(target_text: str, fingerprint: str) -> Tuple[str, str, str]:
+    return (PRONUNCIATION_SCORING, target_text, fingerprint)
+
+
+def get_cached_pronunciation_result(target_text: str, file_unique_id: str) -> Optional[Tuple]:
+    """Готовый результат проверки этого голосового для этой фразы (или None) — до скачивания файла."""
+    return _pronunciation_results.get(_pronunciation_result_key(target_text, f"tg:{file_unique_id}"))
+
+
+async def simple_pronunciation_check(
+    target_text: str,
+    user_audio: AudioSource,
+    lower_threshold: float,
+    upper_threshold: float,
+    file_unique_id: Optional[str] = None
+) -> Tuple[float, str, str, str, str, List[Dict]]:
+    """
+    Проверяет произношение и формирует ответ:
+      • overall_accuracy — численное значение;
+      • verdict          — короткий итог (без процентов при "Отлично" и "Плохо");
+      • analysis_text    — подробности (если нужно);
+      • expected_phonemes, user_phonemes, word_results — служебные данные.
+    user_audio — путь к аудиофайлу или байты голосового сообщения (OGG/Opus).
+    Результат для байтов кэшируется по хэшу содержимого и file_unique_id (если передан):
+    та же запись для той же фразы повторно не распознаётся.
+    :raises AudioRejectedError: в записи нет речи, она слишком длинная или не декодируется.
+    """
+    cache_keys = []
+    if file_unique_id:
+        cache_keys.append(_pronunciation_result_key(target_text, f"tg:{file_unique_id}"))
+    if isinstance(user_audio, (bytes, bytearray)):
+        cache_keys.append(_pronunciation_result_key(target_text, f"sha256:{hashlib.sha256(user_audio).hexdigest()}"))
+    for key in cache_keys:
+        cached = _pronunciation_results.get(key)
+        if cached is not None:
+            print(f"DEBUG: Произношение: результат из кэша ({key[2][:16]}...)")
+            for other_key in cache_keys:
+                _pronunciation_results.set(other_key, cached)
+            return cached
+
+    result = await _check_pronunciation(target_text, user_audio, lower_threshold)
+    for key in cache_keys:
+        _pronunciation_results.set(key, result)
+    return result
+
+
+async def _check_pronunciation(
+    target_text: str,
+    user_audio: AudioSource,
+    lower_threshold: float
+) -> Tuple[float, str, str, str, str, List[Dict]]:
+    # Эталон фразы собирается один раз на процесс (обычно уже при запуске бота),
+    # так что на каждую попытку обрабатывается только запись ученика
+    reference = await get_reference_phrase_async(target_text)
+
+    if PRONUNCIATION_SCORING == "gop":
+        recognition = await score_pronunciation_gop(user_audio, reference.word_ipas)
+        if recognition["gop"] is None:
+            print("DEBUG: Произношение: GOP-оценка недоступна, сравниваем распознанные фонемы.")
+    else:
+        recognition = await recognize_audio(user_audio)
+    print(f"DEBUG: Произношение: запись {recognition['duration']:.2f} с, "
+          f"после обрезки тишины {recognition['speech_duration']:.2f} с")
+
+    return evaluate_pronunciation(reference, recognition, lower_threshold)
+
 # --- Функции AI ассистента ---
 
 # --- НОВАЯ ФУНКЦИЯ ДЛЯ GPT-АНАЛИЗА (перенесена из gpt_phoneme_analyzer.py) ---
@@ -640,7 +1137,7 @@ async def analyze_phonemes_with_gpt(
         return None
 
     try:
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        client = get_ai_client()
 
         error_details = []
         for word_info in word_errors_analysis:
@@ -677,27 +1174,103 @@ async def analyze_phonemes_with_gpt(
         {error_analysis_str}
         """
 
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            max_tokens=350,
-            temperature=0.7
-        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+        # Советы дописываются к уже показанному результату — самая низкая очередь
+        async with ai_governor.slot(max_tokens=350, messages=messages, priority=PRIORITY_BACKGROUND) as grant:
+            response = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=350,
+                temperature=0.7
+            )
+            grant.settle(response.usage.total_tokens if response.usage else None)
         return response.choices[0].message.content
     except Exception as e:
         print(f"Ошибка GPT-анализа произношения: {e}")
         return "⚠️ Произошла ошибка при получении фонетического анализа от AI. Пожалуйста, попробуйте позже."
 
 
-async def get_teacher_response(question: str) -> str:
-    """Получает ответ от AI учителя по грамматике."""
+@asynccontextmanager
+async def breaker_slot(breaker: Optional[CircuitBreaker], max_tokens: int = 0,
+                       messages: Optional[List[Dict[str, str]]] = None,
+                       priority: int = PRIORITY_FEEDBACK) -> AsyncIterator[Tuple[Any, Optional[float]]]:
+    """
+    Слот планировщика для запроса через предохранитель: один срок breaker.call_timeout
+    на ожидание слота и сам запрос. Отдаёт (grant, остаток срока) — остаток передаётся
+    в breaker.call(..., timeout=...). При забитой очереди ученик получает заглушку через
+    то же время, что и при зависшем провайдере; время в очереди предохранитель не учитывает.
+    Без предохранителя — обычный слот, остаток None.
+    :raises AIQueueTimeoutError: если срок ушёл на ожидание очереди.
+    """
+    if breaker is None:
+        async with ai_governor.slot(max_tokens=max_tokens, messages=messages, priority=priority) as grant:
+            yield grant, None
+        return
+    deadline = time.monotonic() + breaker.call_timeout
+    async with ai_governor.slot(max_tokens=max_tokens, messages=messages, priority=priority,
+                                queue_timeout=breaker.call_timeout) as grant:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise AIQueueTimeoutError(f"Очередь запросов к OpenAI: ожидание дольше {breaker.call_timeout} с")
+        yield grant, remaining
+
+
+async def stream_chat_completion(messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                                 priority: int = PRIORITY_FEEDBACK, breaker: Optional[CircuitBreaker] = None,
+                                 model: str = "gpt-4o-mini") -> AsyncIterator[str]:
+    """
+    Запрашивает ответ модели в потоковом режиме и отдаёт фрагменты текста по мере их прихода.
+    Слот планировщика (bot/ai_governor.py) занят до конца потока. С предохранителем breaker
+    ожидание слота и время до начала ответа ограничены одним сроком (breaker_slot),
+    ошибки потока размыкают предохранитель.
+    :raises CircuitOpenError: если предохранитель разомкнут.
+    """
+    if breaker is not None:
+        breaker.ensure_available()
+    client = get_ai_client()
+    async with breaker_slot(breaker, max_tokens=max_tokens, messages=messages, priority=priority) as (grant, remaining):
+        request = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        stream = await (breaker.call(request, timeout=remaining) if breaker is not None else request)
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:  # последний фрагмент — фактический расход токенов
+                    grant.settle(chunk.usage.total_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            raise
+        finally:
+            # Если потребитель перестал читать раньше, соединение возвращается в пул
+            await stream.close()
+
+
+async def stream_teacher_response(question: str) -> AsyncIterator[str]:
+    """
+    Ответ AI учителя по грамматике в потоковом режиме: отдаёт растущий текст ответа
+    (каждый снимок — весь текст на данный момент, последний — окончательный ответ).
+    Тот же или похожий вопрос, уже заданный другими учениками, отвечается из кэша без запроса к API.
+    """
+    cached = teacher_answer_cache.get(question)
+    if cached is not None:
+        yield cached
+        return
     if not OPENAI_AVAILABLE:
-        return await get_simple_teacher_response(question)
-    try:
-        system_prompt = """Ты — помощник в Telegram-боте по изучению английского языка. 
+        yield await get_simple_teacher_response(question)
+        return
+
+    system_prompt = """Ты — помощник в Telegram-боте по изучению английского языка. 
 Отвечай на вопросы по грамматике кратко, чётко и по делу. Пиши на русском языке.
 
 ❗ Правила:
@@ -708,21 +1281,38 @@ async def get_teacher_response(question: str) -> str:
 - Не используй лишние слова, шуточки, извинения.
 - Не пиши "я не понял" — вместо этого уточни, например: “Вы имеете в виду...?”.
 """
-
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
+    answer = prefix = "🤖 "
+    try:
+        async for delta in stream_chat_completion(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Вопрос по грамматике: {question}"}
             ],
             max_tokens=500,
-            temperature=0.7
-        )
-        return f"🤖 {response.choices[0].message.content}"
+            temperature=0.7,
+            priority=PRIORITY_INTERACTIVE
+        ):
+            answer += delta
+            yield answer
     except Exception as e:
         print(f"Ошибка OpenAI API: {e}")
-        return "⚠️ Сервис временно недоступен. Попробуйте позже."
+        if answer == prefix:
+            yield "⚠️ Сервис временно недоступен. Попробуйте позже."
+        else:
+            yield answer + "\n\n⚠️ Ответ прервался. Попробуйте задать вопрос ещё раз."
+        return
+
+    # В кэш попадают только полные ответы модели (не заглушки и не сообщения об ошибке)
+    teacher_answer_cache.put(question, answer)
+    spawn_background_task(asyncio.to_thread(teacher_answer_cache.save))
+
+
+async def get_teacher_response(question: str) -> str:
+    """Получает ответ от AI учителя по грамматике целиком (см. stream_teacher_response)."""
+    answer = "⚠️ Сервис временно недоступен. Попробуйте позже."
+    async for answer in stream_teacher_response(question):
+        pass
+    return answer
 
 
 async def get_simple_teacher_response(question: str) -> str:
@@ -743,13 +1333,14 @@ async def get_simple_teacher_response(question: str) -> str:
             "Попробуйте переформулировать вопрос более конкретно, и я постараюсь помочь!")
 
 
-async def check_writing_with_ai(text: str, task_type: str = "sentence", context_data: str = "") -> str:
-    """Проверяет письменный текст с помощью AI."""
-    if not OPENAI_AVAILABLE:
-        return await simple_writing_check(text, task_type)
-    try:
-        if task_type == "sentence":
-            system_prompt = """Ты — учитель английского языка. Твоя задача — проверить предложение студента по следующим критериям:
+async def _request_writing_feedback(text: str, task_type: str, context_data: str) -> str:
+    """
+    Запрос отзыва учителя у AI (ошибки API пробрасываются вызывающему).
+    :raises CircuitOpenError: если предохранитель разомкнут — запрос не отправляется.
+    """
+    ai_breaker.ensure_available()
+    if task_type == "sentence":
+        system_prompt = """Ты — учитель английского языка. Твоя задача — проверить предложение студента по следующим критериям:
 
 Если в предложении **есть лексически, стилистические, грамматические ошибки или недочёты**, укажи их и предложи исправленный вариант.
 
@@ -758,8 +1349,8 @@ async def check_writing_with_ai(text: str, task_type: str = "sentence", context_
 Отвечай кратко, конструктивно и на русском языке, поддерживай и стимулируй студента к изучению английского языка.
 """
 
-        else:  # translation
-            system_prompt = f"""Ты — учитель английского языка. Твоя задача — проверить как студент перевёл фразу с русского на английский, оцени корректность перевода:
+    else:  # translation
+        system_prompt = f"""Ты — учитель английского языка. Твоя задача — проверить как студент перевёл фразу с русского на английский, оцени корректность перевода:
 
         **Исходная русская фраза:** "{context_data}"
 
@@ -770,17 +1361,35 @@ async def check_writing_with_ai(text: str, task_type: str = "sentence", context_
 
         Отвечай на русском, кратко и конструктивно, с акцентом на обучающую ценность и поддержку."""    
 
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        response = await client.chat.completions.create(
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Проверь это: {text}"}
+    ]
+    client = get_ai_client()
+    async with breaker_slot(ai_breaker, max_tokens=300, messages=messages, priority=PRIORITY_FEEDBACK) as (grant, remaining):
+        response = await ai_breaker.call(client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Проверь это: {text}"}
-            ],
+            messages=messages,
             max_tokens=300,
             temperature=0.3
-        )
-        return f"👨‍🏫 <b>Обратная связь учителя:</b>\n\n{response.choices[0].message.content}"
+        ), timeout=remaining)
+        grant.settle(response.usage.total_tokens if response.usage else None)
+    return f"👨‍🏫 <b>Обратная связь учителя:</b>\n\n{response.choices[0].message.content}"
+
+
+# Отзывы на письменные задания: кэш и объединение одинаковых проверок
+writing_feedback = WritingFeedbackService(_request_writing_feedback)
+
+
+async def check_writing_with_ai(text: str, task_type: str = "sentence", context_data: str = "") -> str:
+    """
+    Проверяет письменный текст с помощью AI. Одинаковые ответы на одно задание
+    проверяются один раз (см. bot/writing_feedback.py).
+    """
+    if not OPENAI_AVAILABLE:
+        return await simple_writing_check(text, task_type)
+    try:
+        return await writing_feedback.check(text, task_type, context_data)
     except Exception as e:
         print(f"Ошибка AI проверки письма: {e}")
         return await simple_writing_check(text, task_type)
@@ -808,12 +1417,17 @@ async def simple_writing_check(text: str, task_type: str = "sentence") -> str:
                     "Обратите внимание на технические термины.")
 
 
-async def analyze_speaking_with_ai(audio_text: str, topic: str) -> str:
-    """Анализирует устное высказывание с помощью AI."""
+async def stream_speaking_analysis(audio_text: str, topic: str) -> AsyncIterator[str]:
+    """
+    Анализ устного высказывания с помощью AI в потоковом режиме: отдаёт растущий текст
+    анализа (последний снимок — окончательный). Без API или при ошибке до начала ответа —
+    простой анализ.
+    """
     if not OPENAI_AVAILABLE:
-        return await simple_speaking_analysis(audio_text, topic)
-    try:
-        system_prompt = """Ты — учитель английского языка. Твоя задача — проверить высказывание  студента по следующим критериям:
+        yield await simple_speaking_analysis(audio_text, topic)
+        return
+
+    system_prompt = """Ты — учитель английского языка. Твоя задача — проверить высказывание  студента по следующим критериям:
 
 1) Грамматические, лексические, стилистические ошибки - предложи исправленный вариант
 
@@ -825,21 +1439,34 @@ async def analyze_speaking_with_ai(audio_text: str, topic: str) -> str:
 
 Отвечай кратко, конструктивно и на русском языке. Используй поддерживающий, но профессиональный тон. Не извиняйся, не используй лишних слов и не пиши в разговорном стиле. Старайся мотивировать студента продолжать учёбу
 """
-
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
+    analysis = header = "🎙️ <b>Анализ вашего высказывания:</b>\n\n"
+    try:
+        async for delta in stream_chat_completion(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Тема: {topic}\n\nВысказывание студента: {audio_text}"}
             ],
             max_tokens=400,
-            temperature=0.4
-        )
-        return f"🎙️ <b>Анализ вашего высказывания:</b>\n\n{response.choices[0].message.content}"
+            temperature=0.4,
+            priority=PRIORITY_FEEDBACK,
+            breaker=ai_breaker
+        ):
+            analysis += delta
+            yield analysis
     except Exception as e:
         print(f"Ошибка AI анализа речи: {e}")
-        return await simple_speaking_analysis(audio_text, topic)
+        if analysis == header:
+            yield await simple_speaking_analysis(audio_text, topic)
+        else:
+            yield analysis + "\n\n⚠️ Анализ прервался, попробуй записать ответ ещё раз."
+
+
+async def analyze_speaking_with_ai(audio_text: str, topic: str) -> str:
+    """Анализирует устное высказывание с помощью AI (целиком, см. stream_speaking_analysis)."""
+    analysis = ""
+    async for analysis in stream_speaking_analysis(audio_text, topic):
+        pass
+    return analysis
 
 
 async def simple_speaking_analysis(audio_text: str, topic: str) -> str:
@@ -864,15 +1491,19 @@ async def transcribe_audio_simple(audio_path: str) -> str:
         file_size = os.path.getsize(audio_path) / (1024 * 1024)
         if file_size > 25:
             raise ValueError(f"Файл слишком большой: {file_size:.1f}MB. Максимум 25MB")
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        with open(audio_path, 'rb') as audio_file:
-            transcript = await client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="en",
-                response_format="text",
-                temperature=0.0
-            )
+        # При разомкнутом предохранителе сразу переходим к запасному ответу
+        ai_breaker.ensure_available()
+        client = get_ai_client()
+        # Whisper расходует только бюджет запросов (токенов у транскрипции нет)
+        async with breaker_slot(ai_breaker, priority=PRIORITY_FEEDBACK) as (_, remaining):
+            with open(audio_path, 'rb') as audio_file:
+                transcript = await ai_breaker.call(client.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=audio_file,
+                    language="en",
+                    response_format="text",
+                    temperature=0.0
+                ), timeout=remaining)
         return transcript.strip()
     except Exception as e:
         print(f"Ошибка при транскрипции: {e}")
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import re
+import sys
+from typing import Awaitable, Callable, Dict, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import WRITING_FEEDBACK_CACHE_SIZE, WRITING_FEEDBACK_CACHE_TTL
+from bot.cache import LRUCache
+
+# Проверка письменных заданий без повторных запросов к AI. На упражнении всей группой
+# многие ученики присылают один и тот же перевод одной и той же фразы, поэтому:
+#   - ответ приводится к каноническому виду, ключ — (тип задания, эталон, ответ);
+#   - готовые отзывы хранятся в кэше;
+#   - одинаковые проверки, пришедшие одновременно, ждут один общий запрос (single-flight).
+# Так число запросов к API растёт с числом разных ответов, а не с числом учеников.
+
+_SPACES_RE = re.compile(r"\s+")
+# Типографские кавычки и апострофы (автозамена на телефонах) → обычные
+_QUOTES = str.maketrans({"’": "'", "‘": "'", "`": "'", "“": '"', "”": '"', "«": '"', "»": '"'})
+
+WritingKey = Tuple[str, str, str]
+
+
+def canonical_text(text: str) -> str:
+    """
+    Канонический вид ответа: пробелы схлопнуты, кавычки и апострофы обычные.
+    Регистр и пунктуация сохраняются — их проверяет учитель.
+    """
+    return _SPACES_RE.sub(" ", text.translate(_QUOTES)).strip()
+
+
+def canonical_key(task_type: str, reference: str, answer: str) -> WritingKey:
+    return task_type, canonical_text(reference), canonical_text(answer)
+
+
+class WritingFeedbackService:
+    """
+    Кэш отзывов и single-flight поверх функции запроса отзыва
+    fetch(text, task_type, context_data) -> str.
+    Ошибки fetch не кэшируются и передаются всем ожидавшим этот запрос.
+    """
+
+    def __init__(self, fetch: Callable[[str, str, str], Awaitable[str]],
+                 maxsize: int = WRITING_FEEDBACK_CACHE_SIZE, ttl: float = WRITING_FEEDBACK_CACHE_TTL):
+        self._fetch = fetch
+        self._verdicts = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight: Dict[WritingKey, asyncio.Task] = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    async def _run(self, key: WritingKey) -> str:
+        task_type, reference, answer = key
+        try:
+            self.requests += 1
+            feedback = await self._fetch(answer, task_type, reference)
+            self._verdicts.set(key, feedback)
+            return feedback
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def check(self, text: str, task_type: str = "sentence", context_data: str = "") -> str:
+        key = canonical_key(task_type, context_data, text)
+        feedback = self._verdicts.get(key)
+        if feedback is not None:
+            print(f"DEBUG: Отзыв на письменное задание ({task_type}) из кэша: '{key[2]}'")
+            return feedback
+
+        task = self._in_flight.get(key)
+        if task is None:
+            # Запрос живёт в отдельной задаче: отмена одного обработчика не отменяет его для остальных
+            task = asyncio.create_task(self._run(key))
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+            print(f"DEBUG: Проверка ({task_type}) '{key[2]}' уже выполняется — ждём её результат")
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        """Число запросов к API, объединённых проверок и попаданий в кэш (для логов)."""
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "cache_hits": self._verdicts.hits,
+            "in_flight": len(self._in_flight),
+        }
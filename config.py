@@ -8,6 +8,37 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 # OpenAI API Key для агента-учителя (опционально)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Общий клиент OpenAI (bot/ai_client.py): адрес API (например, локальный mock-сервер для тестов),
+# таймауты (сек) на подключение и ответ, число повторов с экспоненциальной задержкой и пул соединений
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# Общий планировщик запросов к OpenAI (bot/ai_governor.py): бюджеты запросов и токенов в минуту
+# (по лимитам аккаунта), число одновременных запросов, сколько секунд запрос может ждать
+# своей очереди и на сколько секунд приостановить выдачу после ответа 429
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_MAX_CONCURRENT = int(os.getenv("OPENAI_MAX_CONCURRENT", "16"))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "60"))
+OPENAI_RATE_LIMIT_PAUSE = float(os.getenv("OPENAI_RATE_LIMIT_PAUSE", "5"))
+# Как часто (сек) планировщик пишет в лог свои метрики, пока идут запросы или кто-то ждёт бюджет
+# (0 — только при отказах); отказы и ответы 429 логируются всегда
+OPENAI_METRICS_LOG_INTERVAL = float(os.getenv("OPENAI_METRICS_LOG_INTERVAL", "60"))
+# Предохранитель для AI-проверок письма, говорения и Whisper (bot/circuit_breaker.py): после стольких
+# ошибок или ответов дольше AI_BREAKER_LATENCY_SLO (с) подряд запросы на AI_BREAKER_OPEN_SECONDS (с)
+# сразу уходят в локальные заглушки; каждый запрос ограничен AI_BREAKER_CALL_TIMEOUT (с)
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "3"))
+AI_BREAKER_LATENCY_SLO = float(os.getenv("AI_BREAKER_LATENCY_SLO", "10"))
+AI_BREAKER_OPEN_SECONDS = float(os.getenv("AI_BREAKER_OPEN_SECONDS", "30"))
+AI_BREAKER_CALL_TIMEOUT = float(os.getenv("AI_BREAKER_CALL_TIMEOUT", "20"))
+
+# Потоковые ответы AI: не чаще одного редактирования сообщения за столько секунд
+# (Telegram ограничивает частоту правок одного чата)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
 
 # Paths
 #DATA_PATH = "data/"
@@ -26,6 +57,95 @@ CURRENT_LESSON_ID = "introduction_to_it_english"
 os.makedirs(DATA_PATH, exist_ok=True)
 os.makedirs(AUDIO_PATH, exist_ok=True)
 os.makedirs(IMAGES_PATH, exist_ok=True)
+
+# Пул процессов для распознавания произношения (Wav2Vec2).
+# Каждый процесс загружает модель один раз; 0 — выполнять в потоке основного процесса.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+# Сколько запросов может ждать свободного воркера сверх тех, что уже выполняются
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+# Максимальное время (сек) на распознавание одной записи
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+# Потоков torch на один воркер (чтобы воркеры не конкурировали за одни и те же ядра)
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("INFERENCE_THREADS_PER_WORKER", "1"))
+# Пакетное распознавание: одновременные записи объединяются в один проход модели.
+# Максимальный размер пачки (1 — без объединения) и сколько миллисекунд ждать попутчиков
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "20"))
+# Длинные записи распознаются по окнам INFERENCE_CHUNK_SECONDS секунд с перекрытием
+# INFERENCE_CHUNK_STRIDE_SECONDS с каждой стороны: пиковая память воркера не растёт с длиной записи
+INFERENCE_CHUNK_SECONDS = float(os.getenv("INFERENCE_CHUNK_SECONDS", "10"))
+INFERENCE_CHUNK_STRIDE_SECONDS = float(os.getenv("INFERENCE_CHUNK_STRIDE_SECONDS", "1.5"))
+# Бэкенд инференса модели произношения: torch (fp32), torch_int8 (динамическая
+# квантизация) или onnx (ONNX Runtime). Сравнение: python benchmarks/phoneme_backends.py
+# Для onnx нужны необязательные пакеты: pip install onnx onnxruntime (без них используется torch)
+PHONEME_BACKEND = os.getenv("PHONEME_BACKEND", "torch")
+# Куда сохранять экспортированную ONNX-модель (экспорт выполняется один раз, в отдельном процессе при прогреве пула)
+PHONEME_ONNX_PATH = os.getenv("PHONEME_ONNX_PATH", os.path.join(BASE_DIR, "models", "wav2vec2-lv-60-espeak-cv-ft.onnx"))
+# Прогревать модель произношения в фоне сразу после запуска (0 — загружать при первой записи)
+PRONUNCIATION_WARMUP = os.getenv("PRONUNCIATION_WARMUP", "1") == "1"
+
+# Обрезка тишины перед распознаванием (энергетический VAD по кадрам VAD_FRAME_MS мс).
+# Кадр считается речью, если он не тише VAD_THRESHOLD_DB дБ относительно самого громкого кадра
+# и громче VAD_MIN_DBFS дБ FS; вокруг речи оставляется запас VAD_PADDING_MS мс
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "20"))
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "35"))
+VAD_MIN_DBFS = float(os.getenv("VAD_MIN_DBFS", "-50"))
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "150"))
+# Записи, где речи меньше VAD_MIN_SPEECH_MS мс, считаются тишиной; речь длиннее
+# PRONUNCIATION_MAX_SECONDS секунд не распознаётся (в заданиях — слова и короткие фразы)
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "200"))
+PRONUNCIATION_MAX_SECONDS = float(os.getenv("PRONUNCIATION_MAX_SECONDS", "20"))
+# Максимальная длительность ответа в блоке говорения (сек); длиннее — просим записать короче
+SPEAKING_MAX_SECONDS = int(os.getenv("SPEAKING_MAX_SECONDS", "120"))
+
+# Ограничение дорогих обработчиков голосовых (bot/throttling.py): сколько записей в минуту
+# и сколько подряд может отправить один пользователь в каждый класс обработчиков,
+# сколько таких обработчиков выполняется одновременно на весь бот и сколько секунд
+# запись может ждать свободного места, прежде чем пользователь получит ответ «занято»
+PRONUNCIATION_RATE_PER_MINUTE = float(os.getenv("PRONUNCIATION_RATE_PER_MINUTE", "12"))
+PRONUNCIATION_RATE_BURST = int(os.getenv("PRONUNCIATION_RATE_BURST", "3"))
+SPEAKING_RATE_PER_MINUTE = float(os.getenv("SPEAKING_RATE_PER_MINUTE", "4"))
+SPEAKING_RATE_BURST = int(os.getenv("SPEAKING_RATE_BURST", "2"))
+VOICE_MAX_CONCURRENT = int(os.getenv("VOICE_MAX_CONCURRENT", "16"))
+VOICE_ADMISSION_WAIT_SECONDS = float(os.getenv("VOICE_ADMISSION_WAIT_SECONDS", "3"))
+
+# Способ оценки произношения: similarity — сравнение распознанных фонем с эталоном,
+# gop — принудительное выравнивание эталона по логитам модели (Goodness of Pronunciation)
+PRONUNCIATION_SCORING = os.getenv("PRONUNCIATION_SCORING", "similarity")
+# В режиме gop фонемы с оценкой ниже порога (0–100) показываются как ошибки
+GOP_PHONEME_THRESHOLD = float(os.getenv("GOP_PHONEME_THRESHOLD", "50"))
+
+# Кэш результатов проверки произношения: повторно присланное то же голосовое (пересылка,
+# двойное нажатие) для той же фразы отвечается сразу, без скачивания и модели.
+# Сколько результатов хранить и сколько секунд
+PRONUNCIATION_RESULT_CACHE_SIZE = int(os.getenv("PRONUNCIATION_RESULT_CACHE_SIZE", "1024"))
+PRONUNCIATION_RESULT_CACHE_TTL = float(os.getenv("PRONUNCIATION_RESULT_CACHE_TTL", "3600"))
+
+# Сохранять копии голосовых с проверки произношения в media/archived_voices (в фоне)
+ARCHIVE_VOICES = os.getenv("ARCHIVE_VOICES", "1") == "1"
+ARCHIVED_VOICES_PATH = os.path.join(MEDIA_PATH, 'archived_voices')
+
+# Эталонные транскрипции eSpeak NG: голос, файл кэша на диске и размер кэша в памяти
+ESPEAK_VOICE = os.getenv("ESPEAK_VOICE", "en")
+PHONEME_CACHE_FILE = os.getenv("PHONEME_CACHE_FILE", os.path.join(DATA_PATH, "phoneme_cache.json"))
+PHONEME_CACHE_SIZE = int(os.getenv("PHONEME_CACHE_SIZE", "4096"))
+# Путь к libespeak-ng для фонемизации внутри процесса (по умолчанию ищется автоматически;
+# если библиотека не найдена, espeak-ng запускается отдельным процессом на каждый вызов)
+ESPEAK_LIBRARY_PATH = os.getenv("ESPEAK_LIBRARY_PATH")
+
+# Кэш ответов AI-учителя по грамматике: файл на диске, размер, срок жизни ответа (с)
+# и минимальное сходство (косинус TF-IDF), при котором вопрос с теми же временем, отрицанием
+# и вспомогательными глаголами считается тем же
+TEACHER_CACHE_FILE = os.getenv("TEACHER_CACHE_FILE", os.path.join(DATA_PATH, "teacher_answer_cache.json"))
+TEACHER_CACHE_SIZE = int(os.getenv("TEACHER_CACHE_SIZE", "500"))
+TEACHER_CACHE_TTL = float(os.getenv("TEACHER_CACHE_TTL", str(7 * 24 * 3600)))
+TEACHER_CACHE_SIMILARITY = float(os.getenv("TEACHER_CACHE_SIMILARITY", "0.8"))
+
+# Кэш отзывов AI на письменные задания: одинаковые ответы на одно задание проверяются
+# один раз. Сколько отзывов хранить и сколько секунд
+WRITING_FEEDBACK_CACHE_SIZE = int(os.getenv("WRITING_FEEDBACK_CACHE_SIZE", "2048"))
+WRITING_FEEDBACK_CACHE_TTL = float(os.getenv("WRITING_FEEDBACK_CACHE_TTL", str(24 * 3600)))
+
 # Messages
 MESSAGES = {
     "welcome": "Привет! Давай изучать английский язык! 🇬🇧",
@@ -11,9 +11,14 @@ from aiogram.fsm.storage.memory import MemoryStorage
 # Добавляем текущую директорию в путь Python
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, PRONUNCIATION_WARMUP, OPENAI_API_KEY
 from bot.statistics import UserStatistics
-from bot.utils import UserProgress
+from bot.utils import UserProgress, precompute_reference_phonemes
+from bot.inference import inference_pool
+from bot.throttling import voice_admission
+from bot.ai_client import create_ai_client, close_ai_client
+from bot.ai_governor import ai_governor
+from bot.circuit_breaker import ai_breaker
 # Включаем логирование
 logging.basicConfig(
     level=logging.INFO,
@@ -41,6 +46,9 @@ async def main():
     user_progress = UserProgress()
     dp["user_progress"] = user_progress
 
+    # Лимиты на дорогие обработчики голосовых (флаг expensive): по пользователю и общий
+    dp.message.middleware(voice_admission)
+
     try:
         from bot.handlers.start import router as start_router
         from bot.handlers.lesson import router as lesson_router
@@ -355,11 +363,30 @@ async def main():
     logger.info("🤖 Бот запускается...")
     logger.info("🎯 Специализация: Английский для программистов и Data Science")
 
+    # Пул процессов для распознавания произношения, чтобы модель не блокировала event loop
+    inference_pool.start()
+    # Один клиент OpenAI с пулом соединений на всё время работы бота
+    if OPENAI_API_KEY:
+        create_ai_client()
+    warmup_task = None
+    if PRONUNCIATION_WARMUP:
+        # Модель грузится в фоне: текстовые блоки доступны сразу, не дожидаясь её
+        warmup_task = asyncio.create_task(inference_pool.warm_up())
+    # Эталонные фонемы для всех известных фраз готовятся в фоновом потоке
+    asyncio.get_running_loop().run_in_executor(None, precompute_reference_phonemes)
+
     try:
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
     finally:
+        if warmup_task and not warmup_task.done():
+            warmup_task.cancel()
+        inference_pool.shutdown()
+        user_statistics.flush()
+        print(f"DEBUG: Итоговые метрики очереди OpenAI: {ai_governor.stats()}")
+        print(f"DEBUG: Состояние предохранителя OpenAI: {ai_breaker.stats()}")
+        await close_ai_client()
         await bot.session.close()
 
 
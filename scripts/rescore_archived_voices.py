@@ -0,0 +1,218 @@
+"""
+Пакетная перепроверка архивных голосовых (media/archived_voices) текущим пайплайном произношения.
+
+Каждая запись распознаётся и оценивается заново так же, как в боте (evaluate_pronunciation),
+в пуле процессов на все ядра: модель загружается один раз на процесс.
+Результат — таблица по записям (старая и новая оценка, вердикт, длительности, задержка,
+фонемы) в parquet (если установлен pyarrow) или CSV. Удобно для проверки новых порогов,
+бэкенда модели или режима оценки (similarity / gop) на реальных записях.
+
+Текст задания берётся из <запись>.ogg.json, который бот пишет при архивации.
+Для старых записей без него текст восстанавливается по имени файла
+({user}_acc_{оценка}_%_{начало текста}[_{время}_{id сообщения}].ogg) среди слов и фраз уроков.
+
+Запуск:
+    python scripts/rescore_archived_voices.py
+    python scripts/rescore_archived_voices.py --scoring gop --workers 8 --output rescore_gop.parquet
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import re
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List
+
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import ARCHIVED_VOICES_PATH, DATA_PATH, PRONUNCIATION_SCORING
+
+# Необязательный хвост _ГГГГММДД_ЧЧММСС_<id сообщения> есть у записей, архивированных с метаданными
+LEGACY_NAME_RE = re.compile(r'^(?P<user_id>\d+)_acc_(?P<accuracy>\d+)_%_(?P<prefix>.*?)(?:_\d{8}_\d{6}_\d+)?\.ogg$')
+
+
+def _known_texts() -> List[str]:
+    """Слова блока произношения и фразы блока аудирования — тексты, которые может проверять бот."""
+    texts = []
+    with open(os.path.join(DATA_PATH, "2_pronouncing_words.json"), 'r', encoding='utf-8') as f:
+        texts.extend(item["english"] for item in json.load(f).get("words", []))
+    with open(os.path.join(DATA_PATH, "listening_phrases_it.json"), 'r', encoding='utf-8') as f:
+        texts.extend(item["phrase"] for item in json.load(f))
+    return texts
+
+
+def collect_clips(input_dir: str) -> List[Dict[str, Any]]:
+    """Находит записи и их метаданные (из .json рядом или из имени файла)."""
+    from bot.utils import _sanitize_filename
+
+    by_prefix: Dict[str, str] = {}
+    for text in _known_texts():
+        by_prefix.setdefault(_sanitize_filename(text)[:20], text)
+
+    clips, skipped = [], 0
+    for path in sorted(glob.glob(os.path.join(input_dir, "*.ogg"))):
+        metadata: Dict[str, Any] = {}
+        if os.path.exists(f"{path}.json"):
+            with open(f"{path}.json", 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        match = LEGACY_NAME_RE.match(os.path.basename(path))
+        if match:
+            metadata.setdefault("user_id", int(match["user_id"]))
+            metadata.setdefault("accuracy", float(match["accuracy"]))
+            metadata.setdefault("text", by_prefix.get(match["prefix"]))
+        if not metadata.get("text"):
+            skipped += 1
+            continue
+        clips.append({"path": path, **metadata})
+    if skipped:
+        print(f"Пропущено записей без известного текста: {skipped}")
+    return clips
+
+
+def _rescore_clip(clip: Dict[str, Any], scoring: str) -> Dict[str, Any]:
+    """Перепроверяет одну запись (выполняется в процессе пула)."""
+    from bot.audio_frontend import AudioRejectedError
+    from bot.utils import evaluate_pronunciation, get_reference_phrase, recognize_audio_sync, score_pronunciation_gop_sync
+
+    text = clip["text"]
+    reference = get_reference_phrase(text)
+    lower_threshold = reference.lower_threshold
+    row = {
+        "file": os.path.basename(clip["path"]),
+        "user_id": clip.get("user_id"),
+        "text": text,
+        "scoring": scoring,
+        "archived_accuracy": clip.get("accuracy"),
+        "lower_threshold": lower_threshold,
+        "accuracy": None,
+        "verdict": None,
+        "duration": None,
+        "speech_duration": None,
+        "latency_ms": None,
+        "expected_phonemes": None,
+        "user_phonemes": None,
+        "weak_words": None,
+        "error": None,
+    }
+
+    started = time.perf_counter()
+    try:
+        with open(clip["path"], 'rb') as f:
+            audio = f.read()
+        if scoring == "gop":
+            recognition = score_pronunciation_gop_sync(audio, reference.word_ipas)
+        else:
+            recognition = recognize_audio_sync(audio)
+        accuracy, verdict, _, expected_phonemes, user_phonemes, word_results = evaluate_pronunciation(
+            reference, recognition
+        )
+    except AudioRejectedError as e:
+        row["error"] = e.reason
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    else:
+        row.update({
+            "accuracy": accuracy,
+            "verdict": re.sub(r'<[^>]+>', '', verdict).strip(),
+            "duration": round(recognition["duration"], 3),
+            "speech_duration": round(recognition["speech_duration"], 3),
+            "expected_phonemes": expected_phonemes,
+            "user_phonemes": user_phonemes,
+            "weak_words": ",".join(r["word"] for r in word_results if r["accuracy"] < lower_threshold),
+        })
+    row["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return row
+
+
+def write_results(rows: List[Dict[str, Any]], output: str) -> str:
+    """Пишет таблицу в parquet (если есть pyarrow и расширение .parquet) или CSV; возвращает путь."""
+    if output.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            output = output[:-len(".parquet")] + ".csv"
+            print(f"pyarrow не установлен — результаты будут сохранены в CSV: {output}")
+        else:
+            pq.write_table(pa.Table.from_pylist(rows), output)
+            return output
+
+    import csv
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    return output
+
+
+def _print_summary(rows: List[Dict[str, Any]], elapsed: float):
+    scored = [row for row in rows if row["error"] is None]
+    print(f"\nЗаписей: {len(rows)}, оценено: {len(scored)}, ошибок/отклонено: {len(rows) - len(scored)}, "
+          f"время: {elapsed:.1f} с ({len(rows) / elapsed:.1f} записей/с)")
+    if not scored:
+        return
+    latencies = sorted(row["latency_ms"] for row in scored)
+    print(f"Средняя оценка: {statistics.mean(row['accuracy'] for row in scored):.1f}%, "
+          f"задержка p50/p95: {latencies[len(latencies) // 2]:.0f}/{latencies[int(0.95 * (len(latencies) - 1))]:.0f} мс")
+    deltas = [row["accuracy"] - row["archived_accuracy"] for row in scored if row["archived_accuracy"] is not None]
+    if deltas:
+        print(f"Изменение оценки относительно архива: среднее {statistics.mean(deltas):+.1f}, "
+              f"среднее по модулю {statistics.mean(abs(d) for d in deltas):.1f}")
+    verdicts: Dict[str, int] = {}
+    for row in scored:
+        verdicts[row["verdict"]] = verdicts.get(row["verdict"], 0) + 1
+    for verdict, count in sorted(verdicts.items(), key=lambda item: -item[1]):
+        print(f"  {verdict}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перепроверка архивных голосовых текущим пайплайном произношения")
+    parser.add_argument("--input-dir", default=ARCHIVED_VOICES_PATH)
+    parser.add_argument("--output", default="rescore_results.parquet", help=".parquet (нужен pyarrow) или .csv")
+    parser.add_argument("--scoring", choices=("similarity", "gop"), default=PRONUNCIATION_SCORING)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=1, help="Потоков torch на процесс")
+    parser.add_argument("--limit", type=int, help="Перепроверить только первые N записей")
+    args = parser.parse_args()
+
+    clips = collect_clips(args.input_dir)[:args.limit]
+    if not clips:
+        print(f"В {args.input_dir} нет записей для перепроверки")
+        return
+
+    # Эталонные транскрипции считаются заранее и попадают в кэш на диске,
+    # чтобы процессы пула не запускали eSpeak NG для одних и тех же текстов
+    from bot.utils import get_reference_phrase
+    for text in sorted({clip["text"] for clip in clips}):
+        get_reference_phrase(text)
+
+    from bot.inference import _init_worker
+
+    print(f"Перепроверка {len(clips)} записей ({args.scoring}), процессов: {args.workers}")
+    started = time.perf_counter()
+    rows = []
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.threads,)
+    ) as executor:
+        futures = [executor.submit(_rescore_clip, clip, args.scoring) for clip in clips]
+        for future in tqdm(as_completed(futures), total=len(futures), unit="запись"):
+            rows.append(future.result())
+    elapsed = time.perf_counter() - started
+
+    rows.sort(key=lambda row: row["file"])
+    output = write_results(rows, args.output)
+    _print_summary(rows, elapsed)
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
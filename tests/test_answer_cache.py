@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.answer_cache import TeacherAnswerCache
+
+
+def _cache(tmp_path) -> TeacherAnswerCache:
+    cache = TeacherAnswerCache(path=str(tmp_path / "teacher_answer_cache.json"))
+    cache.put("Когда использовать Present Simple?", "Для регулярных действий и фактов.")
+    cache.put("Как образуется отрицание в Past Simple?", "did not + глагол.")
+    return cache
+
+
+def test_same_question_is_served_from_cache(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.get("когда использовать present simple") == "Для регулярных действий и фактов."
+
+
+def test_longer_question_with_different_intent_misses(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.get("Когда использовать Present Simple с глаголами чувств, например love и hate?") is None
+
+
+def test_question_with_different_grammar_markers_misses(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.get("Когда использовать Present Continuous?") is None
+    assert cache.get("Как образуется отрицание в Present Simple?") is None